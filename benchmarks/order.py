@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the storage and latency of the NGramGraph for orders 1 to 4.
+
+Usage: python benchmarks/order.py [sentences]
+
+with the package installed or on the PYTHONPATH.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+from random import Random
+from time import time
+
+from mtj.markov.graph.ngram import NGramGraph
+from mtj.markov.model import sentence
+
+
+def corpus(count, vocabulary=2000, seed=0):
+    """
+    Generate count sentences with a zipf-like distribution of words.
+    """
+
+    rand = Random(seed)
+    words = ['w%d' % i for i in range(vocabulary)]
+    weights = [1.0 / (i + 1) for i in range(vocabulary)]
+    return [
+        ' '.join(rand.choices(words, weights, k=rand.randint(3, 20)))
+        for i in range(count)
+    ]
+
+
+def bench(order, text, samples=200, seed=0):
+    tempdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tempdir, 'graph.db')
+        # reproducible without patching the graph modules.
+        graph = NGramGraph(
+            'sqlite:///' + path, order=order, random=Random(seed).random)
+        graph.initialize()
+
+        start = time()
+        for raw in text:
+            graph.learn({sentence.Loader: raw})
+        learn_time = time() - start
+
+        timings = []
+        for i in range(samples):
+            start = time()
+            graph.generate({}, default=None)
+            timings.append(time() - start)
+        timings.sort()
+        graph.engine.dispose()
+
+        return {
+            'order': order,
+            'size_kb': os.path.getsize(path) / 1024.0,
+            'learn_ms': learn_time * 1000.0 / len(text),
+            'generate_p50_ms': timings[len(timings) // 2] * 1000.0,
+            'generate_p99_ms': timings[int(len(timings) * 0.99)] * 1000.0,
+        }
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def main(argv=sys.argv):
+    count = int(argv[1]) if len(argv) > 1 else 1000
+    text = corpus(count)
+    columns = (
+        'order', 'size_kb', 'learn_ms', 'generate_p50_ms', 'generate_p99_ms')
+    print(' '.join('%16s' % c for c in columns))
+    for order in range(1, 5):
+        result = bench(order, text)
+        print(' '.join('%16.2f' % result[c] for c in columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Command line tools for the graphs.
+"""
+
+from argparse import ArgumentParser
+from importlib import import_module
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import tracemalloc
+
+from sqlalchemy.engine.url import make_url
+
+from . import footprint
+from .model import sentence
+
+# the graph classes by name, imported when used.
+GRAPHS = {
+    'sentence': ('mtj.markov.graph.sentence', 'SentenceGraph'),
+    'xmpp': ('mtj.markov.graph.xmpp', 'XMPPGraph'),
+    'ngram': ('mtj.markov.graph.ngram', 'NGramGraph'),
+    'aggregate': ('mtj.markov.graph.aggregate', 'AggregateSentenceGraph'),
+    'aggregate-xmpp': ('mtj.markov.graph.aggregate', 'AggregateXMPPGraph'),
+}
+
+
+def load_graph(name, db_src):
+    module, cls = GRAPHS[name]
+    graph = getattr(import_module(module), cls)(db_src)
+    graph.initialize()
+    return graph
+
+
+def scratch_copy(db_src, tempdir):
+    """
+    Return the url of a copy of the sqlite database of db_src within
+    tempdir, for operations that should not change the original.
+    """
+
+    database = make_url(db_src).database
+    if not database or database == ':memory:':
+        # nothing to be kept.
+        return db_src
+    path = os.path.join(tempdir, 'scratch.db')
+    if os.path.exists(database):
+        source = sqlite3.connect('file:%s?mode=ro' % database, uri=True)
+        target = sqlite3.connect(path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+    return 'sqlite:///' + path
+
+
+def memory_report(args, out):
+    db_src = args.db_src
+    if args.learn:
+        # the samples are learned into a copy, not the given database.
+        tempdir = tempfile.mkdtemp()
+        db_src = scratch_copy(db_src, tempdir)
+    else:
+        tempdir = None
+
+    try:
+        _memory_report(args, db_src, out)
+    finally:
+        if tempdir is not None:
+            shutil.rmtree(tempdir)
+
+
+def _memory_report(args, db_src, out):
+    if args.trace:
+        # started before the graph is loaded for it to be accounted.
+        tracemalloc.start()
+    try:
+        graph = load_graph(args.graph, db_src)
+        report = footprint.memory_report(
+            graph,
+            learn=[{sentence.Loader: raw} for raw in args.learn],
+            generate=[{'word': word} for word in args.generate],
+        )
+    finally:
+        if args.trace:
+            tracemalloc.stop()
+
+    if args.json:
+        json.dump(report, out, indent=1, sort_keys=True)
+        out.write('\n')
+    else:
+        out.write(footprint.format_report(report) + '\n')
+
+
+def make_parser():
+    parser = ArgumentParser(prog='mtj-markov')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    report = commands.add_parser(
+        'memory-report', help='report the memory used by a graph')
+    report.add_argument('db_src', help='the database url of the graph')
+    report.add_argument(
+        '--graph', choices=sorted(GRAPHS), default='sentence',
+        help='the type of the graph (default: sentence)')
+    report.add_argument(
+        '--learn', action='append', default=[], metavar='SENTENCE',
+        help='measure learning the sentence, into a copy of the database')
+    report.add_argument(
+        '--generate', action='append', default=[], metavar='WORD',
+        help='measure generating from the word')
+    report.add_argument(
+        '--trace', action='store_true',
+        help='trace all allocations from the loading of the graph')
+    report.add_argument(
+        '--json', action='store_true', help='output the report as json')
+    report.set_defaults(func=memory_report)
+    return parser
+
+
+def main(argv=None, out=sys.stdout):
+    args = make_parser().parse_args(argv)
+    args.func(args, out)
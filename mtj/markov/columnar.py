@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar binary dumps of the tables of a graph.
+
+Every column of a table is written into its own file, integers as a
+packed array of little-endian signed 64-bit ints, and text or binary
+values as records of a little-endian unsigned 32-bit length followed by
+the raw bytes, with the maximum length marking a NULL.  A manifest lists
+the tables in the order they can be loaded in, along with the number of
+rows, and the type and the sha256 checksum of every column file.
+"""
+
+from array import array
+from hashlib import sha256
+import json
+import os
+import struct
+import sys
+
+from sqlalchemy.types import Integer
+from sqlalchemy.types import LargeBinary
+from sqlalchemy.types import String
+
+MANIFEST = 'manifest.json'
+FORMAT = 1
+
+# rows fetched and inserted at a time.
+CHUNK_SIZE = 10000
+# reads of the column files.
+BUFFER_SIZE = 1 << 16
+
+NULL_LENGTH = 0xffffffff
+length_struct = struct.Struct('<I')
+
+
+class ChecksumError(ValueError):
+    """
+    A column file does not match the checksum in the manifest.
+    """
+
+
+def column_type(column):
+    """
+    Return the name of the encoding for the column.
+    """
+
+    if isinstance(column.type, Integer):
+        return 'int'
+    if isinstance(column.type, String):
+        return 'text'
+    if isinstance(column.type, LargeBinary):
+        return 'bytes'
+    raise TypeError('unsupported type %r for column %s' % (
+        column.type, column))
+
+
+def column_filename(table, column):
+    return '%s.%s' % (table.name, column.name)
+
+
+class ColumnWriter(object):
+    """
+    Write the values of a column into the file at path, in chunks.
+    """
+
+    def __init__(self, path, type_):
+        self.stream = open(path, 'wb')
+        self.type = type_
+        self.hash = sha256()
+
+    def _write(self, raw):
+        self.stream.write(raw)
+        self.hash.update(raw)
+
+    def write(self, values):
+        if self.type == 'int':
+            if None in values:
+                raise ValueError('NULL is not supported for integers')
+            values = array('q', values)
+            if sys.byteorder != 'little':  # pragma: no cover
+                values.byteswap()
+            self._write(values.tobytes())
+            return
+
+        chunks = []
+        for value in values:
+            if value is None:
+                chunks.append(length_struct.pack(NULL_LENGTH))
+                continue
+            if self.type == 'text':
+                value = value.encode('utf8')
+            chunks.append(length_struct.pack(len(value)))
+            chunks.append(value)
+        self._write(b''.join(chunks))
+
+    def close(self):
+        self.stream.close()
+        return self.hash.hexdigest()
+
+
+def _read_ints(stream):
+    remainder = b''
+    while True:
+        raw = stream.read(BUFFER_SIZE)
+        if not raw:
+            break
+        raw = remainder + raw
+        end = len(raw) - len(raw) % 8
+        values = array('q')
+        values.frombytes(raw[:end])
+        if sys.byteorder != 'little':  # pragma: no cover
+            values.byteswap()
+        remainder = raw[end:]
+        for value in values:
+            yield value
+
+
+def _read_records(stream, text):
+    while True:
+        raw = stream.read(4)
+        if not raw:
+            break
+        length, = length_struct.unpack(raw)
+        if length == NULL_LENGTH:
+            yield None
+            continue
+        value = stream.read(length)
+        yield value.decode('utf8') if text else value
+
+
+def read_column(path, type_):
+    """
+    Generate the values of the column file at path.
+    """
+
+    with open(path, 'rb') as stream:
+        if type_ == 'int':
+            values = _read_ints(stream)
+        else:
+            values = _read_records(stream, type_ == 'text')
+        for value in values:
+            yield value
+
+
+def checksum(path):
+    digest = sha256()
+    with open(path, 'rb') as stream:
+        for raw in iter(lambda: stream.read(BUFFER_SIZE), b''):
+            digest.update(raw)
+    return digest.hexdigest()
+
+
+def export_tables(connection, tables, path):
+    """
+    Write the tables through the connection into the directory at path
+    as column files plus the manifest, and return the manifest.
+    """
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    manifest = {'format': FORMAT, 'tables': []}
+    for table in tables:
+        columns = list(table.columns)
+        writers = []
+        entry = {'name': table.name, 'rows': 0, 'columns': []}
+        for column in columns:
+            type_ = column_type(column)
+            filename = column_filename(table, column)
+            writers.append(
+                ColumnWriter(os.path.join(path, filename), type_))
+            entry['columns'].append({
+                'name': column.name, 'type': type_, 'file': filename})
+
+        result = connection.execute(
+            table.select().order_by(*table.primary_key.columns))
+        try:
+            while True:
+                rows = result.fetchmany(CHUNK_SIZE)
+                if not rows:
+                    break
+                entry['rows'] += len(rows)
+                for c, writer in enumerate(writers):
+                    writer.write([row[c] for row in rows])
+        finally:
+            for info, writer in zip(entry['columns'], writers):
+                info['sha256'] = writer.close()
+
+        manifest['tables'].append(entry)
+
+    with open(os.path.join(path, MANIFEST), 'w') as stream:
+        json.dump(manifest, stream, indent=1, sort_keys=True)
+    return manifest
+
+
+def read_manifest(path, verify=True):
+    """
+    Return the manifest of the export at path, after verifying the
+    checksums of all the column files.
+    """
+
+    with open(os.path.join(path, MANIFEST)) as stream:
+        manifest = json.load(stream)
+    if manifest.get('format') != FORMAT:
+        raise ValueError('unsupported export format %r' % (
+            manifest.get('format'),))
+
+    if verify:
+        for entry in manifest['tables']:
+            for info in entry['columns']:
+                if checksum(os.path.join(path, info['file'])) != (
+                        info['sha256']):
+                    raise ChecksumError(
+                        'checksum mismatch for %s' % info['file'])
+    return manifest
+
+
+def iter_rows(path, entry):
+    """
+    Generate the rows of the table entry from the manifest as dicts.
+    """
+
+    names = [info['name'] for info in entry['columns']]
+    columns = [
+        read_column(os.path.join(path, info['file']), info['type'])
+        for info in entry['columns']
+    ]
+    for values in zip(*columns):
+        yield dict(zip(names, values))
+
+
+def import_tables(connection, tables, path, manifest):
+    """
+    Bulk load the tables from the export at path through connection,
+    with their indexes dropped during the load and rebuilt after.
+    """
+
+    tables = {table.name: table for table in tables}
+    entries = [
+        entry for entry in manifest['tables'] if entry['name'] in tables]
+
+    indexes = [
+        index for entry in entries for index in tables[entry['name']].indexes]
+    for index in indexes:
+        index.drop(bind=connection)
+
+    for entry in entries:
+        table = tables[entry['name']]
+        insert = table.insert()
+        count = 0
+        chunk = []
+        for row in iter_rows(path, entry):
+            chunk.append(row)
+            if len(chunk) >= CHUNK_SIZE:
+                connection.execute(insert, chunk)
+                count += len(chunk)
+                chunk = []
+        if chunk:
+            connection.execute(insert, chunk)
+            count += len(chunk)
+        if count != entry['rows']:
+            raise ValueError('expected %d rows for %s but read %d' % (
+                entry['rows'], entry['name'], count))
+
+    for index in indexes:
+        index.create(bind=connection)
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+Report of the memory used by a loaded sqlite graph, broken down by its
+components.
+
+The allocations made through Python are measured with tracemalloc, when
+it is tracing.  The page cache of sqlite is allocated outside of Python,
+so it is estimated from the page statistics reported by PRAGMA instead,
+as the smaller of the cache limit and the size of the database for each
+of the pooled connections.
+"""
+
+from collections import defaultdict
+import gc
+import tracemalloc
+
+from sqlalchemy import text
+
+# the components allocations are attributed to by their source file.
+COMPONENTS = (
+    ('/sqlalchemy/', 'sqlalchemy'),
+    ('/mtj/markov/', 'mtj.markov'),
+    ('/sqlite3/', 'sqlite3'),
+)
+
+
+def component_of(filename):
+    filename = filename.replace('\\', '/')
+    for fragment, name in COMPONENTS:
+        if fragment in filename:
+            return name
+    return 'other'
+
+
+def _filtered(snapshot):
+    # exclude the memory of the tracing itself.
+    return snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__)])
+
+
+def pool_connections(pool):
+    """
+    Return the number of connections held open by the pool.
+    """
+
+    # SingletonThreadPool, the default for sqlite in memory, keeps one
+    # connection per thread.
+    connections = getattr(pool, '_all_conns', None)
+    if connections is not None:
+        return len(connections)
+    checkedin = getattr(pool, 'checkedin', None)
+    checkedout = getattr(pool, 'checkedout', None)
+    if checkedin is None or checkedout is None:
+        # NullPool, the default for sqlite files, holds none.
+        return 0
+    return checkedin() + checkedout()
+
+
+def sqlite_report(graph):
+    """
+    Return the page statistics of the sqlite database of the graph, and
+    the estimate of the size of the page cache.
+    """
+
+    with graph.engine.connect() as connection:
+        pragma = lambda name: connection.execute(
+            text('PRAGMA %s' % name)).scalar()
+        page_size = pragma('page_size')
+        page_count = pragma('page_count')
+        freelist_count = pragma('freelist_count')
+        cache_size = pragma('cache_size')
+
+    # a negative cache size is the limit in KiB rather than in pages.
+    cache_limit = (
+        -cache_size * 1024 if cache_size < 0 else cache_size * page_size)
+    database_bytes = page_size * page_count
+    connections = pool_connections(graph.engine.pool)
+    return {
+        'page_size': page_size,
+        'page_count': page_count,
+        'freelist_count': freelist_count,
+        'database_bytes': database_bytes,
+        'cache_limit_bytes': cache_limit,
+        'connections': connections,
+        'cache_bytes': min(cache_limit, database_bytes) * max(connections, 1),
+    }
+
+
+def pool_report(graph):
+    pool = graph.engine.pool
+    return {
+        'class': type(pool).__name__,
+        'connections': pool_connections(pool),
+        'status': pool.status(),
+    }
+
+
+def session_report(graph):
+    """
+    Return the number of objects held by the session of the current
+    thread, which is only reported if one was created.
+    """
+
+    registry = graph._Sessions.registry
+    if not registry.has():
+        return {'active': False, 'identity_map': 0, 'new': 0, 'dirty': 0}
+    session = registry()
+    return {
+        'active': True,
+        'identity_map': len(session.identity_map),
+        'new': len(session.new),
+        'dirty': len(session.dirty),
+    }
+
+
+def cache_report(graph):
+    word_filter = getattr(graph, 'word_filter', None)
+    return {
+        'models': len(graph.classes),
+        'tables': len(graph.model.metadata.tables),
+        'tenant_ids': len(getattr(graph, 'tenant_ids', ())),
+        'word_filter_bytes': (
+            0 if word_filter is None else len(word_filter.bits)),
+    }
+
+
+def object_report():
+    """
+    Return the number of objects tracked by the garbage collector for
+    each of the components, by the module of their type.
+    """
+
+    counts = defaultdict(int)
+    for obj in gc.get_objects():
+        module = getattr(type(obj), '__module__', None) or ''
+        if module.startswith('sqlalchemy'):
+            counts['sqlalchemy'] += 1
+        elif module.startswith('mtj.markov'):
+            counts['mtj.markov'] += 1
+    return dict(counts)
+
+
+def tracemalloc_report(limit=10):
+    """
+    Return the size of the memory traced for each component along with
+    the largest allocation sites, or None if tracemalloc is not tracing.
+    """
+
+    if not tracemalloc.is_tracing():
+        return None
+
+    snapshot = _filtered(tracemalloc.take_snapshot())
+    components = defaultdict(int)
+    stats = snapshot.statistics('filename')
+    for stat in stats:
+        components[component_of(stat.traceback[0].filename)] += stat.size
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        'current': current,
+        'peak': peak,
+        'components': dict(components),
+        'top': [
+            (str(stat.traceback[0]), stat.size)
+            for stat in snapshot.statistics('lineno')[:limit]
+        ],
+    }
+
+
+def allocation_delta(f, *a, **kw):
+    """
+    Return the result of calling f with the arguments, and the change in
+    the memory allocated through Python across the call, in total and by
+    component.  tracemalloc is started for the duration of the call if
+    it was not tracing already.
+    """
+
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        before = _filtered(tracemalloc.take_snapshot())
+        result = f(*a, **kw)
+        after = _filtered(tracemalloc.take_snapshot())
+    finally:
+        if started:
+            tracemalloc.stop()
+
+    components = defaultdict(int)
+    size = count = 0
+    for stat in after.compare_to(before, 'filename'):
+        size += stat.size_diff
+        count += stat.count_diff
+        components[component_of(stat.traceback[0].filename)] += (
+            stat.size_diff)
+    return result, {
+        'size': size, 'count': count, 'components': dict(components)}
+
+
+def operation_report(f, samples):
+    """
+    Return the mean allocation delta of calling f with each one of the
+    samples.
+    """
+
+    totals = {'size': 0, 'count': 0, 'components': defaultdict(int)}
+    for sample in samples:
+        result, delta = allocation_delta(f, sample)
+        totals['size'] += delta['size']
+        totals['count'] += delta['count']
+        for name, size in delta['components'].items():
+            totals['components'][name] += size
+
+    n = len(samples)
+    return {
+        'samples': n,
+        'size': totals['size'] // n,
+        'count': totals['count'] // n,
+        'components': {
+            name: size // n for name, size in totals['components'].items()},
+    }
+
+
+def memory_report(graph, learn=(), generate=()):
+    """
+    Return the breakdown of the memory used by the graph.  The tables in
+    learn are learned into the graph and the data in generate generated
+    from, for the mean allocation deltas of those operations.
+    """
+
+    learn = list(learn)
+    generate = list(generate)
+    operations = {}
+    if learn:
+        operations['learn'] = operation_report(graph.learn, learn)
+    if generate:
+        operations['generate'] = operation_report(
+            lambda data: graph.generate(data, None), generate)
+
+    return {
+        'sqlite': sqlite_report(graph),
+        'pool': pool_report(graph),
+        'sessions': session_report(graph),
+        'caches': cache_report(graph),
+        'objects': object_report(),
+        'tracemalloc': tracemalloc_report(),
+        'operations': operations,
+    }
+
+
+def format_report(report):
+    """
+    Return the report as lines of text.
+    """
+
+    lines = []
+
+    def section(name, values):
+        lines.append('%s:' % name)
+        for key in sorted(values):
+            value = values[key]
+            if isinstance(value, dict):
+                lines.append('  %s:' % key)
+                lines.extend(
+                    '    %s: %s' % (k, value[k]) for k in sorted(value))
+            elif isinstance(value, list):
+                lines.append('  %s:' % key)
+                lines.extend('    %s: %s' % item for item in value)
+            else:
+                lines.append('  %s: %s' % (key, value))
+
+    for name in ('sqlite', 'pool', 'sessions', 'caches', 'objects'):
+        section(name, report[name])
+    if report['tracemalloc'] is not None:
+        section('tracemalloc', report['tracemalloc'])
+    for name, values in sorted(report['operations'].items()):
+        section('operation %s' % name, values)
+    return '\n'.join(lines)
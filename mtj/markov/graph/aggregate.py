@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+from logging import getLogger
+
+from sqlalchemy import and_
+from sqlalchemy import func
+from sqlalchemy import select
+
+from ..utils import cumulative
+from ..utils import weighted_index
+
+from ..model import aggregate
+from ..model import xmpp
+from .base import FragmentRow
+from .sentence import SentenceGraph
+from .xmpp import XMPPGraph
+
+logger = getLogger(__name__)
+
+
+class AggregateSentenceGraph(SentenceGraph):
+    """
+    The graph of sentences, with repeated fragments aggregated into a
+    single weighted transition.
+
+    Chains are picked proportionally to the number of occurrences, so
+    the output distribution is the same as the SentenceGraph.
+    """
+
+    # whether to track the source sentences of transitions.
+    provenance = False
+
+    def initialize(self, modules=None, **kw):
+        local_modules = [aggregate]
+        if modules:
+            local_modules.extend(modules)
+
+        # skip over the SentenceGraph as the fragment model is replaced.
+        super(SentenceGraph, self).initialize(local_modules, **kw)
+
+        self.IndexWordTransition = self.classes['IndexWordTransition']
+        self.Transition = self.classes['Transition']
+        self.TransitionSentence = self.classes['TransitionSentence']
+        self.Sentence = self.classes['Sentence']
+        self.Word = self.classes['Word']
+
+    def quote(self, sentence_id, session=None):
+        # the positions of the words are not recorded.
+        raise ValueError('quotes not supported by aggregate graph')
+
+    def quote_condition(self, data, context):
+        raise ValueError('quotes not supported by aggregate graph')
+
+    def compute_stats(self, connection):
+        result = super(SentenceGraph, self).compute_stats(connection)
+        Transition = self.Transition
+        result.update(self.transition_stats(
+            connection, self.IndexWordTransition,
+            ([Transition.l_word_id, Transition.word_id],
+                Transition.r_word_id),
+            ([Transition.word_id, Transition.r_word_id],
+                Transition.l_word_id)))
+        return result
+
+    def length_bounds(self, data):
+        bounds = super(AggregateSentenceGraph, self).length_bounds(data)
+        if bounds is not None:
+            # the transitions are shared by sentences of varying length.
+            raise ValueError('length bounds not supported by aggregate graph')
+        return bounds
+
+    def scope(self, data):
+        sentence_ids = super(AggregateSentenceGraph, self).scope(data)
+        if sentence_ids is not None and not self.provenance:
+            # the restriction is applied through the provenance.
+            raise ValueError('scope not supported without provenance')
+        return sentence_ids
+
+    def _columns(self):
+        Transition = self.Transition
+        return [
+            Transition.id,
+            Transition.l_word_id,
+            Transition.word_id,
+            Transition.r_word_id,
+        ]
+
+    def _select(self, context, source, conditions):
+        """
+        Return a select of the transition columns plus its weight from
+        the source matching the conditions, with the weight summed over
+        the restricted sentences if the context has any bound.
+        """
+
+        Transition = self.Transition
+        sentence_ids = getattr(context, 'sentence_ids', None)
+        if sentence_ids is None:
+            return select(self._columns() + [Transition.count]).select_from(
+                source).where(and_(*conditions)).order_by(Transition.id)
+
+        TransitionSentence = self.TransitionSentence
+        return select(self._columns() + [
+            func.sum(TransitionSentence.count)]).select_from(
+                source.join(
+                    TransitionSentence.__table__,
+                    TransitionSentence.transition_id == Transition.id)
+            ).where(and_(
+                TransitionSentence.sentence_id.in_(sentence_ids),
+                *conditions
+            )).group_by(Transition.id).order_by(Transition.id)
+
+    def _pick(self, rows):
+        if not rows:
+            return None
+        totals = cumulative(row[-1] for row in rows)
+        if not totals[-1]:
+            return None
+        return rows[weighted_index(totals, self.random())]
+
+    def _entry_point(self, row):
+        return FragmentRow(row[0], None, row[1], row[2], row[3])
+
+    def pick_entry_point(self, data, context):
+        """
+        Return a Transition picked by the number of times the word
+        occurred within it.
+        """
+
+        # bind the restriction to the context for the chain queries.
+        context.sentence_ids = self.scope(data)
+
+        word = data.get('word')
+
+        if not word:
+            if context.sentence_ids is not None:
+                return self.pick_scoped_transition(data, context)
+            word = self.pick_word(context)
+
+        Transition = self.Transition
+        IndexWordTransition = self.IndexWordTransition
+        Word = self.Word
+        source = Transition.__table__.join(
+            IndexWordTransition.__table__,
+            IndexWordTransition.transition_id == Transition.id,
+        ).join(
+            Word.__table__, Word.id == IndexWordTransition.word_id,
+        )
+        condition = Word.word == self.entry_word(word, context)
+        rows = context.execute(
+            self._select(context, source, [condition])).fetchall()
+
+        row = self._pick(rows)
+        if row is None:
+            raise KeyError('no such word in chains')
+        return self._entry_point(row)
+
+    def pick_scoped_transition(self, data, context):
+        """
+        Return a Transition picked by the number of times it occurred
+        within the scope bound to the context.
+        """
+
+        rows = context.execute(self._select(
+            context, self.Transition.__table__, [])).fetchall()
+        row = self._pick(rows)
+        if row is None:
+            raise KeyError('no transitions within scope')
+        return self._entry_point(row)
+
+    def _query_chain(self, data, fragment, s_word_id, t_word_id, context):
+        Transition = self.Transition
+        conditions = [
+            Transition.word_id == getattr(fragment, t_word_id),
+            getattr(Transition, s_word_id) == fragment.word_id,
+        ]
+        closing = self.closing_condition(Transition, t_word_id, context)
+        if closing is not None:
+            conditions.append(closing)
+        rows = context.execute(self._select(
+            context, Transition.__table__, conditions)).fetchall()
+        return self._pick(rows)
+
+
+class AggregateXMPPGraph(AggregateSentenceGraph):
+    """
+    The aggregated graph of sentences with XMPP metadata.
+    """
+
+    provenance = True
+
+    def initialize(self, modules=None, **kw):
+        local_modules = [xmpp]
+        if modules:
+            local_modules.extend(modules)
+
+        super(AggregateXMPPGraph, self).initialize(local_modules, **kw)
+
+        self.JID = self.classes['JID']
+        self.Muc = self.classes['Muc']
+        self.Nickname = self.classes['Nickname']
+        self.XMPPLog = self.classes['XMPPLog']
+
+    # the sentences are scoped by the same log.
+    scope = XMPPGraph.scope
@@ -1,32 +1,166 @@
 # -*- coding: utf-8 -*-
+from hashlib import sha1
 from logging import getLogger
+from threading import local
+from time import perf_counter
 from time import time
-from random import random
 
 from sqlalchemy import create_engine
+from sqlalchemy import event
 from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy import text
 from sqlalchemy.orm import scoped_session
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.exc import SQLAlchemyError
 
+from .. import columnar
+from .. import merge
+from ..utils import ThreadLocalRandom
 # from ..exc import HandledError
 
 from ..model import base
 
 logger = getLogger(__name__)
 
+# Policies for the handling of repeated data, for the dedup argument.
+# Repeats are only recorded as a reference to the existing datum.
+DEDUP_IGNORE = 'ignore'
+# Repeats are also loaded again against the existing datum, such that
+# they still count as extra weight.
+DEDUP_WEIGHT = 'weight'
 
-class Session(object):
 
-    def __init__(self, session):
+def _driver_autocommit(dbapi_connection, connection_record):
+    # pysqlite only begins a transaction before a write, so the reads
+    # of a snapshot must have their transaction begun explicitly.
+    dbapi_connection.isolation_level = None
+
+
+def _begin(connection):
+    connection.execute(text('BEGIN'))
+
+
+class Context(object):
+    """
+    The state of a single generate call, passed along in place of the
+    session to the methods that make up the generation.  Additional
+    state, such as restrictions set up by the entry point, can be
+    assigned as attributes.
+    """
+
+    # the perf_counter time by which the walk should close the chain.
+    deadline = None
+    # whether the walk is only taking steps that end the chain.
+    closing = False
+    # whether the walk was cut short at the deadline.
+    truncated = False
+
+    def __init__(self, session, data, **kw):
         self.session = session
+        self.data = data
+        self.__dict__.update(kw)
+
+    def expired(self):
+        return self.deadline is not None and perf_counter() >= self.deadline
+
+    def execute(self, statement):
+        return self.session.execute(statement)
+
+
+class Chain(list):
+    """
+    The states of a generated chain.
+    """
+
+    truncated = False
+
+
+class Generated(str):
+    """
+    The generated text, which records whether the walk was cut short at
+    the deadline.
+    """
 
-    def __getattr__(self, name):
-        if hasattr(self.session, name):
-            return getattr(self.session, name)
-        return super(Session, self).__getattr__(name)
+    def __new__(cls, value='', truncated=False):
+        self = str.__new__(cls, value)
+        self.truncated = truncated
+        return self
+
+
+class FragmentRow(base.StateTransition):
+    """
+    A lightweight fragment, built from the plain columns of a row.
+    """
+
+    __slots__ = (
+        'id', 'sentence_id', 'l_word_id', 'word_id', 'r_word_id',
+        'l_dist', 'r_dist',
+    )
+
+    def __init__(self, id, sentence_id, l_word_id, word_id, r_word_id,
+                 l_dist=None, r_dist=None):
+        self.id = id
+        self.sentence_id = sentence_id
+        self.l_word_id = l_word_id
+        self.word_id = word_id
+        self.r_word_id = r_word_id
+        self.l_dist = l_dist
+        self.r_dist = r_dist
+
+    def list_states(self):
+        return (
+            self.l_word_id,
+            self.word_id,
+            self.r_word_id,
+        )
+
+    def end(self, direction):
+        """
+        Return the fragment to continue the chain from in direction.
+        """
+
+        return self
+
+
+class FragmentPath(base.StateTransition):
+    """
+    A run of consecutive fragments from a single sentence.
+    """
+
+    __slots__ = ('fragments',)
+
+    def __init__(self, fragments):
+        self.fragments = list(fragments)
+
+    def list_states(self):
+        fragments = self.fragments
+        return tuple(
+            [fragments[0].l_word_id] +
+            [fragment.word_id for fragment in fragments] +
+            [fragments[-1].r_word_id]
+        )
+
+    def end(self, direction):
+        if direction == 'lr':
+            return self.fragments[-1]
+        return self.fragments[0]
+
+
+def lookup_raw(table, loader):
+    """
+    Return the raw data for the loader from the table, which is keyed by
+    the loader classes.  Data keyed by a parent class of the loader is
+    also accepted, so that specialized loaders can be dropped in.
+    """
+
+    for cls in type(loader).__mro__:
+        if cls in table:
+            return table[cls]
+    raise KeyError(type(loader))
 
 
 class SqliteStateGraph(base.StateGraph):
@@ -34,11 +168,28 @@ class SqliteStateGraph(base.StateGraph):
     Generic sqlite state graph implementation
     """
 
-    def __init__(self, db_src='sqlite://', **kw):
+    def __init__(self, db_src='sqlite://', dedup=None, random=None,
+                 metrics=None, snapshot=None, **kw):
         self.model = declarative_base(name=type(self).__name__)
         self.classes = {}
         self.db_src = db_src
         self.loaders = []
+        # the policy for repeated data, dedup is disabled if None.
+        self.dedup = dedup
+        # the callable returning random numbers in [0, 1) for generation.
+        self.random = ThreadLocalRandom() if random is None else random
+        # the model for the tenants, if the graph supports them.
+        self.Tenant = None
+        # the ids of the known tenants by their name.
+        self.tenant_ids = {}
+        # the GraphMetrics to record learn and generate into, if any.
+        self.metrics = metrics
+        # the seconds the results of stats are reused for.
+        self.stats_ttl = 300
+        self._stats = None
+        # the seconds generation keeps reading from the same snapshot
+        # for, or None to always read the latest data.
+        self.snapshot = snapshot
 
     def initialize(self, modules, **kw):
         self.engine = create_engine(self.db_src, **kw)
@@ -66,37 +217,329 @@ class SqliteStateGraph(base.StateGraph):
                         self.State = cls
                     elif issubclass(cls, base.Datum):
                         self.Datum = cls
+                    elif issubclass(cls, base.Digest):
+                        self.Digest = cls
+                    elif issubclass(cls, base.Tenant):
+                        self.Tenant = cls
                 elif issubclass(basecls, base.Loader):
                     self.loaders.append(basecls(self))
 
         self.model.metadata.create_all(self.engine)
         self._Sessions = scoped_session(sessionmaker(bind=self.engine))
+        if self.snapshot is not None:
+            self._initialize_snapshot(**kw)
+
+    def _initialize_snapshot(self, **kw):
+        database = self.engine.url.database
+        if not database or database == ':memory:':
+            raise ValueError('snapshot requires a database file')
+
+        with self.engine.connect() as connection:
+            # the write ahead log lets the readers keep their snapshot
+            # without blocking the writer.
+            connection.execute(text('PRAGMA journal_mode=WAL'))
+
+        self.snapshot_engine = create_engine(self.db_src, **kw)
+        event.listen(self.snapshot_engine, 'connect', _driver_autocommit)
+        event.listen(self.snapshot_engine, 'begin', _begin)
+        self._Snapshots = sessionmaker(bind=self.snapshot_engine)
+        self._snapshots = local()
 
     def _sessions(self):
-        return Session(self._Sessions())
+        return self._Sessions()
+
+    def _read_session(self):
+        """
+        Return the session for generation.  In snapshot mode this is the
+        session of the thread, which keeps its read transaction open
+        until the snapshot is older than the snapshot seconds.
+        """
+
+        if self.snapshot is None:
+            return self._sessions()
+
+        state = self._snapshots
+        session = getattr(state, 'session', None)
+        now = time()
+        if session is None:
+            session = state.session = self._Snapshots()
+            state.started = now
+        elif now - state.started >= self.snapshot:
+            # the next read begins the new snapshot.
+            session.rollback()
+            state.started = now
+        return session
+
+    def _end_read(self, session):
+        if self.snapshot is None:
+            session.rollback()
+
+    def refresh_snapshot(self):
+        """
+        Move the snapshot of the current thread to the latest data.
+        """
+
+        session = getattr(self._snapshots, 'session', None)
+        if session is not None:
+            session.rollback()
+            self._snapshots.started = time()
+
+    def reset_snapshots(self):
+        """
+        Drop the snapshots of all threads, i.e. in a forked process
+        where the connections belong to the parent.
+        """
+
+        if self.snapshot is not None:
+            self._snapshots = local()
+            self.snapshot_engine.dispose()
+
+    def digest(self, table):
+        """
+        Return the combined digest of the data in the table produced by
+        the loaders, or None if none of them provided one.
+        """
+
+        digests = [
+            loader.digest(lookup_raw(table, loader)) for loader in self.loaders]
+        digests = [d for d in digests if d is not None]
+        if not digests:
+            return None
+        if len(digests) == 1:
+            return digests[0]
+        return sha1(u'\0'.join(digests).encode('utf8')).hexdigest()
+
+    def lookup_tenant_id(self, tenant, session, create=False):
+        """
+        Return the id of the named tenant, 0 for the default tenant
+        which is None, creating the tenant if create.  KeyError is
+        raised for an unknown tenant.
+        """
+
+        if tenant is None:
+            return 0
+        if self.Tenant is None:
+            raise ValueError('tenants not supported')
+
+        tenant_id = self.tenant_ids.get(tenant)
+        if tenant_id is not None:
+            return tenant_id
+
+        if create:
+            found = self.Tenant.unique_merge(session, tenant)
+            # the id is required for the data of the tenant; it is only
+            # remembered once committed.
+            session.flush()
+            return found.id
+
+        tenant_id = session.execute(select([self.Tenant.id]).where(
+            self.Tenant.value == tenant)).scalar()
+        if tenant_id is None:
+            raise KeyError('no such tenant')
+        self.tenant_ids[tenant] = tenant_id
+        return tenant_id
+
+    def tenant(self, name):
+        """
+        Return the view of the named tenant of this graph, which learns
+        and generates in isolation from the other tenants while sharing
+        the engine, the models and the states.
+        """
+
+        if self.Tenant is None:
+            raise ValueError('tenants not supported')
+        return TenantGraph(self, name)
+
+    def lookup_datum_by_digest(self, digest, session):
+        """
+        Return the existing Datum with the digest, or None.
+        """
+
+        found = session.query(self.Digest).filter(
+            self.Digest.digest == digest).first()
+        return found and found.datum
+
+    def export(self, path):
+        """
+        Write all the tables of the graph into the directory at path as
+        column files, see the columnar module, and return the manifest.
+        """
+
+        with self.engine.connect() as connection:
+            # a single transaction for a consistent copy.
+            with connection.begin():
+                return columnar.export_tables(
+                    connection, self.model.metadata.sorted_tables, path)
+
+    def import_(self, path):
+        """
+        Bulk load the export at path into this graph, which must be
+        empty, after verifying the checksums of the export.
+        """
+
+        manifest = columnar.read_manifest(path)
+        tables = self.model.metadata.sorted_tables
+        with self.engine.begin() as connection:
+            for table in tables:
+                if connection.execute(
+                        select([1]).select_from(table).limit(1)).first():
+                    raise ValueError(
+                        'cannot import into non-empty table %s' % table.name)
+            columnar.import_tables(connection, tables, path, manifest)
+        self.bulk_loaded()
+
+    def merge_from(self, other):
+        """
+        Merge all the data from the other graph database, either as the
+        path to the sqlite file or as the graph itself, into this graph,
+        and return the offsets the ids of the tables were shifted by.
+        """
+
+        engine = getattr(other, 'engine', None)
+        path = other if engine is None else engine.url.database
+        if not path or path == ':memory:':
+            raise ValueError('can only merge from a database file')
+
+        connection = self.engine.connect()
+        try:
+            connection.execute(text(
+                'ATTACH DATABASE :path AS %s' % merge.SCHEMA), path=path)
+            try:
+                with connection.begin():
+                    offsets = merge.merge_tables(
+                        connection, self.model.metadata.sorted_tables,
+                        self.classes)
+            finally:
+                connection.execute(text('DETACH DATABASE %s' % merge.SCHEMA))
+        finally:
+            connection.close()
+        self.bulk_loaded()
+        return offsets
+
+    def stats(self, refresh=False):
+        """
+        Return the statistics of the graph, computed by compute_stats,
+        reusing the previous results for up to stats_ttl seconds unless
+        refresh.
+        """
+
+        now = time()
+        cached = self._stats
+        if (not refresh and cached is not None and
+                now - cached[0] < self.stats_ttl):
+            return cached[1]
+
+        with self.engine.connect() as connection:
+            # a single transaction for consistent numbers.
+            with connection.begin():
+                result = self.compute_stats(connection)
+        self._stats = (now, result)
+        return result
+
+    def compute_stats(self, connection):
+        """
+        Return the number of rows and the bytes used for every table,
+        with the bytes being None if sqlite was built without dbstat.
+        """
+
+        try:
+            sizes = dict(connection.execute(text(
+                'SELECT name, SUM(pgsize) FROM dbstat GROUP BY name')
+            ).fetchall())
+        except OperationalError:
+            sizes = {}
+
+        tables = {}
+        for table in self.model.metadata.sorted_tables:
+            tables[table.name] = {
+                'rows': connection.execute(
+                    select([func.count()]).select_from(table)).scalar(),
+                'bytes': sizes.get(table.name),
+                'index_bytes': sum(
+                    sizes.get(index.name) or 0 for index in table.indexes
+                ) if sizes else None,
+            }
+        return {'tables': tables}
+
+    def bulk_loaded(self):
+        """
+        Called after data was loaded into the tables in bulk, bypassing
+        the loaders.
+        """
+
+    def learn(self, table, tenant=None):
+        """
+        Learn the table, returning the error that was handled if the
+        learning failed, otherwise None.
+        """
+
+        if self.metrics is None:
+            return self._learn(table, tenant)
+        start = perf_counter()
+        error = self._learn(table, tenant)
+        self.metrics.learned(perf_counter() - start, error)
+        return error
+
+    def _learn(self, table, tenant=None):
+        """
+        Learn the table, returning the error that was handled if the
+        learning failed.
+        """
+
+        if tenant is not None and self.Tenant is None:
+            raise ValueError('tenants not supported')
 
-    def learn(self, table):
         try:
             session = self._sessions()
-        except Exception:
+        except Exception as e:
             logger.exception('Unexpected error')
-            return
+            return e
 
+        datum = None
         try:
-            datum = self.Datum()
+            tenant_id = self.lookup_tenant_id(tenant, session, create=True)
+            digest = None
+            repeat = None
+            if self.dedup:
+                digest = self.digest(table)
+            if digest is not None and tenant is not None:
+                # repeats are only detected within the same tenant.
+                digest = sha1((u'%s\0%s' % (
+                    tenant, digest)).encode('utf8')).hexdigest()
+            if digest is not None:
+                repeat = self.lookup_datum_by_digest(digest, session)
+
+            if repeat is None:
+                datum = self.Datum()
+                datum.tenant_id = tenant_id
+            else:
+                logger.debug('learning repeated datum: %s', repeat)
+                datum = repeat
+
             for loader in self.loaders:
-                raw = table[type(loader)]
+                raw = lookup_raw(table, loader)
+                if (repeat is not None and self.dedup != DEDUP_WEIGHT and
+                        loader.digest(raw) is not None):
+                    # only reference the existing datum.
+                    continue
                 session.add(datum)
                 loader(session, raw, datum, **self.classes)
+
+            if digest is not None and repeat is None:
+                session.add(self.Digest(digest, datum))
         except SQLAlchemyError as e:
             logger.exception(
                 'SQLAlchemy Error while learning: %s', datum)
             session.rollback()
+            return e
         except Exception as e:
             logger.exception('Unexpected error')
             session.rollback()
+            return e
         else:
             session.commit()
+            if tenant is not None:
+                self.tenant_ids[tenant] = tenant_id
 
     def lookup_states_by_ids(self, state_ids, session=None):
         """
@@ -109,7 +552,7 @@ class SqliteStateGraph(base.StateGraph):
         return {state.id: state for state in (session.query(self.State).filter(
             self.State.id.in_(state_ids)).all())}
 
-    def pick_entry_point(self, data, session):
+    def pick_entry_point(self, data, context):
         """
         Return an entry point based on data.
 
@@ -118,7 +561,7 @@ class SqliteStateGraph(base.StateGraph):
 
         raise NotImplementedError
 
-    def follow_chain(self, data, fragment, direction, session=None):
+    def follow_chain(self, data, fragment, direction, context=None):
         """
         Follow the fragments for the list of word ids that will make a
         markov chain.
@@ -130,32 +573,137 @@ class SqliteStateGraph(base.StateGraph):
 
         raise NotImplementedError
 
+    def iter_chain(self, data, fragment, direction, context=None):
+        """
+        Generate the state ids of the chain outwards in direction as
+        they are followed.  Implementations that can follow the chain
+        one step at a time should override this.
+        """
+
+        result = self.follow_chain(data, fragment, direction, context)
+        if direction == 'rl':
+            result = reversed(result)
+        return iter(result)
+
+    def _context(self, session, data):
+        context = Context(session, data, tenant_id=self.lookup_tenant_id(
+            data.get('tenant'), session))
+        if data.get('deadline') is not None:
+            context.deadline = perf_counter() + data['deadline']
+        return context
+
     def _generate(self, data):
         # XXX different from parent definition.
-        session = self._sessions()
+        session = self._read_session()
         try:
-            entry_point = self.pick_entry_point(data, session)
+            context = self._context(session, data)
+            entry_point = self.pick_entry_point(data, context)
 
-            lhs = self.follow_chain(data, entry_point, 'rl', session)
+            lhs = self.follow_chain(data, entry_point, 'rl', context)
             c = list(entry_point.list_states())
-            rhs = self.follow_chain(data, entry_point, 'lr', session)
+            rhs = self.follow_chain(data, entry_point, 'lr', context)
 
             state_ids = lhs + c + rhs
             states = self.lookup_states_by_ids(state_ids, session)
-            return (states[state_id] for state_id in state_ids)
+            result = Chain(states[state_id] for state_id in state_ids)
+            result.truncated = context.truncated
+            return result
         finally:
-            session.rollback()
+            self._end_read(session)
+
+    def _generate_iter(self, data):
+        session = self._read_session()
+        try:
+            context = self._context(session, data)
+            entry_point = self.pick_entry_point(data, context)
+
+            # the left hand side must be complete before the first state.
+            state_ids = self.follow_chain(data, entry_point, 'rl', context)
+            state_ids.extend(entry_point.list_states())
+            states = self.lookup_states_by_ids(state_ids, session)
+            for state_id in state_ids:
+                yield states[state_id]
+
+            for state_id in self.iter_chain(data, entry_point, 'lr', context):
+                if state_id not in states:
+                    states.update(
+                        self.lookup_states_by_ids([state_id], session))
+                yield states[state_id]
+        finally:
+            self._end_read(session)
+
+    def generate_iter(self, data):
+        """
+        Generate the states of a chain as soon as they are known, such
+        that the consumer can start on the output early, or stop before
+        the rest of the chain is followed.  KeyError is raised from the
+        first iteration if nothing can be generated from data.
+        """
+
+        data_ = {}
+        data_.update(data)
+        return self._generate_iter(data_)
+
+    def generate(self, data, default=NotImplemented, deadline=None):
+        """
+        Generate from data.  With a deadline in seconds, the walk stops
+        once it has taken that long, after a final step to the end of
+        the chain if there is one, and the result has truncated set if
+        there is not.
+        """
 
-    def generate(self, data, default=NotImplemented):
         # XXX different from parent definition.
+        metrics = self.metrics
+        if metrics is not None:
+            start = perf_counter()
+        error = None
         try:
             data_ = {}
             data_.update(data)
+            if deadline is not None:
+                data_['deadline'] = deadline
             logger.debug('generate begin')
             return self._generate(data_)
-        except KeyError:
+        except KeyError as e:
+            error = e
             if default is NotImplemented:
                 raise
             return default
+        except Exception as e:
+            error = e
+            raise
         finally:
+            if metrics is not None:
+                metrics.generated(data, perf_counter() - start, error)
             logger.debug('generate end')
+
+
+class TenantGraph(object):
+    """
+    The view of a single tenant of a graph, which only holds the name
+    of the tenant such that it is cheap to have many of these.
+    """
+
+    __slots__ = ('graph', 'name')
+
+    def __init__(self, graph, name):
+        self.graph = graph
+        self.name = name
+
+    def learn(self, table):
+        return self.graph.learn(table, tenant=self.name)
+
+    def _data(self, data):
+        data_ = {}
+        data_.update(data)
+        data_['tenant'] = self.name
+        return data_
+
+    def generate(self, data, default=NotImplemented, deadline=None):
+        return self.graph.generate(self._data(data), default, deadline)
+
+    def generate_iter(self, data):
+        return self.graph.generate_iter(self._data(data))
+
+    def random_quote(self, data, default=NotImplemented):
+        return self.graph.random_quote(self._data(data), default)
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+Key-value store backed state graph.
+
+Everything lives inside a stdlib dbm database, so the graph does not
+have to fit in memory.  The keys are:
+
+- ``w`` + word: the word id for the word.
+- ``i`` + word id: the word for the word id.
+- ``>`` + (word_id, r_word_id): the ids of the words that follow.
+- ``<`` + (l_word_id, word_id): the ids of the words that precede.
+- ``x`` + word_id: entry points, as flattened (l, w, r) word id triples
+  for every fragment with word_id (normalized) in the middle.
+- ``#words``, ``#sentences``: the counters.
+
+All ids and lists are encoded as little-endian unsigned 32-bit ints.
+The lists are split into chunks of chunk_size ids, such that learning
+only rewrites the last chunk of a list rather than the whole of it,
+which would be quadratic in the size of the common keys:
+
+- key: the last chunk, with fewer than chunk_size ids.
+- key + ``\0``: the number of the full chunks before it.
+- key + ``\0`` + n: the n-th full chunk.
+
+Following a chain thus costs at most three reads per hop.
+"""
+
+from logging import getLogger
+import dbm
+
+from ..utils import ThreadLocalRandom
+from ..utils import nchain
+from ..utils import pack_ids as encode
+from ..utils import unpack_ids as decode
+from ..word import normalize
+
+from ..model import base
+from ..model import sentence
+from .base import FragmentRow
+
+logger = getLogger(__name__)
+
+
+class DbmSentenceGraph(base.StateGraph):
+    """
+    The graph of sentences, stored inside a dbm database.
+    """
+
+    # the number of ids in a full chunk of a list, a multiple of the
+    # width of the entry point triples.
+    chunk_size = 768
+
+    def __init__(self, db_src, min_sentence_length=1, max_chain_distance=50,
+                 normalize=normalize, random=None, **kw):
+        self.db_src = db_src
+        # the callable returning random numbers in [0, 1) for generation.
+        self.random = ThreadLocalRandom() if random is None else random
+        self.min_sentence_length = min_sentence_length
+        self.max_chain_distance = max_chain_distance
+        self.normalize = normalize
+
+    def initialize(self, flag='c', **kw):
+        self.db = dbm.open(self.db_src, flag, **kw)
+
+    def close(self):
+        self.db.close()
+
+    def _append(self, key, ids):
+        """
+        Append the ids to the list of the key, moving the full chunks
+        out of the last one.
+        """
+
+        db = self.db
+        size = self.chunk_size * 4
+        tail = db.get(key, b'') + encode(ids)
+        if len(tail) >= size:
+            count_key = key + b'\0'
+            chunks = decode(db.get(count_key, b''))
+            chunk = chunks[0] if chunks else 0
+            while len(tail) >= size:
+                db[count_key + encode((chunk,))] = tail[:size]
+                tail = tail[size:]
+                chunk += 1
+            db[count_key] = encode((chunk,))
+        db[key] = tail
+
+    def _pick(self, key, width=1):
+        """
+        Return width ids at a random offset of the list of the key that
+        is a multiple of width, or an empty list if there are none.
+        """
+
+        db = self.db
+        tail = db.get(key, b'')
+        chunks = decode(db.get(key + b'\0', b''))
+        chunks = chunks[0] if chunks else 0
+        count = (chunks * self.chunk_size + len(tail) // 4) // width
+        if not count:
+            return []
+        chunk, offset = divmod(
+            int(self.random() * count) * width, self.chunk_size)
+        if chunk < chunks:
+            tail = db[key + b'\0' + encode((chunk,))]
+        return list(decode(tail[offset * 4:(offset + width) * 4]))
+
+    def _count(self, name):
+        return decode(self.db.get(b'#' + name, b''))
+
+    def _word_count(self):
+        counter = self._count(b'words')
+        return counter[0] if counter else 0
+
+    def _lookup_word_id(self, word):
+        raw = self.db.get(b'w' + word.encode('utf8'))
+        return None if raw is None else decode(raw)[0]
+
+    def lookup_states_by_ids(self, state_ids, session=None):
+        """
+        Return all words associated with the list of word_ids
+        """
+
+        results = {}
+        for state_id in state_ids:
+            raw = self.db.get(b'i' + encode((state_id,)))
+            if raw is not None:
+                results[state_id] = raw.decode('utf8')
+        return results
+
+    def _learn_sentence(self, raw):
+        source = raw.split()
+        if len(source) < self.min_sentence_length:
+            return None
+
+        db = self.db
+        words = [''] + source + ['']
+        word_ids = {}
+        word_count = self._word_count()
+
+        def merge(word):
+            if word in word_ids:
+                return word_count
+            word_id = self._lookup_word_id(word)
+            if word_id is None:
+                word_id = word_count
+                db[b'w' + word.encode('utf8')] = encode((word_id,))
+                db[b'i' + encode((word_id,))] = word.encode('utf8')
+            word_ids[word] = word_id
+            return max(word_count, word_id + 1)
+
+        for word in words:
+            word_count = merge(word)
+            word_count = merge(self.normalize(word))
+
+        # collect all the appends for the keys before writing them out,
+        # so every key is only rewritten once per sentence.
+        appends = {}
+        for l_word, word, r_word in nchain(3, words):
+            l, w, r = word_ids[l_word], word_ids[word], word_ids[r_word]
+            appends.setdefault(b'>' + encode((l, w)), []).append(r)
+            appends.setdefault(b'<' + encode((w, r)), []).append(l)
+            appends.setdefault(b'x' + encode(
+                (word_ids[self.normalize(word)],)), []).extend((l, w, r))
+
+        for key, ids in appends.items():
+            self._append(key, ids)
+
+        sentences = self._count(b'sentences')
+        sentence_id = sentences[0] if sentences else 0
+        db[b'#sentences'] = encode((sentence_id + 1,))
+        db[b'#words'] = encode((word_count,))
+        return sentence_id
+
+    def learn(self, table):
+        try:
+            return self._learn_sentence(table[sentence.Loader])
+        except Exception:
+            logger.exception('Unexpected error')
+
+    def pick_word(self, session=None):
+        # the empty word is always assigned the first id.
+        count = self._word_count() - 1
+        if count < 1:
+            raise KeyError('no words in graph')
+
+        index = int(self.random() * count) + 1
+        return self.normalize(self.lookup_states_by_ids([index])[index])
+
+    def pick_entry_point(self, data, session=None):
+        """
+        Return a FragmentRow based on arguments, which can serve as the
+        starting value for the generate method.
+        """
+
+        word = data.get('word')
+
+        if not word:
+            word = self.pick_word(session)
+
+        word_id = self._lookup_word_id(self.normalize(word))
+        triple = (
+            self._pick(b'x' + encode((word_id,)), 3)
+            if word_id is not None else ()
+        )
+
+        if not triple:
+            raise KeyError('no such word in chains')
+
+        return FragmentRow(None, None, *triple)
+
+    def follow_chain(self, data, fragment, direction, session=None):
+        """
+        Follow the fragments for the list of word ids that will make a
+        markov chain.
+
+        direction, either
+        - 'lr', left to right
+        - 'rl', right to left
+        """
+
+        if direction == 'lr':
+            prefix = b'>'
+            a, b = fragment.word_id, fragment.r_word_id
+        else:
+            prefix = b'<'
+            a, b = fragment.l_word_id, fragment.word_id
+
+        result = []
+        for c in range(self.max_chain_distance):
+            candidate = self._pick(prefix + encode((a, b)))
+            if not candidate:
+                break
+            word_id = candidate[0]
+            result.append(word_id)
+            if direction == 'lr':
+                a, b = b, word_id
+            else:
+                a, b = word_id, a
+
+        if direction == 'rl':
+            result.reverse()
+        return result
+
+    def _generate(self, data):
+        entry_point = self.pick_entry_point(data)
+
+        lhs = self.follow_chain(data, entry_point, 'rl')
+        c = list(entry_point.list_states())
+        rhs = self.follow_chain(data, entry_point, 'lr')
+
+        state_ids = lhs + c + rhs
+        words = self.lookup_states_by_ids(set(state_ids))
+        return ' '.join(words[i] for i in state_ids).strip()
+
+    def generate(self, data, default=NotImplemented):
+        try:
+            data_ = {}
+            data_.update(data)
+            logger.debug('generate begin')
+            return self._generate(data_)
+        except KeyError:
+            if default is NotImplemented:
+                raise
+            return default
+        finally:
+            logger.debug('generate end')
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+"""
+Pure in-memory state graphs.
+
+These follow the same learn/generate contract as the sqlite backed
+graphs, but keep everything inside compact arrays of interned integer
+ids instead of going through SQLAlchemy.  Intended for tests, ephemeral
+graphs and small bots.
+"""
+
+from array import array
+from logging import getLogger
+from time import time
+import pickle
+
+from ..utils import ThreadLocalRandom
+from ..utils import nchain
+from ..word import normalize
+
+from ..model import base
+from ..model import sentence
+from ..model import xmpp
+from .base import FragmentRow
+
+logger = getLogger(__name__)
+
+# typecode for all the id arrays.
+ID_TYPE = 'i'
+
+
+def _key(a, b):
+    # pack a pair of ids into a single int for a compact dict key.
+    return (a << 32) | b
+
+
+class MemoryStateGraph(base.StateGraph):
+    """
+    Generic in-memory state graph implementation.
+
+    Subclasses define which attributes make up the persisted state by
+    listing them in `state_attributes`.
+    """
+
+    state_attributes = ()
+
+    def __init__(self, random=None, **kw):
+        # the callable returning random numbers in [0, 1) for generation.
+        self.random = ThreadLocalRandom() if random is None else random
+        self.reset()
+
+    def initialize(self, *a, **kw):
+        # nothing to connect to, provided for compatibility with the
+        # sqlite backed graphs.
+        pass
+
+    def reset(self):
+        """
+        Reset the graph into an empty state.
+        """
+
+        raise NotImplementedError
+
+    def dump(self, stream):
+        """
+        Write the state of this graph into the binary stream.
+        """
+
+        pickle.dump({
+            name: getattr(self, name) for name in self.state_attributes
+        }, stream, pickle.HIGHEST_PROTOCOL)
+
+    def load(self, stream):
+        """
+        Replace the state of this graph with one read from the binary
+        stream.
+        """
+
+        state = pickle.load(stream)
+        for name in self.state_attributes:
+            setattr(self, name, state[name])
+
+    def _generate(self, data):
+        raise NotImplementedError
+
+    def generate(self, data, default=NotImplemented):
+        try:
+            data_ = {}
+            data_.update(data)
+            logger.debug('generate begin')
+            return self._generate(data_)
+        except KeyError:
+            if default is NotImplemented:
+                raise
+            return default
+        finally:
+            logger.debug('generate end')
+
+
+class MemorySentenceGraph(MemoryStateGraph):
+    """
+    The in-memory graph of sentences.
+    """
+
+    state_attributes = (
+        'words', 'word_ids', 'timestamps', 'sentence_fragments',
+        'f_sentence', 'f_l_word', 'f_word', 'f_r_word',
+        'idx_word', 'lr', 'rl',
+    )
+
+    def __init__(self, min_sentence_length=1, max_chain_distance=50,
+                 normalize=normalize, **kw):
+        super(MemorySentenceGraph, self).__init__(**kw)
+        self.min_sentence_length = min_sentence_length
+        self.max_chain_distance = max_chain_distance
+        self.normalize = normalize
+
+    def reset(self):
+        # word id to word, and its reverse lookup.
+        self.words = []
+        self.word_ids = {}
+        # sentence id to timestamp and to its first fragment id.
+        self.timestamps = array(ID_TYPE)
+        self.sentence_fragments = array(ID_TYPE)
+        # fragment columns, indexed by fragment id.
+        self.f_sentence = array(ID_TYPE)
+        self.f_l_word = array(ID_TYPE)
+        self.f_word = array(ID_TYPE)
+        self.f_r_word = array(ID_TYPE)
+        # normalized word id to fragment ids.
+        self.idx_word = {}
+        # packed (l_word_id, word_id) and (word_id, r_word_id) to the
+        # fragment ids, for walking left to right and right to left.
+        self.lr = {}
+        self.rl = {}
+
+    def intern(self, word):
+        """
+        Return the id for word, assigning a new one if not seen before.
+        """
+
+        word_id = self.word_ids.get(word)
+        if word_id is None:
+            word_id = self.word_ids[word] = len(self.words)
+            self.words.append(word)
+        return word_id
+
+    def _learn_sentence(self, raw, timestamp=None):
+        source = raw.split()
+        if len(source) < self.min_sentence_length:
+            return None
+
+        words = [''] + source + ['']
+        for word in words:
+            self.intern(word)
+            self.intern(self.normalize(word))
+
+        sentence_id = len(self.timestamps)
+        self.timestamps.append(
+            int(time()) if timestamp is None else timestamp)
+        self.sentence_fragments.append(len(self.f_sentence))
+
+        for l_word, word, r_word in nchain(3, words):
+            fragment_id = len(self.f_sentence)
+            l_word_id = self.word_ids[l_word]
+            word_id = self.word_ids[word]
+            r_word_id = self.word_ids[r_word]
+            self.f_sentence.append(sentence_id)
+            self.f_l_word.append(l_word_id)
+            self.f_word.append(word_id)
+            self.f_r_word.append(r_word_id)
+            self.lr.setdefault(
+                _key(l_word_id, word_id), array(ID_TYPE)).append(fragment_id)
+            self.rl.setdefault(
+                _key(word_id, r_word_id), array(ID_TYPE)).append(fragment_id)
+            self.idx_word.setdefault(
+                self.word_ids[self.normalize(word)], array(ID_TYPE)
+            ).append(fragment_id)
+
+        return sentence_id
+
+    def learn(self, table):
+        try:
+            return self._learn_sentence(table[sentence.Loader])
+        except Exception:
+            logger.exception('Unexpected error')
+
+    def fragment(self, fragment_id):
+        """
+        Return the FragmentRow for the fragment_id.
+        """
+
+        return FragmentRow(
+            fragment_id,
+            self.f_sentence[fragment_id],
+            self.f_l_word[fragment_id],
+            self.f_word[fragment_id],
+            self.f_r_word[fragment_id],
+        )
+
+    def lookup_states_by_ids(self, state_ids, session=None):
+        """
+        Return all words associated with the list of word_ids
+        """
+
+        words = self.words
+        return {i: words[i] for i in state_ids if 0 <= i < len(words)}
+
+    def pick_word(self, session=None):
+        count = len(self.words) - (1 if '' in self.word_ids else 0)
+        if not count:
+            raise KeyError('no words in graph')
+
+        index = int(self.random() * count)
+        # the empty word is skipped, so shift the index past it.
+        if self.word_ids.get('', len(self.words)) <= index:
+            index += 1
+        return self.normalize(self.words[index])
+
+    def pick_entry_point(self, data, session=None):
+        """
+        Return a FragmentRow based on arguments, which can serve as the
+        starting value for the generate method.
+        """
+
+        word = data.get('word')
+
+        if not word:
+            word = self.pick_word(session)
+
+        fragment_ids = self.idx_word.get(
+            self.word_ids.get(self.normalize(word)))
+
+        if not fragment_ids:
+            raise KeyError('no such word in chains')
+
+        return self.fragment(fragment_ids[int(self.random() * len(fragment_ids))])
+
+    def _candidates(self, fragment_ids, session):
+        # session is the set of permitted sentence ids, if restricted.
+        if session is None or not fragment_ids:
+            return fragment_ids
+        f_sentence = self.f_sentence
+        return [i for i in fragment_ids if f_sentence[i] in session]
+
+    def follow_chain(self, data, fragment, direction, session=None):
+        """
+        Follow the fragments for the list of word ids that will make a
+        markov chain.
+
+        direction, either
+        - 'lr', left to right
+        - 'rl', right to left
+        """
+
+        # the pair of word ids that keys the candidate fragments.
+        if direction == 'lr':
+            table, target = self.lr, self.f_r_word
+            a, b = fragment.word_id, fragment.r_word_id
+        else:
+            table, target = self.rl, self.f_l_word
+            a, b = fragment.l_word_id, fragment.word_id
+
+        result = []
+        for c in range(self.max_chain_distance):
+            fragment_ids = self._candidates(table.get(_key(a, b)), session)
+            if not fragment_ids:
+                break
+            word_id = target[fragment_ids[int(self.random() * len(fragment_ids))]]
+            result.append(word_id)
+            if direction == 'lr':
+                a, b = b, word_id
+            else:
+                a, b = word_id, a
+
+        if direction == 'rl':
+            result.reverse()
+        return result
+
+    def scope(self, data):
+        """
+        Return the set of sentence ids generation is restricted to, or
+        None if unrestricted.
+        """
+
+        return None
+
+    def _generate(self, data):
+        session = self.scope(data)
+        entry_point = self.pick_entry_point(data, session)
+
+        lhs = self.follow_chain(data, entry_point, 'rl', session)
+        c = list(entry_point.list_states())
+        rhs = self.follow_chain(data, entry_point, 'lr', session)
+
+        words = self.words
+        return ' '.join(words[i] for i in lhs + c + rhs).strip()
+
+
+class MemoryXMPPGraph(MemorySentenceGraph):
+    """
+    The in-memory graph of sentences with XMPP metadata.
+    """
+
+    state_attributes = MemorySentenceGraph.state_attributes + (
+        'values', 'value_ids', 'log_sentence', 'log_muc', 'log_jid',
+        'log_nickname', 'jid_sentences',
+    )
+
+    def reset(self):
+        super(MemoryXMPPGraph, self).reset()
+        # jids, mucs and nicknames share a single interned value table.
+        self.values = []
+        self.value_ids = {}
+        self.log_sentence = array(ID_TYPE)
+        self.log_muc = array(ID_TYPE)
+        self.log_jid = array(ID_TYPE)
+        self.log_nickname = array(ID_TYPE)
+        # jid value id to sentence ids.
+        self.jid_sentences = {}
+
+    def intern_value(self, value):
+        value_id = self.value_ids.get(value)
+        if value_id is None:
+            value_id = self.value_ids[value] = len(self.values)
+            self.values.append(value)
+        return value_id
+
+    def learn(self, table):
+        try:
+            sentence_id = self._learn_sentence(table[sentence.Loader])
+            raw = table.get(xmpp.Loader)
+            if sentence_id is None or raw is None:
+                return sentence_id
+
+            jid_id = self.intern_value(raw['jid'])
+            self.log_sentence.append(sentence_id)
+            self.log_muc.append(self.intern_value(raw['muc']))
+            self.log_jid.append(jid_id)
+            self.log_nickname.append(self.intern_value(raw['nick']))
+            self.jid_sentences.setdefault(
+                jid_id, array(ID_TYPE)).append(sentence_id)
+            return sentence_id
+        except Exception:
+            logger.exception('Unexpected error')
+
+    def _sentence_fragment_ids(self, sentence_ids):
+        starts = self.sentence_fragments
+        total = len(self.f_sentence)
+        for sentence_id in sentence_ids:
+            end = (starts[sentence_id + 1] if sentence_id + 1 < len(starts)
+                   else total)
+            for fragment_id in range(starts[sentence_id], end):
+                yield fragment_id
+
+    def scope(self, data):
+        jid = data.get('jid')
+        if not jid:
+            return None
+        sentence_ids = self.jid_sentences.get(self.value_ids.get(jid), ())
+        return set(sentence_ids)
+
+    def pick_entry_point(self, data, session=None):
+        jid = data.get('jid')
+        if not jid:
+            return super(MemoryXMPPGraph, self).pick_entry_point(
+                data, session)
+
+        fragment_ids = list(self._sentence_fragment_ids(sorted(session)))
+        if not fragment_ids:
+            raise KeyError('failed to find fragments for jid <%s>', jid)
+
+        return self.fragment(fragment_ids[int(self.random() * len(fragment_ids))])
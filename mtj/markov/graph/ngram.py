@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+from itertools import chain
+from logging import getLogger
+
+from sqlalchemy import exists
+from sqlalchemy import func
+from sqlalchemy import select
+
+from ..utils import unpack_ids
+
+from ..model import base
+from ..model import ngram
+from .base import Context
+from .sentence import SentenceGraph
+
+logger = getLogger(__name__)
+
+
+class NGramRow(base.StateTransition):
+    """
+    A lightweight n-gram, built from the plain columns of a row.
+    """
+
+    __slots__ = ('prefix', 'suffix', 'l_word_id', 'r_word_id')
+
+    def __init__(self, prefix, suffix, l_word_id, r_word_id):
+        self.prefix = prefix
+        self.suffix = suffix
+        self.l_word_id = l_word_id
+        self.r_word_id = r_word_id
+
+    def list_states(self):
+        return list(unpack_ids(self.prefix)) + [self.r_word_id]
+
+
+class NGramGraph(SentenceGraph):
+    """
+    The graph of sentences, with a configurable markov order.
+    """
+
+    def __init__(self, db_src='sqlite://', order=2, **kw):
+        super(NGramGraph, self).__init__(db_src, **kw)
+        if order < 1:
+            raise ValueError('order must be at least 1')
+        self.order = order
+
+    def initialize(self, modules=None, **kw):
+        local_modules = [ngram]
+        if modules:
+            local_modules.extend(modules)
+
+        # skip over the SentenceGraph as the fragment model is replaced.
+        super(SentenceGraph, self).initialize(local_modules, **kw)
+
+        self.IndexWordNGram = self.classes['IndexWordNGram']
+        self.NGram = self.classes['NGram']
+        self.Sentence = self.classes['Sentence']
+        self.Word = self.classes['Word']
+
+    def merge_from(self, other):
+        order = getattr(other, 'order', self.order)
+        if order != self.order:
+            # the packed keys would not line up.
+            raise ValueError(
+                'cannot merge n-grams of order %d into order %d' % (
+                    order, self.order))
+        return super(NGramGraph, self).merge_from(other)
+
+    def quote(self, sentence_id, session=None):
+        """
+        Return the sentence as it was learned, from the words of its
+        n-grams in the order they were added.
+        """
+
+        if session is None:
+            session = self._sessions()
+
+        NGram = self.NGram
+        rows = session.execute(select([
+            NGram.prefix, NGram.r_word_id,
+        ]).where(NGram.sentence_id == sentence_id).order_by(
+            NGram.id)).fetchall()
+        if not rows:
+            raise KeyError('no such sentence')
+
+        boundary_id = session.execute(
+            select([self.Word.id]).where(self.Word.word == '')).scalar()
+        word_ids = []
+        for word_id in chain(unpack_ids(rows[0][0]), (
+                r_word_id for prefix, r_word_id in rows)):
+            if word_id != boundary_id:
+                word_ids.append(word_id)
+            elif word_ids:
+                # repeated sentences have their n-grams added again.
+                break
+
+        words = dict(session.execute(select([
+            self.Word.id, self.Word.word,
+        ]).where(self.Word.id.in_(set(word_ids)))).fetchall())
+        return ' '.join(words[word_id] for word_id in word_ids)
+
+    def quote_condition(self, data, context):
+        self.scope(data)
+        Sentence = self.Sentence
+        # the sentences too short for an n-gram cannot be quoted.
+        learned = exists(select([self.NGram.id]).where(
+            self.NGram.sentence_id == Sentence.id))
+        return Sentence.id, learned
+
+    def length_bounds(self, data):
+        bounds = super(NGramGraph, self).length_bounds(data)
+        if bounds is not None:
+            # the positions of the words are not recorded.
+            raise ValueError('length bounds not supported by n-gram graph')
+        return bounds
+
+    def scope(self, data):
+        if data.get('since') is not None or data.get('until') is not None:
+            # the n-grams are shared by the sentences.
+            raise ValueError('scope not supported by n-gram graph')
+        return None
+
+    def compute_stats(self, connection):
+        result = super(SentenceGraph, self).compute_stats(connection)
+        NGram = self.NGram
+        result.update(self.transition_stats(
+            connection, self.IndexWordNGram,
+            ([NGram.prefix], NGram.r_word_id),
+            ([NGram.suffix], NGram.l_word_id)))
+        return result
+
+    def _ngram_columns(self):
+        NGram = self.NGram
+        return [
+            NGram.prefix,
+            NGram.suffix,
+            NGram.l_word_id,
+            NGram.r_word_id,
+        ]
+
+    def pick_entry_point(self, data, context):
+        if data.get('words'):
+            raise ValueError('words not supported by n-gram graph')
+        self.length_bounds(data)
+        context.sentence_ids = self.scope(data)
+
+        word = data.get('word')
+
+        if not word:
+            word = self.pick_word(context)
+
+        IndexWordNGram = self.IndexWordNGram
+        Word = self.Word
+        source = IndexWordNGram.__table__.join(
+            Word.__table__, Word.id == IndexWordNGram.word_id)
+        condition = Word.word == self.entry_word(word, context)
+
+        count = context.execute(
+            select([func.count()]).select_from(source).where(condition)
+        ).scalar()
+
+        if not count:
+            raise KeyError('no such word in chains')
+
+        row = context.execute(
+            select(self._ngram_columns()).select_from(
+                source.join(
+                    self.NGram.__table__,
+                    self.NGram.id == IndexWordNGram.ngram_id)
+            ).where(condition).offset(int(self.random() * count)).limit(1)
+        ).first()
+        return NGramRow(*row)
+
+    def _query_chain(self, data, fragment, s_key, t_key, context):
+        condition = getattr(self.NGram, s_key) == getattr(fragment, t_key)
+        closing = self.closing_condition(
+            self.NGram, 'r_word_id' if t_key == 'suffix' else 'l_word_id',
+            context)
+        if closing is not None:
+            condition = condition & closing
+        count = context.execute(select([func.count()]).select_from(
+            self.NGram.__table__).where(condition)).scalar()
+        if not count:
+            return None
+        return context.execute(
+            select(self._ngram_columns()).where(condition).offset(
+                int(self.random() * count)).limit(1)
+        ).first()
+
+    def follow_chain(self, data, fragment, direction, context=None):
+        """
+        Follow the n-grams for the list of word ids that will make a
+        markov chain, up to the boundary word.
+
+        direction, either
+        - 'lr', left to right
+        - 'rl', right to left
+        """
+
+        result = list(self.iter_chain(data, fragment, direction, context))
+        if direction == 'rl':
+            result.reverse()
+        return result
+
+    def iter_chain(self, data, fragment, direction, context=None):
+        if context is None:  # pragma: no cover
+            context = Context(self._sessions(), data)
+
+        if direction == 'lr':
+            s_key, t_key, t_word_id = 'prefix', 'suffix', 'r_word_id'
+        else:
+            s_key, t_key, t_word_id = 'suffix', 'prefix', 'l_word_id'
+
+        boundary_id = self.boundary_id(context)
+        if getattr(fragment, t_word_id) == boundary_id:
+            # already at the boundary.
+            return
+
+        for c in range(self.max_chain_distance):
+            # only a step to the end of the chain is taken once expired.
+            context.closing = context.closing or context.expired()
+            fragment = self._query_chain(data, fragment, s_key, t_key, context)
+            if not fragment:
+                context.truncated = context.truncated or context.closing
+                break
+            word_id = getattr(fragment, t_word_id)
+            yield word_id
+            if word_id == boundary_id:
+                break
@@ -1,23 +1,32 @@
 # -*- coding: utf-8 -*-
 from logging import getLogger
 from time import time
-from random import random
 
 from sqlalchemy import create_engine
+from sqlalchemy import and_
+from sqlalchemy import exists
 from sqlalchemy import func
+from sqlalchemy import literal_column
+from sqlalchemy import select
 from sqlalchemy.orm import scoped_session
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
 from sqlalchemy.exc import SQLAlchemyError
 
+from ..utils import BloomFilter
 from ..utils import unique_merge
 from ..utils import nchain
 from ..word import normalize
 # from ..exc import HandledError
 
+from ..model import fuzzy
 from ..model import sentence
 from . import base
+from .base import Context
+from .base import FragmentPath
+from .base import FragmentRow
+from .base import Generated
 
 logger = getLogger(__name__)
 
@@ -31,6 +40,7 @@ class SentenceGraph(base.SqliteStateGraph):
                  min_sentence_length=1,
                  max_chain_distance=50,
                  normalize=normalize,
+                 word_filter=False,
                  **kw):
         super(SentenceGraph, self).__init__(db_src, **kw)
 
@@ -39,6 +49,12 @@ class SentenceGraph(base.SqliteStateGraph):
         # maximum distance from starting chain for output.
         self.max_chain_distance = max_chain_distance
         self.normalize = normalize
+        # whether to reject unknown words through the BloomFilter of all
+        # known words, only correct if this is the only writer.
+        self.filter_words = word_filter
+        self.word_filter = None
+        # minimum trigram similarity of a near miss for an unknown word.
+        self.fuzzy_threshold = 0.3
 
     def initialize(self, modules=None, **kw):
         local_modules = [sentence]
@@ -51,65 +67,569 @@ class SentenceGraph(base.SqliteStateGraph):
         # XXX assigning the autocreated classes in parent to here
         self.IndexWordFragment = self.classes['IndexWordFragment']
         self.Fragment = self.classes['Fragment']
-        # self.Sentence = self.classes['Sentence']
+        self.Sentence = self.classes['Sentence']
         self.Word = self.classes['Word']
 
-    def pick_word(self, session=None):
-        if session is None:  # pragma: no cover
+    def lookup_states_by_ids(self, state_ids, session=None):
+        """
+        Return all words associated with the list of word_ids, as a
+        mapping of id to word.
+        """
+
+        if session is None:
             session = self._sessions()
 
-        query = lambda p: session.query(p).select_from(self.Word).filter(
-            self.Word.word != '')
-        count = query(func.count()).one()[0]
+        Word = self.Word
+        return dict(session.execute(
+            select([Word.id, Word.word]).where(Word.id.in_(set(state_ids)))
+        ).fetchall())
+
+    def pick_word(self, context=None):
+        if context is None:  # pragma: no cover
+            context = Context(self._sessions(), {})
+
+        Word = self.Word
+        condition = Word.word != ''
+        count = context.execute(
+            select([func.count()]).select_from(Word).where(condition)
+        ).scalar()
 
         if not count:
             raise KeyError('no words in graph')
 
-        return self.normalize(
-            query(self.Word.word).offset(int(random() * count)).first()[0])
+        return self.normalize(context.execute(
+            select([Word.word]).where(condition).offset(
+                int(self.random() * count)).limit(1)
+        ).scalar())
+
+    def load_word_filter(self, session=None):
+        """
+        Build the filter of known words from all words in the graph.
+        """
+
+        if session is None:
+            session = self._sessions()
+
+        Word = self.Word
+        count = session.execute(select([func.count()]).select_from(
+            Word.__table__)).scalar()
+        word_filter = BloomFilter(max(1024, count * 2))
+        word_filter.update(
+            row[0] for row in session.execute(select([Word.word])))
+        self.word_filter = word_filter
+        return word_filter
+
+    def bulk_loaded(self):
+        # the words are reloaded on next use.
+        self.word_filter = None
+
+    def entry_word(self, word, context):
+        """
+        Return the normalized word for looking up the entry point,
+        substituting a near miss if the word is definitely unknown and
+        the fuzzy index is available.
+        """
+
+        word = self.normalize(word)
+        if self.filter_words:
+            word_filter = self.word_filter
+            if word_filter is None or word_filter.saturated:
+                word_filter = self.load_word_filter(context.session)
+            if word in word_filter:
+                return word
+        elif ('WordTrigram' not in self.classes or context.execute(
+                select([self.Word.id]).where(self.Word.word == word)
+                ).scalar() is not None):
+            return word
+        return self.suggest_word(word, context)
+
+    def suggest_word(self, word, context):
+        """
+        Return the indexed word nearest to the unknown word, first from
+        the words that it is a prefix of, then by trigram similarity.
+        """
+
+        WordTrigram = self.classes.get('WordTrigram')
+        if WordTrigram is None or not word:
+            raise KeyError('no such word in chains')
+
+        Word = self.Word
+        source = Word.__table__.join(
+            WordTrigram.__table__, WordTrigram.word_id == Word.id)
+        if len(word) >= 3:
+            # a range over the index of the words.
+            suggestion = context.execute(
+                select([Word.word]).select_from(source).where(and_(
+                    Word.word > word, Word.word < word + u'\U0010ffff',
+                )).order_by(Word.word).limit(1)
+            ).scalar()
+            if suggestion is not None:
+                return suggestion
+
+        grams = fuzzy.trigrams(word)
+        rows = context.execute(
+            select([Word.word, func.count()]).select_from(source).where(
+                WordTrigram.trigram.in_(grams)
+            ).group_by(Word.id).order_by(
+                func.count().desc(), Word.id).limit(16)
+        ).fetchall()
+
+        best, similarity = None, self.fuzzy_threshold
+        for candidate, shared in rows:
+            # the jaccard index of the trigrams.
+            value = shared / float(
+                len(grams) + len(fuzzy.trigrams(candidate)) - shared)
+            if value >= similarity:
+                best, similarity = candidate, value
+        if best is None:
+            raise KeyError('no such word in chains')
+        return best
+
+    def _fragment_columns(self, Fragment):
+        return [
+            Fragment.id,
+            Fragment.sentence_id,
+            Fragment.l_word_id,
+            Fragment.word_id,
+            Fragment.r_word_id,
+            Fragment.l_dist,
+            Fragment.r_dist,
+        ]
+
+    def length_bounds(self, data):
+        """
+        Return the (min_length, max_length) bounds on the number of words
+        to be generated as specified in data, or None if unbounded.  The
+        max_length is None if only the minimum is bounded.
+        """
+
+        min_length = data.get('min_length')
+        max_length = data.get('max_length')
+        if min_length is None and max_length is None:
+            return None
+        return (min_length or 1, max_length)
+
+    def length_condition(self, Fragment, bounds):
+        """
+        Return the condition for fragments from sentences with a length
+        within bounds.
+        """
+
+        min_length, max_length = bounds
+        length = Fragment.l_dist + Fragment.r_dist + 1
+        if max_length is None:
+            return length >= min_length
+        return length.between(min_length, max_length)
+
+    def time_conditions(self, data):
+        """
+        Return the list of conditions on the Sentence for the since and
+        until timestamps in data.
+        """
+
+        Sentence = self.Sentence
+        conditions = []
+        if data.get('since') is not None:
+            conditions.append(Sentence.timestamp >= data['since'])
+        if data.get('until') is not None:
+            conditions.append(Sentence.timestamp < data['until'])
+        return conditions
+
+    def scope(self, data):
+        """
+        Return a select of the ids of the sentences that generation is
+        restricted to by data, or None if unrestricted.
+        """
+
+        conditions = self.time_conditions(data)
+        if not conditions:
+            return None
+        return select([self.Sentence.id]).where(and_(*conditions))
+
+    def scope_condition(self, Fragment, context):
+        """
+        Return the condition restricting the fragments to the scope
+        bound to the context, or None if unrestricted.
+        """
+
+        sentence_ids = getattr(context, 'sentence_ids', None)
+        if sentence_ids is None:
+            return None
+        # correlated, such that each candidate fragment is looked up by
+        # its sentence rather than listing the whole scope at every hop.
+        column = list(sentence_ids.inner_columns)[0]
+        return exists(sentence_ids.where(column == Fragment.sentence_id))
+
+    def transition_stats(self, connection, Index, lr, rl, keys=()):
+        """
+        Return the number of distinct transitions, the branching factor
+        of the chain in either direction, and the words with the most
+        transitions in the word index.  The directions lr and rl are
+        the columns of the state a step is taken from and the column of
+        the word it leads to, with the transitions also distinct by
+        keys.
+        """
+
+        keys = list(keys)
+
+        def branching(state, target):
+            counts = select([
+                func.count(target.distinct()).label('n'),
+            ]).group_by(*(keys + state)).alias()
+            states, transitions, most = connection.execute(select([
+                func.count(), func.sum(counts.c.n), func.max(counts.c.n),
+            ]).select_from(counts)).first()
+            return states, transitions or 0, {
+                'states': states,
+                'mean': transitions / states if states else 0.0,
+                'max': most or 0,
+            }
+
+        states, transitions, lr = branching(*lr)
+        states, transitions, rl = branching(*rl)
+
+        Word = self.Word
+        count = func.count().label('count')
+        top = select([Index.word_id, count]).group_by(
+            Index.word_id).order_by(count.desc(), Index.word_id).limit(
+                10).alias()
+        top_words = connection.execute(
+            select([Word.word, top.c.count]).select_from(
+                top.join(Word.__table__, Word.id == top.c.word_id)
+            ).order_by(top.c.count.desc(), top.c.word_id)).fetchall()
+
+        return {
+            'transitions': transitions,
+            'branching': {'lr': lr, 'rl': rl},
+            'top_words': [tuple(row) for row in top_words],
+        }
+
+    def compute_stats(self, connection):
+        result = super(SentenceGraph, self).compute_stats(connection)
+        Fragment = self.Fragment
+        result.update(self.transition_stats(
+            connection, self.IndexWordFragment,
+            ([Fragment.l_word_id, Fragment.word_id], Fragment.r_word_id),
+            ([Fragment.word_id, Fragment.r_word_id], Fragment.l_word_id),
+            [Fragment.tenant_id]))
+        return result
+
+    def boundary_id(self, context):
+        """
+        Return the id of the boundary (empty) word.
+        """
+
+        boundary_id = getattr(context, 'boundary_id', None)
+        if boundary_id is None:
+            boundary_id = context.boundary_id = context.execute(
+                select([self.Word.id]).where(self.Word.word == '')).scalar()
+        return boundary_id
 
-    def pick_entry_point(self, data, session):
+    def closing_condition(self, table, t_word_id, context):
+        """
+        Return the condition for the transitions of the table that end
+        the chain if the walk is closing, otherwise None.
+        """
+
+        if not context.closing:
+            return None
+        return getattr(table, t_word_id) == self.boundary_id(context)
+
+    def tenant_condition(self, table, context):
+        """
+        Return the condition restricting the rows of the table to the
+        tenant bound to the context.
+        """
+
+        return table.tenant_id == getattr(context, 'tenant_id', 0)
+
+    def pick_entry_point(self, data, context):
         """
         Return a state_transition based on arguments.  Return value must
         be a StateTransition type, that can serve as the starting
         value for the generate method.
         """
 
+        # bind the restriction to the context for the chain queries.
+        context.sentence_ids = self.scope(data)
+
         # TODO verify that data is a word
+        if data.get('words'):
+            return self.pick_path(data, context)
+
         word = data.get('word')
 
         if not word:
-            word = self.pick_word(session)
+            if (context.sentence_ids is not None or
+                    getattr(context, 'tenant_id', 0)):
+                # the words of the graph may be from the other tenants.
+                return self.pick_scoped_fragment(data, context)
+            word = self.pick_word(context)
+
+        Fragment = self.Fragment
+        IndexWordFragment = self.IndexWordFragment
+        Word = self.Word
+        source = IndexWordFragment.__table__.join(
+            Word.__table__, Word.id == IndexWordFragment.word_id)
+        condition = (
+            (Word.word == self.entry_word(word, context)) &
+            self.tenant_condition(IndexWordFragment, context)
+        )
+        bounds = self.length_bounds(data)
+        scoped = self.scope_condition(Fragment, context)
+        if bounds is not None or scoped is not None:
+            # the fragment is required for its sentence.
+            source = source.join(
+                Fragment.__table__,
+                Fragment.id == IndexWordFragment.fragment_id)
+        if bounds is not None:
+            condition = condition & self.length_condition(Fragment, bounds)
+        if scoped is not None:
+            condition = condition & scoped
+
+        count = context.execute(
+            select([func.count()]).select_from(source).where(condition)
+        ).scalar()
+
+        if not count:
+            raise KeyError('no such word in chains')
 
-        query = lambda p: session.query(p).select_from(
-            self.IndexWordFragment).join(self.Word).filter(
-                self.Word.word == self.normalize(word))
+        if bounds is None and scoped is None:
+            source = source.join(
+                Fragment.__table__,
+                Fragment.id == IndexWordFragment.fragment_id)
 
-        count = query(func.count()).one()[0]
+        row = context.execute(
+            select(self._fragment_columns(Fragment)).select_from(
+                source).where(condition).offset(
+                    int(self.random() * count)).limit(1)
+        ).first()
+        return FragmentRow(*row)
+
+    def pick_scoped_fragment(self, data, context):
+        """
+        Return a FragmentRow picked from all fragments of the tenant
+        within the scope bound to the context.
+        """
+
+        Fragment = self.Fragment
+        condition = self.tenant_condition(Fragment, context)
+        if context.sentence_ids is not None:
+            # listed once to drive the lookup through the index of the
+            # sentences, which the indexes leading with the tenant would
+            # otherwise be preferred over, hence the no-op on its column.
+            condition = (
+                ((Fragment.tenant_id + 0) == getattr(
+                    context, 'tenant_id', 0)) &
+                Fragment.sentence_id.in_(context.sentence_ids)
+            )
+        bounds = self.length_bounds(data)
+        if bounds is not None:
+            condition = condition & self.length_condition(Fragment, bounds)
+
+        count = context.execute(
+            select([func.count()]).select_from(
+                Fragment.__table__).where(condition)
+        ).scalar()
 
         if not count:
-            raise KeyError('no such word in chains')
+            raise KeyError('no fragments within scope')
 
-        index = query(self.IndexWordFragment).offset(
-            int(random() * count)).first()
-        return index.fragment
+        row = context.execute(
+            select(self._fragment_columns(Fragment)).where(
+                condition).order_by(Fragment.id).offset(
+                    int(self.random() * count)).limit(1)
+        ).first()
+        logger.debug('picked fragment_id %d', row.id)
+        return FragmentRow(*row)
 
-    def _query_chain(self, data, fragment, s_word_id, t_word_id, session):
+    def pick_path(self, data, context):
+        """
+        Return a FragmentPath from a sentence picked from the ones that
+        contain all of the words listed in data, spanning from the first
+        to the last occurrence of those words.
+        """
+
+        words = set(self.entry_word(w, context)
+                    for w in data['words'] if self.normalize(w))
+        if not words:
+            raise KeyError('no words to find in chains')
+
+        Fragment = self.Fragment
+        IndexWordFragment = self.IndexWordFragment
+        Word = self.Word
+        word_ids = [row[0] for row in context.execute(
+            select([Word.id]).where(Word.word.in_(words))).fetchall()]
+        if len(word_ids) < len(words):
+            raise KeyError('no such words in chains')
+
+        # the sentences that have every word, from the intersection of
+        # the fragments of each word in the index.
+        conditions = [
+            self.tenant_condition(IndexWordFragment, context),
+            IndexWordFragment.word_id.in_(word_ids),
+        ]
+        bounds = self.length_bounds(data)
+        if bounds is not None:
+            conditions.append(self.length_condition(Fragment, bounds))
+        scoped = self.scope_condition(Fragment, context)
+        if scoped is not None:
+            conditions.append(scoped)
+        sentences = select([Fragment.sentence_id]).select_from(
+            IndexWordFragment.__table__.join(
+                Fragment.__table__,
+                Fragment.id == IndexWordFragment.fragment_id)
+        ).where(and_(*conditions)).group_by(Fragment.sentence_id).having(
+            func.count(IndexWordFragment.word_id.distinct()) == len(word_ids))
+
+        count = context.execute(
+            select([func.count()]).select_from(sentences.alias())).scalar()
+        if not count:
+            raise KeyError('no sentence with all words in chains')
+
+        sentence_id = context.execute(
+            sentences.order_by(Fragment.sentence_id).offset(
+                int(self.random() * count)).limit(1)
+        ).scalar()
+
+        rows = context.execute(
+            select(self._fragment_columns(Fragment) + [
+                IndexWordFragment.word_id]).select_from(
+                Fragment.__table__.outerjoin(
+                    IndexWordFragment.__table__, and_(
+                        IndexWordFragment.fragment_id == Fragment.id,
+                        IndexWordFragment.word_id.in_(word_ids),
+                    ))
+            ).where(Fragment.sentence_id == sentence_id).order_by(
+                Fragment.l_dist, Fragment.id)
+        ).fetchall()
+
+        fragments = []
+        anchors = []
+        for row in rows:
+            if fragments and fragments[-1].l_dist == row.l_dist:
+                # repeated sentences have their fragments added again.
+                continue
+            if row[-1] is not None:
+                anchors.append(len(fragments))
+            fragments.append(FragmentRow(*row[:-1]))
+
+        path = FragmentPath(fragments[anchors[0]:anchors[-1] + 1])
+        first, last = path.end('rl'), path.end('lr')
+        length = last.l_dist - first.l_dist + 1 + (
+            1 if first.l_dist else 0) + (1 if last.r_dist else 0)
+        if bounds is not None and bounds[1] is not None and (
+                length > bounds[1]):
+            raise KeyError('no path within the length bounds')
+        return path
+
+    def quote(self, sentence_id, session=None):
+        """
+        Return the sentence as it was learned, from the words of its
+        fragments in the order of their position.
+        """
+
+        if session is None:
+            session = self._sessions()
+
+        Fragment = self.Fragment
+        Word = self.Word
+        rows = session.execute(select([
+            Fragment.l_dist, Word.word,
+        ]).select_from(Fragment.__table__.join(
+            Word.__table__, Word.id == Fragment.word_id)
+        ).where(Fragment.sentence_id == sentence_id).order_by(
+            Fragment.l_dist, Fragment.id)).fetchall()
+        if not rows:
+            raise KeyError('no such sentence')
+
+        words = []
+        last = None
+        for l_dist, word in rows:
+            if l_dist == last:
+                # repeated sentences have their fragments added again.
+                continue
+            words.append(word)
+            last = l_dist
+        return ' '.join(words)
+
+    def quote_condition(self, data, context):
+        """
+        Return the column of the ids of the sentences that can be quoted
+        and the condition on its table, with a row for each time one of
+        the sentences within the scope of data was learned.
+        """
+
+        Fragment = self.Fragment
+        # the first fragment stands for its sentence; the literal is
+        # required for the partial index of the first fragments.
+        condition = (
+            self.tenant_condition(Fragment, context) &
+            (Fragment.l_dist == literal_column('0'))
+        )
+        sentence_ids = self.scope(data)
+        if sentence_ids is not None:
+            condition = condition & Fragment.sentence_id.in_(sentence_ids)
+        return Fragment.sentence_id, condition
+
+    def random_quote(self, data, default=NotImplemented):
+        """
+        Return a sentence picked from the ones within the scope of data,
+        as it was learned.
+        """
+
+        session = self._read_session()
+        try:
+            context = self._context(session, data)
+            column, condition = self.quote_condition(data, context)
+            count = session.execute(
+                select([func.count(column)]).where(condition)).scalar()
+            if not count:
+                raise KeyError('no sentences within scope')
+
+            sentence_id = session.execute(
+                select([column]).where(condition).order_by(column).offset(
+                    int(self.random() * count)).limit(1)
+            ).scalar()
+            return self.quote(sentence_id, session)
+        except KeyError:
+            if default is NotImplemented:
+                raise
+            return default
+        finally:
+            self._end_read(session)
+
+    def _query_chain(self, data, fragment, s_word_id, t_word_id, context):
         # self.Fragment.word_id points to a joiner, skip the second cond
         # which is the source restriction, so that words like "and" can
         # be treated as a standalone 1-order word.
 
-        Fragment = getattr(session, 'Fragment', self.Fragment)
+        Fragment = self.Fragment
 
-        query = lambda p: session.query(p).select_from(Fragment).filter(
+        condition = (
+            self.tenant_condition(Fragment, context) &
             (Fragment.word_id == getattr(fragment, t_word_id)) &
-            (getattr(Fragment, s_word_id) == fragment.word_id))
-        count = query(func.count()).one()[0]
+            (getattr(Fragment, s_word_id) == fragment.word_id)
+        )
+        scoped = self.scope_condition(Fragment, context)
+        if scoped is not None:
+            condition = condition & scoped
+        closing = self.closing_condition(Fragment, t_word_id, context)
+        if closing is not None:
+            condition = condition & closing
+
+        count = context.execute(select([func.count()]).select_from(
+            Fragment.__table__).where(condition)).scalar()
         if not count:
             return None
-        return query(Fragment).offset(int(random() * count)).first()
-
-    def follow_chain(self, data, fragment, direction, session=None):
+        return context.execute(select([
+            Fragment.l_word_id,
+            Fragment.word_id,
+            Fragment.r_word_id,
+        ]).where(condition).offset(int(self.random() * count)).limit(1)
+        ).first()
+
+    def follow_chain(self, data, fragment, direction, context=None):
         """
         Follow the fragments for the list of word ids that will make a
         markov chain.
@@ -119,8 +639,33 @@ class SentenceGraph(base.SqliteStateGraph):
         - 'rl', right to left
         """
 
-        if session is None:  # pragma: no cover
-            session = self._sessions()
+        result = list(self.iter_chain(data, fragment, direction, context))
+        if direction[1] == 'l':  # if target is towards left, reverse
+            result.reverse()
+        return result
+
+    def iter_chain(self, data, fragment, direction, context=None):
+        """
+        Generate the word ids that make up the markov chain as each of
+        the fragments is followed, outwards from the fragment towards
+        direction.
+        """
+
+        if context is None:  # pragma: no cover
+            context = Context(self._sessions(), data)
+
+        entry_point = fragment
+        # continue from the end of the entry point towards direction.
+        fragment = fragment.end(direction)
+
+        bounds = self.length_bounds(data)
+        if bounds is not None:
+            # the number of words that a path spans between its ends.
+            span = entry_point.end('lr').l_dist - entry_point.end('rl').l_dist
+            for word_id in self._iter_bounded_chain(
+                    data, fragment, direction, context, bounds, span):
+                yield word_id
+            return
 
         # split direction to target and source.
         s, t = direction
@@ -128,18 +673,107 @@ class SentenceGraph(base.SqliteStateGraph):
         # build identifiers
         s_word_id, t_word_id = s + _word_id, t + _word_id
 
-        result = []
         for c in range(self.max_chain_distance):
+            if context.expired():
+                if getattr(fragment, t_word_id) == self.boundary_id(context):
+                    break
+                # only a step to the end of the chain is still taken.
+                context.closing = True
             fragment = self._query_chain(
-                data, fragment, s_word_id, t_word_id, session)
+                data, fragment, s_word_id, t_word_id, context)
             if not fragment:
+                context.truncated = context.truncated or context.closing
                 break
-            result.append(getattr(fragment, t_word_id))
+            yield getattr(fragment, t_word_id)
 
-        if t == 'l':  # if target is towards left, reverse
-            return list(reversed(result))
-        return result
+    def _iter_bounded_chain(self, data, fragment, direction, context,
+                            bounds, span=0):
+        """
+        Follow the chain, only picking fragments that originated from a
+        sentence which, if followed to the end, results in a chain with
+        a length within bounds.  As the fragment from the same sentence
+        always qualifies, the walk will never be stuck.
+
+        The left walk is done first and leaves enough room to the right
+        for the sentence of the entry point, and the length it walked
+        is recorded into the context for the right walk, along with the
+        span of words between the ends of a path picked as the entry
+        point.  Once the walk loops back onto a pair of words already
+        visited, it will only pick from the fragments that would end the
+        chain the soonest.
+        """
+
+        s, t = direction
+        s_word_id, t_word_id = s + '_word_id', t + '_word_id'
+        t_dist = t + '_dist'
+        Fragment = self.Fragment
+        dist = getattr(Fragment, t_dist)
+        scoped = self.scope_condition(Fragment, context)
+
+        min_length, max_length = bounds
+        # the number of words on the other side of the entry point.
+        other = fragment.r_dist if t == 'l' else context.walked + span
+        # the bounds on the number of words for this direction.
+        lower = min_length - 1 - other
+        upper = None if max_length is None else max_length - 1 - other
+        limit = max(self.max_chain_distance, max_length or 0)
+
+        # number of words walked, which includes the one on this side of
+        # the entry point if it is not at the boundary.
+        length = 1 if getattr(fragment, t_dist) else 0
+        seen = set()
+        closing = False
+        for c in range(limit):
+            conditions = [
+                self.tenant_condition(Fragment, context),
+                Fragment.word_id == getattr(fragment, t_word_id),
+                getattr(Fragment, s_word_id) == fragment.word_id,
+            ]
+            if scoped is not None:
+                conditions.append(scoped)
+            if context.expired():
+                if not getattr(fragment, t_dist):
+                    break
+                # past the bounds, only a step to the end is taken.
+                context.closing = True
+                conditions.append(dist == 0)
+            else:
+                conditions.append(dist >= lower - length)
+                if upper is not None:
+                    conditions.append(dist <= upper - length)
+
+            rows = context.execute(select([
+                Fragment.l_word_id,
+                Fragment.word_id,
+                Fragment.r_word_id,
+                dist,
+            ]).where(and_(*conditions))).fetchall()
+            if not rows:
+                context.truncated = context.truncated or context.closing
+                break
+            if closing:
+                shortest = min(row[-1] for row in rows)
+                rows = [row for row in rows if row[-1] == shortest]
+
+            fragment = rows[int(self.random() * len(rows))]
+            if fragment[-1]:
+                length += 1
+            # recorded before yielding as the consumer may stop early.
+            context.walked = length
+            yield getattr(fragment, t_word_id)
+
+            state = (fragment.word_id, getattr(fragment, t_word_id))
+            closing = closing or state in seen
+            seen.add(state)
+
+        context.walked = length
 
     def _generate(self, data, default=None):
         result = super(SentenceGraph, self)._generate(data)
-        return ' '.join(w.word for w in result).strip()
+        return Generated(' '.join(result).strip(), result.truncated)
+
+    def _generate_iter(self, data):
+        # the boundary words are empty.
+        for word in super(SentenceGraph, self)._generate_iter(data):
+            if word:
+                yield word
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Partitioning of the sentences across multiple graphs.
+
+Each shard is a complete graph of its own, typically in its own sqlite
+file, such that they can be written into and maintained independently.
+A partition decides which shard learns the data, and which shards can
+generate from the data.
+"""
+
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from time import time
+from zlib import crc32
+
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy import text
+
+from ..utils import ThreadLocalRandom
+from ..utils import cumulative
+from ..utils import weighted_index
+from ..model import base
+from ..model import xmpp
+
+logger = getLogger(__name__)
+
+
+def stable_hash(value):
+    """
+    Return a hash of the string that is stable across processes, unlike
+    the builtin hash.
+    """
+
+    return crc32(value.encode('utf8'))
+
+
+class Partition(object):
+    """
+    Base partition, which spreads the data across all shards through a
+    callable that maps the learn table to a shard, and lets every shard
+    generate.
+    """
+
+    def __init__(self, count, key=None):
+        self.count = count
+        self.key = key
+
+    def learn_shard(self, table):
+        """
+        Return the index of the shard that learns the table.
+        """
+
+        return self.key(table) % self.count
+
+    def generate_shards(self, data):
+        """
+        Return the indexes of the shards that can generate from data.
+        """
+
+        return list(range(self.count))
+
+
+class XMPPPartition(Partition):
+    """
+    Partition by the hash of a field of the xmpp data, such that all
+    sentences with the same value are in the same shard.
+    """
+
+    field = None
+
+    def shard_of(self, value):
+        return stable_hash(value) % self.count
+
+    def learn_shard(self, table):
+        return self.shard_of(table[xmpp.Loader][self.field])
+
+    def generate_shards(self, data):
+        value = data.get(self.field)
+        if value:
+            return [self.shard_of(value)]
+        return super(XMPPPartition, self).generate_shards(data)
+
+
+class MucPartition(XMPPPartition):
+    field = 'muc'
+
+
+class JIDPartition(XMPPPartition):
+    field = 'jid'
+
+
+class TimePartition(Partition):
+    """
+    Partition by the time of learning, where the shard i holds the
+    sentences from boundaries[i - 1] up to boundaries[i], with the first
+    and the last shards being open ended.
+    """
+
+    def __init__(self, boundaries, time=time):
+        super(TimePartition, self).__init__(len(boundaries) + 1)
+        self.boundaries = sorted(boundaries)
+        self.time = time
+
+    def shard_of(self, timestamp):
+        return bisect_right(self.boundaries, timestamp)
+
+    def learn_shard(self, table):
+        return self.shard_of(self.time())
+
+    def generate_shards(self, data):
+        since = data.get('since')
+        until = data.get('until')
+        first = 0 if since is None else self.shard_of(since)
+        last = self.count - 1 if until is None else self.shard_of(until)
+        return list(range(first, last + 1))
+
+
+class ShardedGraph(base.StateGraph):
+    """
+    Route learning to one of the shards through the partition, and
+    generate from one of the shards picked by their weight, which is
+    the number of sentences within them unless specified.
+    """
+
+    def __init__(self, shards, partition, weights=None, workers=None,
+                 random=None):
+        if len(shards) != partition.count:
+            raise ValueError('partition does not match the number of shards')
+        self.shards = list(shards)
+        self.partition = partition
+        self.weights = weights
+        self.workers = workers or len(self.shards)
+        self.random = ThreadLocalRandom() if random is None else random
+
+    def map(self, f, shards=None):
+        """
+        Return the list of results of calling f on each of the shards,
+        run in parallel.
+        """
+
+        shards = self.shards if shards is None else shards
+        with ThreadPoolExecutor(self.workers) as executor:
+            return list(executor.map(f, shards))
+
+    def initialize(self, *a, **kw):
+        self.map(lambda shard: shard.initialize(*a, **kw))
+
+    def refresh_weights(self):
+        """
+        Set the weights of the shards to the number of sentences in
+        them.
+        """
+
+        def count(shard):
+            session = shard._sessions()
+            try:
+                return session.execute(select([func.count()]).select_from(
+                    shard.Datum.__table__)).scalar()
+            finally:
+                session.close()
+
+        self.weights = self.map(count)
+        return self.weights
+
+    def vacuum(self):
+        """
+        Vacuum all the shards in parallel.
+        """
+
+        def vacuum(shard):
+            with shard.engine.connect() as connection:
+                connection.execute(text('VACUUM'))
+
+        self.map(vacuum)
+
+    def learn(self, table):
+        """
+        Learn the table into the shard picked by the partition, returning
+        the error that was handled if the learning failed, like the
+        underlying graph.
+        """
+
+        try:
+            index = self.partition.learn_shard(table)
+        except KeyError as e:
+            # the table lacks the data that the partition routes by.
+            logger.exception('Cannot route the table to a shard')
+            return e
+        error = self.shards[index].learn(table)
+        if error is None and self.weights is not None:
+            self.weights[index] += 1
+        return error
+
+    def order_shards(self, indexes):
+        """
+        Return the shard indexes in the order that they should be tried
+        in, by sampling without replacement by their weights.
+        """
+
+        if self.weights is None:
+            self.refresh_weights()
+
+        indexes = [i for i in indexes if self.weights[i]]
+        result = []
+        while indexes:
+            totals = cumulative(self.weights[i] for i in indexes)
+            result.append(indexes.pop(weighted_index(totals, self.random())))
+        return result
+
+    def generate(self, data, default=NotImplemented, deadline=None, *,
+                 shard=None):
+        """
+        Generate from the shard, or from the shards that the partition
+        selected for data by their weights, falling back to the other
+        selected ones if a shard cannot generate from data.  The deadline
+        is passed on to the shard generating.
+        """
+
+        if shard is not None:
+            return self.shards[shard].generate(data, default, deadline)
+
+        for index in self.order_shards(self.partition.generate_shards(data)):
+            result = self.shards[index].generate(data, None, deadline)
+            if result is not None:
+                return result
+
+        if default is NotImplemented:
+            raise KeyError('no shards can generate from data')
+        return default
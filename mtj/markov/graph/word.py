@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+The in-memory graph of words, generated one character at a time.
+
+The counts of the transitions are kept in a single dense array, with a
+row for every state of (order) characters and a column for every
+character, such that learning is an increment at an offset and the
+generation never touches SQL.  The counts may be saved into and restored
+from the tables of the word model, i.e. within an existing sqlite store.
+"""
+
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+from logging import getLogger
+
+from sqlalchemy import select
+from sqlalchemy.ext.declarative import declarative_base
+
+from ..utils import pack_ids
+from ..utils import unpack_ids
+from ..word import normalize
+
+from ..model import base
+from ..model import word
+from .memory import MemoryStateGraph
+
+logger = getLogger(__name__)
+
+# typecode for the arrays of counts.
+COUNT_TYPE = 'I'
+# the initial number of columns of the counts, doubled as required.
+INITIAL_WIDTH = 32
+
+
+class WordGraph(MemoryStateGraph):
+    """
+    The graph of the characters of words.
+    """
+
+    state_attributes = (
+        'order', 'chars', 'char_ids', 'state_ids', 'width', 'counts',
+        'totals',
+    )
+
+    def __init__(self, order=2, max_length=24, normalize=normalize, **kw):
+        if order < 1:
+            raise ValueError('order must be at least 1')
+        self.order = order
+        self.max_length = max_length
+        self.normalize = normalize
+        self._tables = None
+        super(WordGraph, self).__init__(**kw)
+
+    def reset(self):
+        # character id to character, and its reverse lookup; the id 0 is
+        # the boundary on either end of a word.
+        self.chars = ['']
+        self.char_ids = {'': 0}
+        # tuple of the (order) preceding character ids to the state id.
+        self.state_ids = {}
+        # the counts of each character following a state, at the offset
+        # of state id * width + character id, and the totals by state.
+        self.width = INITIAL_WIDTH
+        self.counts = array(COUNT_TYPE)
+        self.totals = array(COUNT_TYPE)
+        self._rows = {}
+
+    def load(self, stream):
+        super(WordGraph, self).load(stream)
+        self._rows = {}
+
+    def intern(self, char):
+        """
+        Return the id for the character, assigning a new one if not seen
+        before.
+        """
+
+        char_id = self.char_ids.get(char)
+        if char_id is None:
+            char_id = self.char_ids[char] = len(self.chars)
+            self.chars.append(char)
+            if char_id >= self.width:
+                self._widen(self.width * 2)
+        return char_id
+
+    def _widen(self, width):
+        # copy every row into the wider array.
+        counts = array(COUNT_TYPE, bytes(len(self.totals) * width * 4))
+        for state_id in range(len(self.totals)):
+            source = state_id * self.width
+            target = state_id * width
+            counts[target:target + self.width] = self.counts[
+                source:source + self.width]
+        self.counts = counts
+        self.width = width
+
+    def intern_state(self, key):
+        """
+        Return the id for the state of the key, the tuple of character
+        ids, adding a row of counts if not seen before.
+        """
+
+        state_id = self.state_ids.get(key)
+        if state_id is None:
+            state_id = self.state_ids[key] = len(self.totals)
+            self.totals.append(0)
+            self.counts.frombytes(bytes(self.width * 4))
+        return state_id
+
+    def _learn_word(self, value):
+        ids = [0] * self.order
+        ids.extend(self.intern(char) for char in value)
+        ids.append(0)
+        width = self.width
+        for i in range(len(ids) - self.order):
+            state_id = self.intern_state(tuple(ids[i:i + self.order]))
+            self.counts[state_id * width + ids[i + self.order]] += 1
+            self.totals[state_id] += 1
+
+    def learn(self, table):
+        """
+        Learn the words of the raw text of the table, returning the
+        number of words learned.
+        """
+
+        try:
+            count = 0
+            for value in word.tokens(table[word.Loader], self.normalize):
+                self._learn_word(value)
+                count += 1
+            return count
+        except Exception:
+            logger.exception('Unexpected error')
+        finally:
+            # the cumulative rows are stale.
+            self._rows = {}
+
+    def _row(self, state_id):
+        """
+        Return the cumulative counts of the characters that follow the
+        state, along with the ids of those characters.
+        """
+
+        row = self._rows.get(state_id)
+        if row is None:
+            start = state_id * self.width
+            counts = self.counts[start:start + self.width]
+            char_ids = [i for i, count in enumerate(counts) if count]
+            row = self._rows[state_id] = (
+                list(accumulate(counts[i] for i in char_ids)), char_ids)
+        return row
+
+    def _generate(self, data):
+        prefix = data.get('prefix') or ''
+        max_length = data.get('max_length') or self.max_length
+        order = self.order
+        ids = [0] * order
+        for char in prefix:
+            # KeyError for a character never learned.
+            ids.append(self.char_ids[char])
+
+        result = list(prefix)
+        random = self.random
+        state_ids = self.state_ids
+        while len(result) < max_length:
+            state_id = state_ids.get(tuple(ids[-order:]))
+            if state_id is None:
+                raise KeyError('no words with the prefix')
+            cumulative, char_ids = self._row(state_id)
+            char_id = char_ids[
+                bisect_right(cumulative, random() * cumulative[-1])]
+            if char_id == 0:
+                break
+            ids.append(char_id)
+            result.append(self.chars[char_id])
+        return ''.join(result)
+
+    def tables(self, engine):
+        """
+        Return the tables of the word model, created in the database of
+        the engine if they do not exist.
+        """
+
+        if self._tables is None:
+            model = declarative_base(name='WordModel')
+            self._tables = {}
+            for clsname in word.__all__:
+                basecls = getattr(word, clsname)
+                if issubclass(basecls, base.Node):
+                    self._tables[clsname] = type(
+                        clsname, (basecls, model), {}).__table__
+            self._metadata = model.metadata
+        self._metadata.create_all(engine)
+        return self._tables
+
+    def save(self, engine):
+        """
+        Replace the counts in the database of the engine with the ones
+        of this graph, returning the number of rows written.
+        """
+
+        tables = self.tables(engine)
+        characters = tables['Character']
+        counts = tables['CharacterCount']
+        rows = []
+        for key, state_id in self.state_ids.items():
+            state = pack_ids(key)
+            start = state_id * self.width
+            row = self.counts[start:start + self.width]
+            rows.extend(
+                {'state': state, 'character_id': char_id, 'count': count}
+                for char_id, count in enumerate(row) if count
+            )
+
+        with engine.begin() as connection:
+            connection.execute(counts.delete())
+            connection.execute(characters.delete())
+            connection.execute(characters.insert(), [
+                {'id': char_id, 'character': char}
+                for char_id, char in enumerate(self.chars)
+            ])
+            if rows:
+                connection.execute(counts.insert(), rows)
+        return len(rows)
+
+    def restore(self, engine):
+        """
+        Replace the state of this graph with the counts saved in the
+        database of the engine.
+        """
+
+        tables = self.tables(engine)
+        characters = tables['Character']
+        counts = tables['CharacterCount']
+        with engine.connect() as connection:
+            chars = connection.execute(select(
+                [characters.c.id, characters.c.character]
+            ).order_by(characters.c.id)).fetchall()
+            rows = connection.execute(select([
+                counts.c.state, counts.c.character_id, counts.c.count,
+            ]).order_by(counts.c.id)).fetchall()
+
+        if [char_id for char_id, char in chars] != list(range(len(chars))):
+            raise ValueError('the saved character ids are not contiguous')
+        rows = [
+            (tuple(unpack_ids(state)), char_id, count)
+            for state, char_id, count in rows
+        ]
+        if any(len(key) != self.order for key, char_id, count in rows):
+            raise ValueError(
+                'the saved counts are not of order %d' % self.order)
+
+        self.reset()
+        for char_id, char in chars[1:]:
+            self.intern(char)
+        for key, char_id, count in rows:
+            state_id = self.intern_state(key)
+            self.counts[state_id * self.width + char_id] = count
+            self.totals[state_id] += count
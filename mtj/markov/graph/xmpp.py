@@ -1,14 +1,10 @@
 from logging import getLogger
-from random import random
+from sqlalchemy import and_
 from sqlalchemy import func
-from sqlalchemy import text
-from sqlalchemy import Index
-from sqlalchemy import MetaData
-from sqlalchemy import Table
+from sqlalchemy import select
 
 from .sentence import SentenceGraph
 from ..model import xmpp
-from ..model.sentence import FragmentBase
 
 logger = getLogger(__name__)
 
@@ -31,52 +27,94 @@ class XMPPGraph(SentenceGraph):
         self.Muc = self.classes['Muc']
         self.Nickname = self.classes['Nickname']
         self.XMPPLog = self.classes['XMPPLog']
+        # the vocabularies by the field of the data.
+        self.vocabularies = {
+            'jid': (self.JID, self.classes['JIDWord']),
+            'muc': (self.Muc, self.classes['MucWord']),
+        }
 
-        # construct ORM temporary classes after real stuff are done
-        self.FragmentTemp = type('FragmentTemp', (FragmentBase, self.model), {
-            '__tablename__': 'fragment_xmpp_temp',
-            '__table_args__': {'prefixes': ['TEMP']},
-        })
+    def vocabulary(self, field, limit=None, session=None):
+        """
+        Return the list of the values of the field, either 'jid' or
+        'muc', with the sizes of their vocabularies, largest first.
+        """
+
+        if session is None:
+            session = self._sessions()
+
+        Value, Vocabulary = self.vocabularies[field]
+        size = func.count().label('size')
+        query = select([Value.value, size]).select_from(
+            Vocabulary.__table__.join(
+                Value.__table__, Value.id == Vocabulary.value_id)
+        ).group_by(Vocabulary.value_id).order_by(size.desc(), Value.value)
+        if limit is not None:
+            query = query.limit(limit)
+        return [tuple(row) for row in session.execute(query).fetchall()]
+
+    def vocabulary_size(self, field, value, session=None):
+        """
+        Return the size of the vocabulary of the value of the field.
+        """
 
-    def pick_entry_point(self, data, session):
+        if session is None:
+            session = self._sessions()
+
+        Value, Vocabulary = self.vocabularies[field]
+        return session.execute(
+            select([func.count()]).select_from(Vocabulary.__table__).where(
+                Vocabulary.value_id == select([Value.id]).where(
+                    Value.value == value).as_scalar())
+        ).scalar()
+
+    def compute_stats(self, connection):
+        result = super(XMPPGraph, self).compute_stats(connection)
+        vocabularies = {}
+        for field, (Value, Vocabulary) in sorted(self.vocabularies.items()):
+            sizes = select([func.count().label('size')]).select_from(
+                Vocabulary.__table__).group_by(Vocabulary.value_id).alias()
+            count, total, largest = connection.execute(select([
+                func.count(), func.sum(sizes.c.size), func.max(sizes.c.size),
+            ]).select_from(sizes)).first()
+            vocabularies[field] = {
+                'count': count,
+                'mean': (total or 0) / count if count else 0.0,
+                'max': largest or 0,
+            }
+        result['vocabulary'] = vocabularies
+        return result
+
+    def scope(self, data):
         """
-        Return a state_transition based on arguments.  Return value must
-        be a StateTransition type, that can serve as the starting
-        value for the generate method.
+        Return a select of the ids of the sentences logged with the jid,
+        muc and nickname in data, within the since and until timestamps.
         """
 
-        jid = data.get('jid')
-        if not jid:
-            # XXX what about nickname and muc??
-            # only rely on jid for the mean time, figure out the metrics
-            # for mapping nickname + muc to jid
-            return super(XMPPGraph, self).pick_entry_point(data, session)
-
-        insq = session.query(self.Fragment).select_from(
-            self.Fragment).join(
-                self.XMPPLog,
-                self.XMPPLog.sentence_id == self.Fragment.sentence_id
-            ).join(self.JID).filter(self.JID.value == jid)
-
-        # create temporary table
-        # checkfirst as some implementations keep them around...
-        self.FragmentTemp.__table__.create(
-            bind=session.connection(), checkfirst=True)
-
-        # directly poking at the table.
-        # TODO figure out ORM equivalent...
-        session.execute(self.FragmentTemp.__table__.insert().from_select(
-            self.Fragment.__table__.columns, insq))
-
-        count = session.query(self.FragmentTemp).count()
-
-        if not count:
-            raise KeyError('failed to find fragments for jid <%s>', jid)
-
-        fragment = session.query(self.FragmentTemp).offset(
-            int(random() * count)).first()
-        logger.debug('picked fragment_id %d', fragment.id)
-
-        # bind the Fragment table reference to the session object
-        session.Fragment = self.FragmentTemp
-        return fragment
+        XMPPLog = self.XMPPLog
+        source = XMPPLog.__table__
+        conditions = []
+        for key, Value, column in (
+                ('jid', self.JID, XMPPLog.jid_id),
+                ('muc', self.Muc, XMPPLog.muc_id),
+                ('nickname', self.Nickname, XMPPLog.nickname_id)):
+            value = data.get(key)
+            if value:
+                # resolve the value id first for the composite indexes.
+                conditions.append(column == select([Value.id]).where(
+                    Value.value == value).as_scalar())
+
+        Sentence = self.Sentence
+        time_conditions = self.time_conditions(data)
+        if not conditions:
+            if not time_conditions:
+                return None
+            # nothing to look up from the log.
+            return select([Sentence.id]).where(and_(*time_conditions))
+
+        if time_conditions:
+            source = source.join(
+                Sentence.__table__, Sentence.id == XMPPLog.sentence_id)
+            conditions.extend(time_conditions)
+
+        return select([XMPPLog.sentence_id]).select_from(source).where(
+            and_(*conditions))
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk merging of the tables of one sqlite graph database into another.
+
+The source database is attached to the connection of the target, and
+every table is copied with a single INSERT ... SELECT in dependency
+order.  Rows of the value tables (words, jids and the like) are matched
+up by their unique value through a temporary mapping table of the source
+id to the target id, and all other rows are shifted past the largest id
+of the target table, with the foreign keys rewritten accordingly.
+
+Columns may also reference a value table by naming it as the 'value' in
+their info, without a foreign key, such that ids without a row (i.e. the
+default tenant 0) are kept as they are, or name it as 'packed' for the
+ids packed into bytes by pack_ids, which are remapped one by one.
+
+Tables with a column marked to be summed in its info, i.e. the count of
+an aggregated transition, are matched up by their unique constraint like
+the value tables, with the marked columns of the rows present in both
+added together.
+"""
+
+from sqlalchemy import text
+from sqlalchemy.schema import UniqueConstraint
+
+from .model import base
+from .utils import pack_ids
+from .utils import unpack_ids
+
+SCHEMA = 'merge_source'
+
+
+def quote(connection, name):
+    return connection.dialect.identifier_preparer.quote(name)
+
+
+def value_column(table):
+    """
+    Return the column that uniquely identifies the rows of a value
+    table, i.e. the word of a Word.
+    """
+
+    columns = [
+        column for column in table.columns
+        if column.unique and not column.primary_key]
+    if len(columns) != 1:
+        raise ValueError(
+            'value table %s requires exactly one unique column' % table.name)
+    return columns[0]
+
+
+def primary_key(table):
+    columns = list(table.primary_key.columns)
+    if len(columns) != 1:
+        raise ValueError(
+            'table %s requires a single column primary key' % table.name)
+    return columns[0]
+
+
+def foreign_key(column):
+    keys = list(column.foreign_keys)
+    if len(keys) > 1:  # pragma: no cover
+        raise ValueError('column %s has multiple foreign keys' % column)
+    return keys[0].column if keys else None
+
+
+def unique_columns(table):
+    """
+    Return the columns of the unique constraint of a summed table, i.e.
+    the words of an aggregated transition.
+    """
+
+    constraints = [
+        constraint for constraint in table.constraints
+        if isinstance(constraint, UniqueConstraint)]
+    if len(constraints) != 1:
+        raise ValueError(
+            'summed table %s requires exactly one unique constraint' %
+            table.name)
+    return list(constraints[0].columns)
+
+
+def summed(table):
+    return any(column.info.get('merge') == 'sum' for column in table.columns)
+
+
+def map_name(name):
+    return 'merge_map_%s' % name
+
+
+def remap_name(name):
+    return 'merge_remap_%s' % name
+
+
+def register_remap(connection, name):
+    """
+    Register the sql function that remaps the packed ids of the value
+    table through its mapping.
+    """
+
+    mapping = dict(connection.execute(text(
+        'SELECT old_id, new_id FROM temp.%s' % quote(
+            connection, map_name(name)))).fetchall())
+
+    def remap(raw):
+        return pack_ids([mapping[i] for i in unpack_ids(raw)])
+
+    connection.connection.create_function(remap_name(name), 1, remap)
+
+
+def merge_values(connection, table):
+    """
+    Copy the rows of the value table missing from the target, and fill
+    the mapping of the source ids to the target ids.
+    """
+
+    q = lambda name: quote(connection, name)
+    pk = q(primary_key(table).name)
+    value = q(value_column(table).name)
+    columns = [
+        q(column.name) for column in table.columns if not column.primary_key]
+    name = q(table.name)
+    mapping = q(map_name(table.name))
+
+    connection.execute(text(
+        'INSERT INTO main.%(name)s (%(columns)s) '
+        'SELECT %(source_columns)s FROM %(schema)s.%(name)s AS o '
+        'WHERE NOT EXISTS (SELECT 1 FROM main.%(name)s AS t '
+        'WHERE t.%(value)s = o.%(value)s) ORDER BY o.%(pk)s' % {
+            'name': name,
+            'schema': SCHEMA,
+            'columns': ', '.join(columns),
+            'source_columns': ', '.join('o.' + c for c in columns),
+            'value': value,
+            'pk': pk,
+        }))
+
+    connection.execute(text(
+        'CREATE TEMP TABLE %s '
+        '(old_id INTEGER PRIMARY KEY, new_id INTEGER NOT NULL)' % mapping))
+    connection.execute(text(
+        'INSERT INTO temp.%(mapping)s (old_id, new_id) '
+        'SELECT o.%(pk)s, t.%(pk)s FROM %(schema)s.%(name)s AS o '
+        'JOIN main.%(name)s AS t ON t.%(value)s = o.%(value)s' % {
+            'mapping': mapping,
+            'name': name,
+            'schema': SCHEMA,
+            'value': value,
+            'pk': pk,
+        }))
+
+
+def source_values(connection, table, value_tables, offsets, skip=()):
+    """
+    Return the names of the columns of the table other than the ones to
+    skip, the expressions of their remapped values from the source rows
+    aliased as o, and the joins to the mappings these require.
+    """
+
+    q = lambda name: quote(connection, name)
+    columns = []
+    values = []
+    joins = []
+    for column in table.columns:
+        if column.name in skip:
+            continue
+        columns.append(q(column.name))
+        target = foreign_key(column)
+        reference = column.info.get('value')
+        packed = column.info.get('packed')
+        source = 'o.' + q(column.name)
+        if packed in value_tables:
+            values.append('%s(%s)' % (remap_name(packed), source))
+        elif reference in value_tables:
+            alias = 'm%d' % len(joins)
+            joins.append('LEFT JOIN temp.%s AS %s ON %s.old_id = %s' % (
+                q(map_name(reference)), alias, alias, source))
+            values.append('COALESCE(%s.new_id, %s)' % (alias, source))
+        elif target is None:
+            values.append(source)
+        elif target.table.name in value_tables:
+            alias = 'm%d' % len(joins)
+            joins.append('JOIN temp.%s AS %s ON %s.old_id = %s' % (
+                q(map_name(target.table.name)), alias, alias, source))
+            values.append(alias + '.new_id')
+        elif target.table.name in offsets:
+            values.append('%s + %d' % (source, offsets[target.table.name]))
+        else:  # pragma: no cover
+            raise ValueError('cannot remap column %s' % column)
+    return columns, values, joins
+
+
+def merge_rows(connection, table, value_tables, offsets, skip_existing):
+    """
+    Copy all rows of the table with the primary key shifted past the
+    largest one in the target, and the foreign keys remapped.  Rows with
+    an unique value already in the target are skipped if skip_existing.
+    """
+
+    q = lambda name: quote(connection, name)
+    pk = primary_key(table)
+    name = q(table.name)
+    offset = connection.execute(text(
+        'SELECT COALESCE(MAX(%s), 0) FROM main.%s' % (q(pk.name), name)
+    )).scalar()
+    offsets[table.name] = offset
+
+    columns, values, joins = source_values(
+        connection, table, value_tables, offsets, skip=(pk.name,))
+    columns.append(q(pk.name))
+    values.append('o.%s + %d' % (q(pk.name), offset))
+
+    conditions = ''
+    if skip_existing:
+        value = q(value_column(table).name)
+        conditions = (
+            ' WHERE NOT EXISTS (SELECT 1 FROM main.%s AS t '
+            'WHERE t.%s = o.%s)' % (name, value, value))
+
+    # the unique constraints of index tables may already be satisfied
+    # through the rows from the target.
+    connection.execute(text(
+        'INSERT OR IGNORE INTO main.%s (%s) SELECT %s FROM %s.%s AS o %s%s '
+        'ORDER BY o.%s' % (
+            name, ', '.join(columns), ', '.join(values), SCHEMA, name,
+            ' '.join(joins), conditions, q(pk.name),
+        )))
+
+
+def merge_summed(connection, table, value_tables, offsets):
+    """
+    Copy the rows of the table missing from the target by its unique
+    constraint, add the summed columns of the ones present in both, and
+    fill the mapping of the source ids to the target ids.
+    """
+
+    q = lambda name: quote(connection, name)
+    pk = q(primary_key(table).name)
+    name = q(table.name)
+    mapping = q(map_name(table.name))
+    columns, values, joins = source_values(
+        connection, table, value_tables, offsets,
+        skip=(primary_key(table).name,))
+    remapped = dict(zip(columns, values))
+    key = [q(column.name) for column in unique_columns(table)]
+    totals = [
+        q(column.name) for column in table.columns
+        if column.info.get('merge') == 'sum']
+
+    # the WHERE is required for the upsert to be parsed after the joins.
+    connection.execute(text(
+        'INSERT INTO main.%(name)s (%(columns)s) '
+        'SELECT %(values)s FROM %(schema)s.%(name)s AS o %(joins)s '
+        'WHERE 1 ORDER BY o.%(pk)s '
+        'ON CONFLICT (%(key)s) DO UPDATE SET %(totals)s' % {
+            'name': name,
+            'schema': SCHEMA,
+            'columns': ', '.join(columns),
+            'values': ', '.join(values),
+            'joins': ' '.join(joins),
+            'pk': pk,
+            'key': ', '.join(key),
+            'totals': ', '.join(
+                '%s = %s + excluded.%s' % (c, c, c) for c in totals),
+        }))
+
+    connection.execute(text(
+        'CREATE TEMP TABLE %s '
+        '(old_id INTEGER PRIMARY KEY, new_id INTEGER NOT NULL)' % mapping))
+    connection.execute(text(
+        'INSERT INTO temp.%(mapping)s (old_id, new_id) '
+        'SELECT o.%(pk)s, t.%(pk)s FROM %(schema)s.%(name)s AS o '
+        '%(joins)s JOIN main.%(name)s AS t ON %(key)s' % {
+            'mapping': mapping,
+            'name': name,
+            'schema': SCHEMA,
+            'joins': ' '.join(joins),
+            'pk': pk,
+            'key': ' AND '.join(
+                't.%s = %s' % (c, remapped[c]) for c in key),
+        }))
+
+
+def merge_tables(connection, tables, classes):
+    """
+    Merge the tables of the model classes from the source database that
+    is attached to the connection.
+    """
+
+    value_tables = set()
+    digest_tables = set()
+    for cls in classes.values():
+        if issubclass(cls, (base.Value, base.State)):
+            value_tables.add(cls.__tablename__)
+        elif issubclass(cls, base.Digest):
+            digest_tables.add(cls.__tablename__)
+
+    existing = set(row[0] for row in connection.execute(text(
+        "SELECT name FROM %s.sqlite_master WHERE type = 'table'" % SCHEMA)))
+
+    packed_tables = set(
+        column.info['packed'] for table in tables
+        for column in table.columns if column.info.get('packed'))
+
+    offsets = {}
+    # the value tables are not necessarily ordered before the tables
+    # that reference them through the info of their columns.
+    tables = sorted(tables, key=lambda table: table.name not in value_tables)
+    # the summed tables are mapped like the value tables.
+    mapped_tables = set(value_tables)
+    try:
+        for table in tables:
+            if table.name not in existing:
+                # the source graph was created without this model.
+                continue
+            if table.name in value_tables:
+                merge_values(connection, table)
+                if table.name in packed_tables:
+                    register_remap(connection, table.name)
+            elif summed(table):
+                merge_summed(connection, table, mapped_tables, offsets)
+                mapped_tables.add(table.name)
+            else:
+                merge_rows(
+                    connection, table, mapped_tables, offsets,
+                    table.name in digest_tables)
+    finally:
+        for name in mapped_tables:
+            connection.execute(text(
+                'DROP TABLE IF EXISTS temp.%s' % quote(
+                    connection, map_name(name))))
+    return offsets
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+A minimal registry of counters and histograms, exported in the text
+format of Prometheus, either served over HTTP or dumped to a file.
+
+The graphs are only instrumented when given a GraphMetrics, such that
+the cost while disabled is a single attribute check per call.
+"""
+
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+import os
+from threading import Lock
+from threading import Thread
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# upper bounds of the latency buckets, in seconds.
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0,
+)
+
+# the keys of the data that scope the generation, for the breakdown of
+# the metrics by the kind of scope without a label for every value.
+SCOPE_KEYS = (
+    'word', 'words', 'jid', 'muc', 'nickname', 'since', 'until', 'tenant')
+
+
+def escape(value):
+    return (
+        str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+            '\n', '\\n'))
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, escape(value)) for name, value in pairs)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+    """
+    A metric with a child state for each combination of label values.
+    """
+
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.children = {}
+        self.lock = Lock()
+
+    def samples(self):
+        """
+        Generate the name, the labels and the value of each sample.
+        """
+
+        raise NotImplementedError
+
+    def export(self):
+        lines = [
+            '# HELP %s %s' % (self.name, self.help.replace('\n', ' ')),
+            '# TYPE %s %s' % (self.name, self.type),
+        ]
+        for name, labels, value in self.samples():
+            lines.append('%s%s %s' % (name, labels, format_value(value)))
+        return lines
+
+
+class Counter(Metric):
+
+    type = 'counter'
+
+    def inc(self, *values, **kw):
+        amount = kw.get('amount', 1)
+        with self.lock:
+            self.children[values] = self.children.get(values, 0) + amount
+
+    def value(self, *values):
+        return self.children.get(values, 0)
+
+    def samples(self):
+        with self.lock:
+            children = sorted(self.children.items())
+        for values, count in children:
+            yield self.name, format_labels(self.labels, values), count
+
+
+class Histogram(Metric):
+    """
+    A histogram with fixed buckets, which only counts the bucket that
+    each observation falls into; the counts are made cumulative on
+    export.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *values):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            child = self.children.get(values)
+            if child is None:
+                # the counts of the buckets plus the overflow, the sum.
+                child = self.children[values] = [
+                    [0] * (len(self.buckets) + 1), 0.0]
+            child[0][index] += 1
+            child[1] += value
+
+    def count(self, *values):
+        child = self.children.get(values)
+        return 0 if child is None else sum(child[0])
+
+    def quantile(self, q, *values):
+        """
+        Return the upper bound of the bucket holding the q quantile of
+        the observations, i.e. 0.99 for the p99.
+        """
+
+        child = self.children.get(values)
+        if child is None:
+            return None
+        counts = child[0]
+        rank = q * sum(counts)
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            total += count
+            if total >= rank:
+                return bound
+
+    def samples(self):
+        with self.lock:
+            children = sorted(
+                (values, (list(child[0]), child[1]))
+                for values, child in self.children.items())
+        bounds = self.buckets + (float('inf'),)
+        for values, (counts, total) in children:
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                yield self.name + '_bucket', format_labels(
+                    self.labels, values, [('le', format_value(bound))]
+                ), cumulative
+            labels = format_labels(self.labels, values)
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, cumulative
+
+
+class Registry(object):
+    """
+    The collection of metrics to be exported together.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = Lock()
+
+    def _register(self, cls, name, *a, **kw):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *a, **kw)
+            elif not isinstance(metric, cls):
+                raise ValueError(
+                    'metric %s already registered as %s' % (
+                        name, metric.type))
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter, name, help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help, labels, buckets)
+
+    def export(self):
+        """
+        Return all the metrics in the Prometheus text format.
+        """
+
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+        lines = []
+        for name, metric in metrics:
+            lines.extend(metric.export())
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path):
+        """
+        Write the export into the file at path, replaced atomically such
+        that a collector never reads a partial file.
+        """
+
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as stream:
+            stream.write(self.export())
+        os.replace(tmp, path)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    registry = None
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.export().encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(registry, host='127.0.0.1', port=0):
+    """
+    Serve the export of the registry over HTTP from a daemon thread, and
+    return the server; its server_address has the actual port.
+    """
+
+    handler = type(
+        'MetricsHandler', (MetricsHandler,), {'registry': registry})
+    server = HTTPServer((host, port), handler)
+    thread = Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def scope_of(data):
+    """
+    Return the label for the kind of scope of the data.
+    """
+
+    return '+'.join(key for key in SCOPE_KEYS if data.get(key)) or 'none'
+
+
+class GraphMetrics(object):
+    """
+    The metrics of the learn and generate calls of a graph, which graphs
+    sharing a registry also share.
+    """
+
+    def __init__(self, registry=None, prefix='mtj_markov'):
+        self.registry = Registry() if registry is None else registry
+        self.learn_seconds = self.registry.histogram(
+            prefix + '_learn_seconds', 'Latency of learn.')
+        self.learn_errors = self.registry.counter(
+            prefix + '_learn_errors_total', 'Errors while learning.',
+            ('error',))
+        self.generate_seconds = self.registry.histogram(
+            prefix + '_generate_seconds', 'Latency of generate by scope.',
+            ('scope',))
+        self.generate_errors = self.registry.counter(
+            prefix + '_generate_errors_total',
+            'Errors while generating by scope, including KeyError for '
+            'data without an entry point.', ('scope', 'error'))
+
+    def learned(self, seconds, error=None):
+        self.learn_seconds.observe(seconds)
+        if error is not None:
+            self.learn_errors.inc(type(error).__name__)
+
+    def generated(self, data, seconds, error=None):
+        scope = scope_of(data)
+        self.generate_seconds.observe(seconds, scope)
+        if error is not None:
+            self.generate_errors.inc(scope, type(error).__name__)
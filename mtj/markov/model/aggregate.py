@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Aggregated sentence model.
+
+Rather than storing every fragment of every sentence, each unique
+transition is stored only once along with the number of times it has
+been seen.
+"""
+
+from collections import Counter
+
+from sqlalchemy.orm import relationship
+from sqlalchemy.schema import ForeignKey
+from sqlalchemy.schema import Column
+from sqlalchemy.schema import Index
+from sqlalchemy.schema import UniqueConstraint
+from sqlalchemy.types import Integer
+from sqlalchemy.ext.declarative import declared_attr
+
+from ..utils import nchain
+
+from . import base
+from . import sentence
+from .sentence import Sentence
+from .sentence import SentenceDigest
+from .sentence import Word
+
+__all__ = [
+    'Sentence', 'Word', 'Transition', 'IndexWordTransition',
+    'TransitionSentence', 'SentenceDigest', 'Loader',
+]
+
+
+class Transition(base.StateTransition):
+    """
+    A unique transition of 3 word states, with the number of times it
+    occurred.
+    """
+
+    __tablename__ = 'transition'
+
+    id = Column(Integer(), primary_key=True, nullable=False)
+    # the counts of the same transition in merged graphs are summed.
+    count = Column(
+        Integer(), nullable=False, default=0, info={'merge': 'sum'})
+
+    @declared_attr
+    def l_word_id(cls):
+        return Column(Integer(), ForeignKey('word.id'), nullable=False)
+
+    @declared_attr
+    def word_id(cls):
+        return Column(Integer(), ForeignKey('word.id'), nullable=False)
+
+    @declared_attr
+    def r_word_id(cls):
+        return Column(Integer(), ForeignKey('word.id'), nullable=False)
+
+    # the unique constraint doubles as the index for the lookups from
+    # the left.
+    @declared_attr
+    def lwr(cls):
+        return UniqueConstraint(cls.l_word_id, cls.word_id, cls.r_word_id)
+
+    @declared_attr
+    def idx_transition_r_word(cls):
+        return Index('idx_transition_r_word', cls.word_id, cls.r_word_id)
+
+    def __init__(self, l_word_id, word_id, r_word_id, count=0):
+        self.l_word_id = l_word_id
+        self.word_id = word_id
+        self.r_word_id = r_word_id
+        self.count = count
+
+    def list_states(self):
+        return (
+            self.l_word_id,
+            self.word_id,
+            self.r_word_id,
+        )
+
+
+class IndexWordTransition(base.Index):
+    """
+    Look up normalized word to transition, like IndexWordFragment.
+    """
+
+    __tablename__ = 'idx_word_transition'
+
+    id = Column(Integer(), primary_key=True, nullable=False)
+
+    @declared_attr
+    def word_id(cls):
+        return Column(
+            Integer(), ForeignKey('word.id'), index=True, nullable=False)
+
+    @declared_attr
+    def transition_id(cls):
+        return Column(Integer(), ForeignKey('transition.id'), nullable=False)
+
+    @declared_attr
+    def wt(cls):
+        return UniqueConstraint(cls.word_id, cls.transition_id)
+
+    def __init__(self, word_id, transition_id):
+        self.word_id = word_id
+        self.transition_id = transition_id
+
+
+class TransitionSentence(base.Index):
+    """
+    The provenance of a transition, i.e. which sentences it came from
+    and the number of times it occurred within them.  Only required for
+    restricting generation to specific sentences.
+    """
+
+    __tablename__ = 'transition_sentence'
+
+    id = Column(Integer(), primary_key=True, nullable=False)
+    count = Column(Integer(), nullable=False)
+
+    @declared_attr
+    def transition_id(cls):
+        return Column(Integer(), ForeignKey('transition.id'), nullable=False)
+
+    @declared_attr
+    def sentence_id(cls):
+        return Column(
+            Integer(), ForeignKey('sentence.id'), index=True, nullable=False)
+
+    @declared_attr
+    def sentence(cls):
+        return relationship('Sentence', foreign_keys=cls.sentence_id)
+
+    @declared_attr
+    def idx_transition_sentence(cls):
+        return Index('idx_transition_sentence',
+                     cls.transition_id, cls.sentence_id)
+
+    def __init__(self, transition_id, sentence, count):
+        self.transition_id = transition_id
+        self.sentence = sentence
+        self.count = count
+
+
+class Loader(sentence.Loader):
+
+    def __init__(self, graph):
+        super(Loader, self).__init__(graph)
+        self.provenance = graph.provenance
+
+    def __call__(self, session, raw, datum, Word=None, Transition=None,
+                 IndexWordTransition=None, TransitionSentence=None,
+                 **classes):
+        """
+        The learner.
+        """
+
+        source = raw.split()
+        if len(source) < self.min_sentence_length:
+            return []
+        words = [''] + source + ['']
+        word_map = self.gen_word_dict(session, words, Word)
+        # the ids are required for the transition lookups.
+        session.flush()
+
+        counts = Counter(
+            tuple(word_map[w].id for w in chain)
+            for chain in nchain(3, words)
+        )
+        normalized = {
+            word_map[w].id: word_map[self.normalize(w)].id for w in words}
+
+        for ids, count in counts.items():
+            transition = session.query(Transition).filter(
+                (Transition.l_word_id == ids[0]) &
+                (Transition.word_id == ids[1]) &
+                (Transition.r_word_id == ids[2])
+            ).first()
+            if transition is None:
+                transition = Transition(*ids)
+                session.add(transition)
+                session.flush()
+                session.add(IndexWordTransition(
+                    normalized[ids[1]], transition.id))
+            transition.count = Transition.count + count
+            if self.provenance:
+                session.add(TransitionSentence(transition.id, datum, count))
@@ -40,6 +40,14 @@ class Value(Node):
                 session.merge(cls(value)))
 
 
+class Tenant(Value):
+    """
+    A named tenant, i.e. one of the logical graphs that share the same
+    tables.  The data of the default tenant has the id 0, which has no
+    row in the table.
+    """
+
+
 class Datum(Node):
     """
     Base class for the representation of a single unit of data to be
@@ -89,6 +97,19 @@ class Index(Node):
     """
 
 
+class Digest(Index):
+    """
+    Base class for the digest of the content of a Datum, such that any
+    repeated data can be detected and referenced.
+
+    It should provide the digest and the datum it references.
+    """
+
+    def __init__(self, digest, datum):
+        self.digest = digest
+        self.datum = datum
+
+
 class StateTransition(Node):
     """
     Base class for describing state transition using States.
@@ -127,6 +148,15 @@ class Loader(object):
     Loads stuff into a state graph.
     """
 
+    def digest(self, raw):
+        """
+        Return a digest of the raw content to be loaded, for the
+        detection of repeated data.  Loaders that only load metadata
+        about the data should return None.
+        """
+
+        return None
+
 
 class StateGraph(Graph):
     """
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Optional trigram index over the normalized words, for resolving words
+unknown to the graph to the nearest known ones, i.e. typos or plurals.
+"""
+
+from sqlalchemy import select
+from sqlalchemy.orm import relationship
+from sqlalchemy.schema import ForeignKey
+from sqlalchemy.schema import Column
+from sqlalchemy.schema import UniqueConstraint
+from sqlalchemy.types import Integer
+from sqlalchemy.types import String
+from sqlalchemy.ext.declarative import declared_attr
+
+from . import base
+from . import sentence
+
+__all__ = [
+    'WordTrigram',
+    'Loader',
+]
+
+
+def trigrams(word):
+    """
+    Return the set of trigrams of the word, padded such that the start
+    and the end of the word are also represented.
+    """
+
+    padded = u'  %s ' % word
+    return set(padded[c:c + 3] for c in range(len(padded) - 2))
+
+
+class WordTrigram(base.Index):
+    """
+    Look up trigram to the normalized words that contain them.
+    """
+
+    __tablename__ = 'word_trigram'
+
+    id = Column(Integer(), primary_key=True, nullable=False)
+    trigram = Column(String(length=3), nullable=False)
+
+    @declared_attr
+    def word_id(cls):
+        return Column(
+            Integer(), ForeignKey('word.id'), index=True, nullable=False)
+
+    @declared_attr
+    def word(cls):
+        return relationship('Word', foreign_keys=cls.word_id)
+
+    @declared_attr
+    def tw(cls):
+        return UniqueConstraint(cls.trigram, cls.word_id)
+
+    def __init__(self, trigram, word):
+        self.trigram = trigram
+        self.word = word
+
+
+class Loader(sentence.Loader):
+    """
+    Index the trigrams of the normalized words from the raw sentence
+    that are not yet indexed.
+    """
+
+    def digest(self, raw):
+        # already covered by the sentence.
+        return None
+
+    def __call__(self, session, raw, datum, Word=None, WordTrigram=None,
+                 **classes):
+        source = raw.split()
+        if len(source) < self.min_sentence_length:
+            return []
+
+        normalized = set(filter(None, (self.normalize(w) for w in source)))
+        word_map = self.gen_word_dict(session, sorted(normalized), Word)
+        # the ids are required for finding the indexed words.
+        session.flush()
+
+        indexed = set(row[0] for row in session.execute(
+            select([WordTrigram.word_id]).where(WordTrigram.word_id.in_(
+                [word_map[w].id for w in normalized])).distinct()
+        ).fetchall())
+
+        session.add_all(
+            WordTrigram(trigram, word_map[w])
+            for w in sorted(normalized) if word_map[w].id not in indexed
+            for trigram in sorted(trigrams(w))
+        )
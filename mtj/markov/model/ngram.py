@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Sentence model with a configurable markov order.
+
+Each n-gram of (order + 1) words is stored with its leading and
+trailing (order) word ids packed into the prefix and suffix keys, such
+that the next n-gram towards the right is the one with the prefix that
+matches the suffix, and vice versa.
+"""
+
+from sqlalchemy.orm import relationship
+from sqlalchemy.schema import ForeignKey
+from sqlalchemy.schema import Column
+from sqlalchemy.schema import Index
+from sqlalchemy.schema import UniqueConstraint
+from sqlalchemy.types import Integer
+from sqlalchemy.types import LargeBinary
+from sqlalchemy.ext.declarative import declared_attr
+
+from ..utils import nchain
+from ..utils import pack_ids
+from ..utils import unpack_ids
+
+from . import base
+from . import sentence
+from .sentence import Sentence
+from .sentence import SentenceDigest
+from .sentence import Word
+
+__all__ = [
+    'Sentence', 'Word', 'NGram', 'IndexWordNGram', 'SentenceDigest',
+    'Loader',
+]
+
+
+def padding(order):
+    """
+    Return the number of boundary words required on either side of a
+    sentence for the order, so that even a single word sentence will
+    produce n-grams.
+    """
+
+    return max(1, order - 1)
+
+
+def indexed_positions(order):
+    """
+    Return the positions within an n-gram of the words to be indexed,
+    i.e. the inner words, or just the right word for order 1.
+    """
+
+    return range(1, max(2, order))
+
+
+class NGram(base.StateTransition):
+    """
+    A fragment of a sentence of (order + 1) word states.
+    """
+
+    __tablename__ = 'ngram'
+
+    id = Column(Integer(), primary_key=True, nullable=False)
+    # the word ids are packed, which the merge remaps one by one.
+    prefix = Column(
+        LargeBinary(), nullable=False, index=True, info={'packed': 'word'})
+    suffix = Column(
+        LargeBinary(), nullable=False, index=True, info={'packed': 'word'})
+
+    @declared_attr
+    def sentence_id(cls):
+        # indexed for the quotes.
+        return Column(
+            Integer(), ForeignKey('sentence.id'), index=True, nullable=False)
+
+    @declared_attr
+    def l_word_id(cls):
+        return Column(Integer(), ForeignKey('word.id'), nullable=False)
+
+    @declared_attr
+    def r_word_id(cls):
+        return Column(Integer(), ForeignKey('word.id'), nullable=False)
+
+    @declared_attr
+    def sentence(cls):
+        return relationship('Sentence', foreign_keys=cls.sentence_id)
+
+    def __init__(self, sentence, word_ids):
+        self.sentence = sentence
+        self.prefix = pack_ids(word_ids[:-1])
+        self.suffix = pack_ids(word_ids[1:])
+        self.l_word_id = word_ids[0]
+        self.r_word_id = word_ids[-1]
+
+    def list_states(self):
+        return list(unpack_ids(self.prefix)) + [self.r_word_id]
+
+
+class IndexWordNGram(base.Index):
+    """
+    Look up normalized word to n-gram, like IndexWordFragment.
+    """
+
+    __tablename__ = 'idx_word_ngram'
+
+    id = Column(Integer(), primary_key=True, nullable=False)
+
+    @declared_attr
+    def word_id(cls):
+        return Column(
+            Integer(), ForeignKey('word.id'), index=True, nullable=False)
+
+    @declared_attr
+    def ngram_id(cls):
+        return Column(
+            Integer(), ForeignKey('ngram.id'), index=True, nullable=False)
+
+    @declared_attr
+    def ngram(cls):
+        return relationship('NGram', foreign_keys=cls.ngram_id)
+
+    @declared_attr
+    def wn(cls):
+        return UniqueConstraint(cls.word_id, cls.ngram_id)
+
+    def __init__(self, word_id, ngram):
+        self.word_id = word_id
+        self.ngram = ngram
+
+
+class Loader(sentence.Loader):
+
+    def __init__(self, graph):
+        super(Loader, self).__init__(graph)
+        self.order = graph.order
+
+    def __call__(self, session, raw, datum, Word=None, NGram=None,
+                 IndexWordNGram=None, **classes):
+        """
+        The learner.
+        """
+
+        source = raw.split()
+        if len(source) < self.min_sentence_length:
+            return []
+
+        pad = [''] * padding(self.order)
+        words = pad + source + pad
+        word_map = self.gen_word_dict(session, words, Word)
+        # the ids are required for the packed keys.
+        session.flush()
+
+        positions = indexed_positions(self.order)
+        ngrams = []
+        indexes = []
+        for chain in nchain(self.order + 1, words):
+            ngram = NGram(datum, [word_map[w].id for w in chain])
+            ngrams.append(ngram)
+            word_ids = set(
+                word_map[self.normalize(chain[i])].id
+                for i in positions if chain[i]
+            )
+            indexes.extend(IndexWordNGram(i, ngram) for i in word_ids)
+
+        session.add_all(ngrams)
+        session.add_all(indexes)
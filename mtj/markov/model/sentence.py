@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
+from hashlib import sha1
 from time import time
 
+from sqlalchemy import text
 from sqlalchemy.orm import relationship
 from sqlalchemy.schema import ForeignKey
 from sqlalchemy.schema import Column
@@ -18,23 +20,43 @@ from ..utils import nchain
 from . import base
 
 __all__ = [
-    'Sentence', 'Word', 'Fragment', 'IndexWordFragment',
-    'Loader',
+    'Tenant', 'Sentence', 'Word', 'Fragment', 'IndexWordFragment',
+    'SentenceDigest', 'Loader',
 ]
 
 
+def tenant_column():
+    # the tenant is referenced by value, such that the default tenant 0
+    # does not require a row.
+    return Column(
+        Integer(), nullable=False, default=0, info={'value': 'tenant'})
+
+
+class Tenant(base.Tenant):
+    __tablename__ = 'tenant'
+
+    id = Column(Integer(), primary_key=True, nullable=False)
+    value = Column(String(length=255), nullable=False, index=True,
+                   unique=True)
+
+
 class Sentence(base.Datum):
     __tablename__ = 'sentence'
 
     # metadata attaches to this.
     id = Column(Integer(), primary_key=True, nullable=False)
     # This is the most basic extended attribute.
-    timestamp = Column(Integer(), nullable=False)
+    timestamp = Column(Integer(), nullable=False, index=True)
 
-    def __init__(self, timestamp=None):
+    @declared_attr
+    def tenant_id(cls):
+        return tenant_column()
+
+    def __init__(self, timestamp=None, tenant_id=0):
         if timestamp is None:
             timestamp = int(time())
         self.timestamp = timestamp
+        self.tenant_id = tenant_id
 
 
 class Word(base.State):
@@ -54,6 +76,12 @@ class FragmentBase(object):
 
     id = Column(Integer(), primary_key=True, nullable=False)
 
+    # copied from the sentence, such that the lookups of a tenant are
+    # covered by the indexes.
+    @declared_attr
+    def tenant_id(cls):
+        return tenant_column()
+
     @declared_attr
     def sentence_id(cls):
         return Column(Integer(), nullable=False)
@@ -70,24 +98,45 @@ class FragmentBase(object):
     def r_word_id(cls):
         return Column(Integer(), nullable=False)
 
+    # The number of words before and after word within the sentence,
+    # i.e. the distance towards the start and the end of the sentence.
+    l_dist = Column(Integer(), nullable=False, default=0)
+    r_dist = Column(Integer(), nullable=False, default=0)
+
     # This is deferred to IndexWordFragment
     # idx_word = Index('word_id', 'word_id')
     @declared_attr
     def idx_l_word(cls):
-        return Index('idx_l_word', cls.word_id, cls.r_word_id)
+        return Index('idx_l_word', cls.tenant_id, cls.word_id, cls.r_word_id)
 
     @declared_attr
     def idx_r_word(cls):
-        return Index('idx_r_word', cls.l_word_id, cls.word_id)
+        return Index('idx_r_word', cls.tenant_id, cls.l_word_id, cls.word_id)
+
+    @declared_attr
+    def idx_sentence(cls):
+        # ordered by the position, for the words of the sentence.
+        return Index('idx_fragment_sentence', cls.sentence_id, cls.l_dist)
+
+    @declared_attr
+    def idx_first(cls):
+        # the first fragment of every sentence, for picking a sentence;
+        # only used by queries with the literal condition on l_dist.
+        return Index(
+            'idx_fragment_first', cls.tenant_id, cls.l_dist, cls.sentence_id,
+            sqlite_where=text('l_dist = 0'))
 
     # TODO figure out how to get all fragments associated with this
     # fragment at either directions.
 
-    def __init__(self, sentence, l_word, word, r_word):
+    def __init__(self, sentence, l_word, word, r_word, l_dist=0, r_dist=0):
+        self.tenant_id = sentence.tenant_id
         self.sentence = sentence
         self.l_word = l_word
         self.word = word
         self.r_word = r_word
+        self.l_dist = l_dist
+        self.r_dist = r_dist
 
     def list_states(self):
         # return the raw identifiers.
@@ -156,9 +205,13 @@ class IndexWordFragment(base.Index):
     # XXX probably don't need id as the primary key
     id = Column(Integer(), primary_key=True, nullable=False)
 
+    @declared_attr
+    def tenant_id(cls):
+        return tenant_column()
+
     @declared_attr
     def word_id(cls):
-        return Column(Integer(), ForeignKey('word.id'), index=True, nullable=False)
+        return Column(Integer(), ForeignKey('word.id'), nullable=False)
 
     @declared_attr
     def fragment_id(cls):
@@ -177,11 +230,35 @@ class IndexWordFragment(base.Index):
     def wc(cls):
         return UniqueConstraint(cls.word_id, cls.fragment_id)
 
+    @declared_attr
+    def idx_tenant_word(cls):
+        return Index('idx_word_fragment_tenant', cls.tenant_id, cls.word_id)
+
     def __init__(self, word, fragment):
+        self.tenant_id = fragment.tenant_id
         self.word = word
         self.fragment = fragment
 
 
+class SentenceDigest(base.Digest):
+    """
+    The digest of the normalized words of a sentence.
+    """
+
+    __tablename__ = 'sentence_digest'
+
+    id = Column(Integer(), primary_key=True, nullable=False)
+    digest = Column(String(length=40), nullable=False, index=True, unique=True)
+
+    @declared_attr
+    def sentence_id(cls):
+        return Column(Integer(), ForeignKey('sentence.id'), nullable=False)
+
+    @declared_attr
+    def datum(cls):
+        return relationship('Sentence', foreign_keys=cls.sentence_id)
+
+
 def lookup_words_by_words(words, session, Word):
     """
     Return all Words associated with the list of words
@@ -198,48 +275,64 @@ class Loader(base.Loader):
         self.min_sentence_length = graph.min_sentence_length
         self.normalize = graph.normalize
 
-    def __call__(self, session, raw, datum, Word=None, Sentence=None,
-                 Fragment=None, IndexWordFragment=None, **classes):
+    def digest(self, raw):
         """
-        The learner.
+        Digest of the normalized words.
+        """
+
+        return sha1(u'\0'.join(
+            self.normalize(w) for w in raw.split()).encode('utf8')
+        ).hexdigest()
+
+    def gen_word_dict(self, session, words, Word):
+        """
+        A dedicated method to generate a word dictionary that maps all
+        input words (plus their normalized form) into the actual objects
+        that are present inside the db.  If not they will be merged.
+
+        Returns a dictionary that maps all words to be used for fragment
+        generation.
         """
 
-        def _gen_word_dict(words):
-            """
-            A dedicated method to generate a word dictionary that maps all
-            input words (plus their normalized form) into the actual objects
-            that are present inside the db.  If not they will be merged.
+        # grab all of them with a single in statement.
+        results = lookup_words_by_words(
+            (set([self.normalize(w) for w in words] + words)),
+            session, Word)
 
-            Returns a dictionary that maps all words to be used for fragment
-            generation.
-            """
+        def merge(word):
+            if word in results:
+                return
+            # hopefully these are unique.
+            # results[word] = unique_merge(session, Word, word=word)
+            results[word] = session.merge(Word(word=word))
 
-            # grab all of them with a single in statement.
-            results = lookup_words_by_words(
-                (set([self.normalize(w) for w in words] + words)),
-                session, Word)
+        for word in words:
+            merge(word)
+            merge(self.normalize(word))
 
-            def merge(word):
-                if word in results:
-                    return
-                # hopefully these are unique.
-                # results[word] = unique_merge(session, Word, word=word)
-                results[word] = session.merge(Word(word=word))
+        word_filter = getattr(self.graph, 'word_filter', None)
+        if word_filter is not None:
+            word_filter.update(results)
 
-            for word in words:
-                merge(word)
-                merge(self.normalize(word))
+        return results
 
-            return results
+    def __call__(self, session, raw, datum, Word=None, Sentence=None,
+                 Fragment=None, IndexWordFragment=None, **classes):
+        """
+        The learner.
+        """
 
         def _merge_states(words):
-            word_map = _gen_word_dict(words)
+            word_map = self.gen_word_dict(session, words, Word)
 
             fragments = []
             indexes = []
 
-            for chain in nchain(3, words):
-                fragment = Fragment(datum, *(word_map[c] for c in chain))
+            length = len(words) - 2
+            for c, chain in enumerate(nchain(3, words)):
+                fragment = Fragment(
+                    datum, *(word_map[w] for w in chain),
+                    l_dist=c, r_dist=length - 1 - c)
                 fragments.append(fragment)
                 nword = word_map[self.normalize(chain[1])]
                 indexes.append(IndexWordFragment(nword, fragment))
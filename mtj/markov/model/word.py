@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Word model, for the generation of words one character at a time.
+
+The transitions are kept in memory by the word graph, so the tables
+here only serve as the optional persistence of its counts, with each
+row being the count of a character following a state of (order)
+characters, packed into a key.
+"""
+
+from sqlalchemy.schema import ForeignKey
+from sqlalchemy.schema import Column
+from sqlalchemy.schema import UniqueConstraint
+from sqlalchemy.types import Integer
+from sqlalchemy.types import LargeBinary
+from sqlalchemy.types import String
+from sqlalchemy.ext.declarative import declared_attr
+
+from ..utils import unpack_ids
+from ..word import has_word_char
+from ..word import normalize
+
+from . import base
+
+__all__ = [
+    'Character', 'CharacterCount', 'Loader',
+]
+
+
+def tokens(raw, normalize=normalize):
+    """
+    Generate the normalized words of the raw text that have at least a
+    word character.
+    """
+
+    for token in raw.split():
+        word = normalize(token)
+        if has_word_char.search(word):
+            yield word
+
+
+class Character(base.State):
+    __tablename__ = 'word_character'
+
+    # the ids are assigned by the graph, with 0 as the boundary.
+    id = Column(Integer(), primary_key=True, nullable=False,
+                autoincrement=False)
+    character = Column(String(length=8), nullable=False, unique=True)
+
+    def __init__(self, id, character):
+        self.id = id
+        self.character = character
+
+
+class CharacterCount(base.StateTransition):
+    __tablename__ = 'word_character_count'
+
+    id = Column(Integer(), primary_key=True, nullable=False)
+    # the ids of the preceding characters, packed.
+    state = Column(LargeBinary(), nullable=False)
+
+    @declared_attr
+    def character_id(cls):
+        return Column(
+            Integer(), ForeignKey('word_character.id'), nullable=False)
+
+    count = Column(Integer(), nullable=False, default=0)
+
+    @declared_attr
+    def sc(cls):
+        return UniqueConstraint(cls.state, cls.character_id)
+
+    def list_states(self):
+        return list(unpack_ids(self.state)) + [self.character_id]
+
+
+class Loader(base.Loader):
+    """
+    The key of the raw text in the table learned by the word graph, of
+    which the words are learned.
+    """
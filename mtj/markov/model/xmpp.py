@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+from sqlalchemy import literal
+from sqlalchemy import select
 from sqlalchemy.orm import relationship
 from sqlalchemy.schema import ForeignKey
 from sqlalchemy.schema import Column
@@ -12,7 +14,7 @@ from sqlalchemy.ext.declarative import declared_attr
 from . import base
 
 __all__ = [
-    'JID', 'Muc', 'Nickname', 'XMPPLog',
+    'JID', 'Muc', 'Nickname', 'XMPPLog', 'JIDWord', 'MucWord',
     'Loader',
 ]
 
@@ -87,6 +89,22 @@ class XMPPLog(base.Index):
         return Column(
             Integer(), ForeignKey('xmpp_nickname.id'), nullable=False)
 
+    # indexes, leading with the id of each value the sentences can be
+    # scoped by, such that the sentence ids are covered.
+
+    @declared_attr
+    def idx_jid_sentence(cls):
+        return Index('idx_xmpp_log_jid_sentence', cls.jid_id, cls.sentence_id)
+
+    @declared_attr
+    def idx_muc_sentence(cls):
+        return Index('idx_xmpp_log_muc_sentence', cls.muc_id, cls.sentence_id)
+
+    @declared_attr
+    def idx_nickname_sentence(cls):
+        return Index(
+            'idx_xmpp_log_nickname_sentence', cls.nickname_id, cls.sentence_id)
+
     # relationships
 
     @declared_attr
@@ -112,6 +130,52 @@ class XMPPLog(base.Index):
         self.nickname = nickname
 
 
+class VocabularyBase(object):
+    """
+    The distinct normalized words used with a value, as a summary that
+    is maintained as the sentences are learned.
+    """
+
+    id = Column(Integer(), primary_key=True, nullable=False)
+
+    @declared_attr
+    def word_id(cls):
+        return Column(Integer(), ForeignKey('word.id'), nullable=False)
+
+
+class JIDWord(VocabularyBase, base.Index):
+    """
+    The vocabulary of each jid.
+    """
+
+    __tablename__ = 'xmpp_jid_word'
+
+    @declared_attr
+    def value_id(cls):
+        return Column(Integer(), ForeignKey('xmpp_jid.id'), nullable=False)
+
+    # the unique constraint doubles as the index for the counts.
+    @declared_attr
+    def vw(cls):
+        return UniqueConstraint(cls.value_id, cls.word_id)
+
+
+class MucWord(VocabularyBase, base.Index):
+    """
+    The vocabulary of each muc.
+    """
+
+    __tablename__ = 'xmpp_muc_word'
+
+    @declared_attr
+    def value_id(cls):
+        return Column(Integer(), ForeignKey('xmpp_muc.id'), nullable=False)
+
+    @declared_attr
+    def vw(cls):
+        return UniqueConstraint(cls.value_id, cls.word_id)
+
+
 def lookup_words_by_words(words, session, Word):
     """
     Return all Words associated with the list of words
@@ -132,9 +196,25 @@ class Loader(base.Loader):
     # the classes defined that are missing will result in sql errors,
     # as they will no longer be the one that understand the protocol.
 
+    def update_vocabulary(self, session, Vocabulary, value, datum,
+                          Fragment, IndexWordFragment):
+        """
+        Add the indexed words of the sentence to the vocabulary of the
+        value.
+        """
+
+        words = select([
+            literal(value.id), IndexWordFragment.word_id,
+        ]).select_from(IndexWordFragment.__table__.join(
+            Fragment.__table__, Fragment.id == IndexWordFragment.fragment_id)
+        ).where(Fragment.sentence_id == datum.id).distinct()
+        session.execute(Vocabulary.__table__.insert().prefix_with(
+            'OR IGNORE').from_select(['value_id', 'word_id'], words))
+
     def __call__(self, session, raw, datum,
                  JID=None, Muc=None, Nickname=None, XMPPLog=None,
-                 **classes):
+                 JIDWord=None, MucWord=None, Fragment=None,
+                 IndexWordFragment=None, **classes):
         """
         Loads things into the graph.
         """
@@ -145,3 +225,13 @@ class Loader(base.Loader):
 
         log = XMPPLog(sentence=datum, muc=muc, jid=jid, nickname=nickname)
         session.merge(log)
+
+        if IndexWordFragment is None:
+            # the vocabularies are only maintained from the fragments.
+            return
+        # for the ids of the values and the fragments of the sentence.
+        session.flush()
+        self.update_vocabulary(
+            session, JIDWord, jid, datum, Fragment, IndexWordFragment)
+        self.update_vocabulary(
+            session, MucWord, muc, datum, Fragment, IndexWordFragment)
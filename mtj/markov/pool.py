@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+A pool of pregenerated chains, so replies can be returned without
+waiting on the graph.
+"""
+
+from collections import deque
+from logging import getLogger
+from threading import Condition
+from threading import Thread
+from time import time
+
+logger = getLogger(__name__)
+
+
+def freeze(value):
+    """
+    Return a hashable equivalent of the value of a data field.
+    """
+
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def pool_key(data):
+    """
+    Return the pool key for the generation data, i.e. the sorted tuple
+    of all the fields that are set, as every one of them may change what
+    is generated, including the falsy ones such as a zero since.
+    """
+
+    return tuple(sorted(
+        (k, freeze(v)) for k, v in data.items() if v is not None))
+
+
+class PregeneratedPool(object):
+    """
+    Keeps up to `size` generated chains for every key requested, which
+    are refilled by the worker threads.
+
+    Chains older than `max_age` seconds, or ones generated before the
+    latest learn by more than `max_learns` learns, are discarded.
+    """
+
+    def __init__(self, graph, size=8, workers=1, max_age=None,
+                 max_learns=0, max_keys=1024):
+        self.graph = graph
+        self.size = size
+        self.max_age = max_age
+        self.max_learns = max_learns
+        self.max_keys = max_keys
+
+        # key to deque of (generation, timestamp, chain)
+        self.queues = {}
+        # key to the data that the chains are generated from.
+        self.data = {}
+        # keys to be refilled
+        self.pending = deque()
+        self.generation = 0
+        self.condition = Condition()
+        self.running = False
+        self.threads = [
+            Thread(target=self._worker, name='pool-worker-%d' % i)
+            for i in range(workers)
+        ]
+        for thread in self.threads:
+            thread.daemon = True
+
+        # metrics
+        self.hits = 0
+        self.misses = 0
+        self.refills = 0
+        self.refill_time = 0.0
+
+    def start(self):
+        self.running = True
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+
+    def _expired(self, entry, now):
+        generation, timestamp, chain = entry
+        return (
+            self.generation - generation > self.max_learns or
+            (self.max_age is not None and now - timestamp > self.max_age)
+        )
+
+    def _request(self, key):
+        # caller must hold the condition.
+        if key not in self.pending:
+            self.pending.append(key)
+            self.condition.notify()
+
+    def get(self, data, default=NotImplemented):
+        """
+        Return a pregenerated chain for the data, falling back to the
+        generate method of the graph.
+        """
+
+        key = pool_key(data)
+        now = time()
+        with self.condition:
+            queue = self.queues.get(key)
+            if queue is None and len(self.queues) < self.max_keys:
+                queue = self.queues[key] = deque()
+                self.data[key] = dict(data)
+            if queue is not None:
+                while queue:
+                    entry = queue.popleft()
+                    if not self._expired(entry, now):
+                        self.hits += 1
+                        self._request(key)
+                        return entry[2]
+                self._request(key)
+            self.misses += 1
+
+        return self.graph.generate(data, default)
+
+    def learn(self, *a, **kw):
+        """
+        Learn through the graph, which ages out the pregenerated chains.
+        """
+
+        result = self.graph.learn(*a, **kw)
+        with self.condition:
+            self.generation += 1
+            for key in self.queues:
+                self._request(key)
+        return result
+
+    def refill(self, key):
+        """
+        Top up the queue for key, discarding expired chains.
+        """
+
+        with self.condition:
+            queue = self.queues.get(key)
+            if queue is None:
+                return
+            data = self.data[key]
+            now = time()
+            fresh = [e for e in queue if not self._expired(e, now)]
+            queue.clear()
+            queue.extend(fresh)
+            missing = self.size - len(queue)
+
+        for i in range(missing):
+            start = time()
+            generation = self.generation
+            chain = self.graph.generate(data, None)
+            end = time()
+            with self.condition:
+                self.refills += 1
+                self.refill_time += end - start
+                if chain is None or len(queue) >= self.size:
+                    # nothing can be generated for this key, or another
+                    # worker got to it first.
+                    break
+                queue.append((generation, end, chain))
+
+    def _worker(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                key = self.pending.popleft()
+            try:
+                self.refill(key)
+            except Exception:
+                logger.exception('Unexpected error while refilling')
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / float(total) if total else 0.0
+
+    @property
+    def refill_latency(self):
+        """
+        The average time taken to generate a chain for a refill.
+        """
+
+        return self.refill_time / self.refills if self.refills else 0.0
+
+    def metrics(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'refills': self.refills,
+            'refill_latency': self.refill_latency,
+            'keys': len(self.queues),
+            'pregenerated': sum(len(q) for q in self.queues.values()),
+        }
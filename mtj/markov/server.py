@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+A prefork generation server.
+
+The graph is loaded once in the parent process and the workers are
+forked from it, such that they share the loaded state copy-on-write.
+Learning happens in the parent, and the workers are forked again for
+them to pick up the changes.
+"""
+
+from logging import getLogger
+import os
+from multiprocessing import cpu_count
+from multiprocessing import get_context
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+from multiprocessing.connection import Listener
+from threading import Lock
+from threading import Thread
+from time import time
+
+logger = getLogger(__name__)
+
+# The graph inherited by the forked workers.
+_graph = None
+
+
+def _init_worker():
+    reseed = getattr(getattr(_graph, 'random', None), 'reseed', None)
+    if reseed is not None:
+        # otherwise every worker draws the same numbers.
+        reseed()
+    engine = getattr(_graph, 'engine', None)
+    if engine is not None and engine.url.database not in (
+            None, '', ':memory:'):
+        # do not share the connections of the parent, but an in-memory
+        # database only exists through its connection so it is kept.
+        engine.dispose()
+    reset_snapshots = getattr(_graph, 'reset_snapshots', None)
+    if reset_snapshots is not None:
+        reset_snapshots()
+
+
+def _generate(args):
+    data, default = args
+    return _graph.generate(data, default)
+
+
+class GenerationServer(object):
+    """
+    Serve generate requests from a pool of forked worker processes.
+
+    After a learn the workers are reforked on the next request, but no
+    more often than every `reload_interval` seconds.
+    """
+
+    def __init__(self, graph, workers=None, reload_interval=0):
+        self.graph = graph
+        self.workers = workers or cpu_count()
+        self.reload_interval = reload_interval
+        self.pool = None
+        self.listener = None
+        self.authkey = None
+        self.allow_learn = False
+        self.stale = False
+        self.loaded = 0
+        self.lock = Lock()
+
+    def _start(self):
+        global _graph
+        _graph = self.graph
+        self.pool = get_context('fork').Pool(
+            self.workers, initializer=_init_worker)
+        self.stale = False
+        self.loaded = time()
+
+    def _close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def start(self):
+        with self.lock:
+            self._start()
+
+    def close(self):
+        with self.lock:
+            self._close()
+
+    def reload(self):
+        """
+        Fork a new set of workers off the current state of the graph,
+        after the current ones finished their work.
+        """
+
+        logger.debug('reloading workers')
+        with self.lock:
+            self._close()
+            self._start()
+
+    def _pool(self):
+        with self.lock:
+            if self.stale and time() - self.loaded >= self.reload_interval:
+                logger.debug('reloading stale workers')
+                self._close()
+                self._start()
+            return self.pool
+
+    def learn(self, *a, **kw):
+        result = self.graph.learn(*a, **kw)
+        self.stale = True
+        return result
+
+    def generate(self, data, default=NotImplemented):
+        return self._pool().apply(_generate, ((data, default),))
+
+    def generate_many(self, data, count, default=None):
+        """
+        Return a list of count chains generated from the data.
+        """
+
+        return self._pool().map(
+            _generate, [(data, default)] * count,
+            chunksize=max(1, count // (self.workers * 4)),
+        )
+
+    def serve_forever(self, address, authkey=None, allow_learn=False):
+        """
+        Serve requests from local clients connecting to address through
+        multiprocessing.connection.Client.  Requests are tuples of the
+        method name and its arguments, i.e. ('generate', (data,)) and
+        the reply is a tuple of an error and the result.
+
+        As the requests are unpickled, clients must authenticate with
+        the authkey; a random one is generated into self.authkey if none
+        is given.  learn is only served if allow_learn is set.
+        """
+
+        if authkey is None:
+            authkey = os.urandom(32)
+        self.authkey = authkey
+        self.allow_learn = allow_learn
+        listener = self.listener = Listener(address, authkey=authkey)
+        logger.info('serving on %r', listener.address)
+        try:
+            while True:
+                try:
+                    connection = listener.accept()
+                except (AuthenticationError, EOFError, ConnectionError):
+                    logger.warning('rejected a client failing to authenticate')
+                    continue
+                if self.listener is None:
+                    # woken up by shutdown.
+                    connection.close()
+                    return
+                thread = Thread(target=self._handle, args=(connection,))
+                thread.daemon = True
+                thread.start()
+        finally:
+            listener.close()
+
+    def shutdown(self):
+        """
+        Stop serve_forever from accepting further connections.
+        """
+
+        listener, self.listener = self.listener, None
+        if listener is not None:
+            # wake up the blocking accept.
+            Client(listener.address, authkey=self.authkey).close()
+
+    def _handle(self, connection):
+        methods = {
+            'generate': self.generate,
+            'generate_many': self.generate_many,
+        }
+        if self.allow_learn:
+            methods['learn'] = self.learn
+        with connection:
+            while True:
+                try:
+                    name, args = connection.recv()
+                except EOFError:
+                    return
+                try:
+                    connection.send((None, methods[name](*args)))
+                except Exception as e:
+                    connection.send((e, None))
@@ -1,4 +1,13 @@
 # -*- coding: utf-8 -*-
+from array import array
+from bisect import bisect_right
+from hashlib import blake2b
+from math import log
+from random import Random
+from threading import local
+import os
+import struct
+import sys
 
 
 def nchain(count, items):
@@ -22,3 +31,171 @@ def unique_merge(session, model, **kw):
     if not result:
         result = session.merge(model(**kw))
     return result
+
+
+def cumulative(weights):
+    """
+    Return the list of running totals of weights.
+    """
+
+    total = 0
+    result = []
+    for weight in weights:
+        total += weight
+        result.append(total)
+    return result
+
+
+def weighted_index(totals, value):
+    """
+    Return the index into the cumulative totals (as produced by the
+    cumulative function) where value, a number from 0 to 1, falls at.
+    """
+
+    return min(bisect_right(totals, value * totals[-1]), len(totals) - 1)
+
+
+def pack_ids(ids):
+    """
+    Pack a sequence of ids into bytes, as little-endian unsigned 32-bit
+    ints.
+    """
+
+    values = array('I', ids)
+    if sys.byteorder != 'little':  # pragma: no cover
+        values.byteswap()
+    return values.tobytes()
+
+
+def unpack_ids(raw):
+    """
+    Unpack bytes produced by pack_ids back into an array of ids.
+    """
+
+    values = array('I')
+    if raw:
+        values.frombytes(raw)
+        if sys.byteorder != 'little':  # pragma: no cover
+            values.byteswap()
+    return values
+
+
+class BloomFilter(object):
+    """
+    A set of strings that can only answer whether a string is definitely
+    not a member, or probably a member with the error_rate chance of a
+    false positive while no more than capacity strings were added.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * log(error_rate) / log(2) ** 2))
+        self.hashes = max(1, int(round(self.size / capacity * log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value):
+        # double hashing off a single digest.
+        h1, h2 = struct.unpack(
+            '<QQ', blake2b(value.encode('utf8'), digest_size=16).digest())
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add(self, value):
+        bits = self.bits
+        for position in self._positions(value):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    def __contains__(self, value):
+        bits = self.bits
+        return all(
+            bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(value)
+        )
+
+    @property
+    def saturated(self):
+        """
+        Whether more strings were added than the filter was sized for.
+        """
+
+        return self.count > self.capacity
+
+
+class ThreadLocalRandom(object):
+    """
+    A random number callable that keeps a separate generator for each
+    thread, created by the factory, such that concurrent generators do
+    not share any state.
+    """
+
+    def __init__(self, factory=None):
+        self.factory = factory or (lambda: Random().random)
+        self.local = local()
+
+    def __call__(self):
+        try:
+            return self.local.random()
+        except AttributeError:
+            random = self.local.random = self.factory()
+            return random()
+
+    def reseed(self):
+        """
+        Discard the generators such that new ones are created, i.e. for
+        forked processes to not repeat the numbers of the parent.
+        """
+
+        self.local = local()
+
+
+# the mantissa and the exponent bits of 1.0 in an IEEE 754 double.
+MANTISSA = (1 << 52) - 1
+ONE = 0x3ff << 52
+
+
+class BatchedRandom(object):
+    """
+    A random number callable that draws size numbers at a time in bulk,
+    from a single call for the random bits of the whole batch, for hot
+    loops where calling a generator for every number is expensive.  The
+    bits are taken from random, a random.Random, or from os.urandom if
+    not given.
+    """
+
+    def __init__(self, random=None, size=1024):
+        self.random = random
+        self.size = size
+        # the bits of the doubles in [1, 2) with the random mantissas;
+        # the masks span the whole batch, such that each draw is applied
+        # to the bits of all of the numbers at once.
+        lanes = sum(1 << (64 * i) for i in range(size))
+        self.mantissas = lanes * MANTISSA
+        self.exponents = lanes * ONE
+        self.batch = array('d')
+        self.index = size
+
+    def bits(self):
+        if self.random is None:
+            return int.from_bytes(os.urandom(8 * self.size), 'little')
+        return self.random.getrandbits(64 * self.size)
+
+    def refill(self):
+        bits = (self.bits() & self.mantissas) | self.exponents
+        self.batch = array('d')
+        self.batch.frombytes(bits.to_bytes(8 * self.size, 'little'))
+        if sys.byteorder != 'little':
+            self.batch.byteswap()
+        self.index = 0
+
+    def __call__(self):
+        if self.index >= self.size:
+            self.refill()
+        value = self.batch[self.index]
+        self.index += 1
+        return value - 1.0
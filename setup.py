@@ -29,5 +29,7 @@ setup(name='mtj.markov',
       ],
       entry_points="""
       # -*- Entry points: -*-
+      [console_scripts]
+      mtj-markov = mtj.markov.cli:main
       """,
       )
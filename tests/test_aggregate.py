@@ -0,0 +1,165 @@
+import unittest
+from collections import Counter
+from random import Random
+
+from mtj.markov.graph.aggregate import AggregateSentenceGraph
+from mtj.markov.graph.aggregate import AggregateXMPPGraph
+from mtj.markov.graph.sentence import SentenceGraph
+
+from mtj.markov.model import sentence
+from mtj.markov.model import xmpp
+
+
+class AggregateSentenceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = AggregateSentenceGraph(random=Random(0).random)
+        self.engine.initialize()
+
+    def test_learn_results(self):
+        engine = self.engine
+        for i in range(3):
+            engine.learn({sentence.Loader: 'hello world'})
+        engine.learn({sentence.Loader: 'hello there world'})
+
+        s = engine._sessions()
+        self.assertEqual(s.query(engine.Transition).count(), 5)
+        self.assertEqual(s.query(engine.IndexWordTransition).count(), 5)
+        # no provenance by default.
+        self.assertEqual(s.query(engine.TransitionSentence).count(), 0)
+        self.assertEqual(sorted(
+            t.count for t in s.query(engine.Transition).all()),
+            [1, 1, 1, 3, 3])
+
+    def test_stats(self):
+        engine = self.engine
+        for i in range(3):
+            engine.learn({sentence.Loader: 'hello world'})
+        engine.learn({sentence.Loader: 'hello there world'})
+        stats = engine.stats()
+        self.assertEqual(stats['transitions'], 5)
+        self.assertEqual(stats['branching']['lr']['max'], 2)
+        self.assertEqual(stats['top_words'][0], ('hello', 2))
+
+    def test_deadline(self):
+        engine = self.engine
+        engine.learn({sentence.Loader: 'a b c d e'})
+        result = engine.generate({'word': 'c'}, deadline=0)
+        self.assertEqual(result, 'b c d')
+        self.assertTrue(result.truncated)
+        engine.learn({sentence.Loader: 'b c d'})
+        result = engine.generate({'word': 'c'}, deadline=0)
+        self.assertEqual(result, 'b c d')
+        self.assertFalse(result.truncated)
+
+    def test_quote_unsupported(self):
+        engine = self.engine
+        engine.learn({sentence.Loader: 'hello world'})
+        with self.assertRaises(ValueError):
+            engine.quote(1)
+        with self.assertRaises(ValueError):
+            engine.random_quote({})
+        # unsupported is not mistaken for no sentences.
+        with self.assertRaises(ValueError):
+            engine.random_quote({}, None)
+
+    def test_learn_repeated_in_sentence(self):
+        engine = self.engine
+        engine.learn({sentence.Loader: 'a b a b a b'})
+        s = engine._sessions()
+        self.assertEqual(sorted(
+            t.count for t in s.query(engine.Transition).all()),
+            [1, 1, 2, 2])
+
+    def test_null_generate(self):
+        with self.assertRaises(KeyError):
+            self.engine.generate({'word': 'hi'})
+
+    def test_basic_generate(self):
+        engine = self.engine
+        engine.learn({sentence.Loader: 'how are you doing'})
+        self.assertEqual(
+            engine.generate({'word': 'you'}), 'how are you doing')
+        self.assertEqual(engine.generate({}), 'how are you doing')
+
+    def test_generate_weighted(self):
+        engine = self.engine
+        for i in range(9):
+            engine.learn({sentence.Loader: 'the cat sat'})
+        engine.learn({sentence.Loader: 'the dog sat'})
+        results = Counter(
+            engine.generate({'word': 'the'}) for i in range(200))
+        self.assertEqual(sorted(results), ['the cat sat', 'the dog sat'])
+        self.assertTrue(results['the cat sat'] > results['the dog sat'] * 4)
+
+    def test_same_distribution(self):
+        text = ['the cat sat'] * 3 + ['the cat ran', 'the dog sat']
+
+        def sample(cls):
+            engine = cls()
+            engine.initialize()
+            for p in text:
+                engine.learn({sentence.Loader: p})
+            return Counter(
+                engine.generate({'word': 'the'}) for i in range(200))
+
+        plain = sample(SentenceGraph)
+        aggregated = sample(AggregateSentenceGraph)
+        self.assertEqual(
+            sorted(aggregated), ['the cat ran', 'the cat sat', 'the dog sat'])
+        for key in plain:
+            self.assertTrue(abs(plain[key] - aggregated[key]) < 40)
+
+
+class AggregateXMPPTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = AggregateXMPPGraph(random=Random(0).random)
+        self.engine.initialize()
+
+    def learn(self, text, jid):
+        self.engine.learn({
+            sentence.Loader: text,
+            xmpp.Loader: {
+                'muc': 'room@chat.example.com',
+                'jid': jid,
+                'nick': jid,
+            }
+        })
+
+    def test_provenance(self):
+        engine = self.engine
+        self.learn('hello world', 'user1@example.com')
+        self.learn('hello world', 'user2@example.com')
+        s = engine._sessions()
+        self.assertEqual(s.query(engine.Transition).count(), 2)
+        self.assertEqual(s.query(engine.TransitionSentence).count(), 4)
+        self.assertEqual(s.query(engine.XMPPLog).count(), 2)
+
+    def test_jid_generate(self):
+        engine = self.engine
+        self.learn('she will be a bright star', 'user1@example.com')
+        self.learn('she will not be forgotten', 'user2@example.com')
+        for i in range(20):
+            self.assertEqual(
+                engine.generate({'jid': 'user2@example.com'}),
+                'she will not be forgotten')
+        with self.assertRaises(KeyError):
+            engine.generate({'jid': 'user3@example.com'})
+
+    def test_nickname_word_generate(self):
+        engine = self.engine
+        self.learn('she will be a bright star', 'user1@example.com')
+        self.learn('she will not be forgotten', 'user2@example.com')
+        for i in range(20):
+            self.assertEqual(
+                engine.generate({
+                    'nickname': 'user1@example.com', 'word': 'will'}),
+                'she will be a bright star')
+
+    def test_scope_without_provenance(self):
+        engine = AggregateSentenceGraph()
+        engine.initialize()
+        engine.learn({sentence.Loader: 'hello world'})
+        with self.assertRaises(ValueError):
+            engine.generate({'since': 0})
@@ -0,0 +1,127 @@
+import os
+import shutil
+import tempfile
+import unittest
+from random import Random
+
+from sqlalchemy import func
+from sqlalchemy import select
+
+from mtj.markov import columnar
+from mtj.markov.graph.ngram import NGramGraph
+from mtj.markov.graph.xmpp import XMPPGraph
+
+from mtj.markov.model import sentence
+from mtj.markov.model import xmpp
+
+
+class ColumnarTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'export')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def make_graph(self, cls=XMPPGraph, **kw):
+        graph = cls(random=Random(0).random, **kw)
+        graph.initialize()
+        return graph
+
+    def learn(self, graph):
+        for jid, text in (
+                ('user1@example.com', 'how are you doing'),
+                ('user2@example.com', u'I am fine, caf\xe9 is open.'),
+                ('user1@example.com', 'are you going to the caf\xe9')):
+            graph.learn({
+                sentence.Loader: text,
+                xmpp.Loader: {
+                    'muc': 'room@chat.example.com',
+                    'jid': jid,
+                    'nick': jid,
+                },
+            })
+
+    def counts(self, graph):
+        s = graph._sessions()
+        return {
+            table.name: s.execute(
+                select([func.count()]).select_from(table)).scalar()
+            for table in graph.model.metadata.sorted_tables
+        }
+
+    def test_column_roundtrip(self):
+        path = os.path.join(self.tempdir, 'column')
+        for type_, values in (
+                ('int', [0, 1, -1, 2 ** 40]),
+                ('text', [u'', u'caf\xe9', None]),
+                ('bytes', [b'\0\1', b'', None])):
+            writer = columnar.ColumnWriter(path, type_)
+            writer.write(values[:1])
+            writer.write(values[1:])
+            digest = writer.close()
+            self.assertEqual(digest, columnar.checksum(path))
+            self.assertEqual(list(columnar.read_column(path, type_)), values)
+
+    def test_roundtrip(self):
+        graph = self.make_graph()
+        self.learn(graph)
+        manifest = graph.export(self.path)
+        self.assertEqual(
+            [entry['name'] for entry in manifest['tables']],
+            [table.name for table in graph.model.metadata.sorted_tables])
+
+        restored = self.make_graph()
+        restored.import_(self.path)
+        self.assertEqual(self.counts(restored), self.counts(graph))
+
+        for data in ({'word': 'you'}, {'jid': 'user2@example.com'}):
+            self.assertEqual(
+                set(graph.generate(data) for i in range(20)),
+                set(restored.generate(data) for i in range(20)))
+
+        # further learning continues from the imported ids.
+        self.learn(restored)
+        self.assertEqual(
+            restored.generate({'word': 'fine,'}),
+            u'I am fine, caf\xe9 is open.')
+
+    def test_roundtrip_indexes(self):
+        graph = self.make_graph()
+        self.learn(graph)
+        graph.export(self.path)
+        restored = self.make_graph()
+        restored.import_(self.path)
+        s = restored._sessions()
+        indexes = set(row[0] for row in s.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'"))
+        self.assertIn('idx_fragment_sentence', indexes)
+        self.assertIn('idx_xmpp_log_jid_sentence', indexes)
+
+    def test_roundtrip_binary(self):
+        graph = self.make_graph(NGramGraph, order=3)
+        graph.learn({sentence.Loader: 'how are you doing'})
+        graph.export(self.path)
+        restored = self.make_graph(NGramGraph, order=3)
+        restored.import_(self.path)
+        self.assertEqual(
+            restored.generate({'word': 'are'}), 'how are you doing')
+
+    def test_checksum_mismatch(self):
+        graph = self.make_graph()
+        self.learn(graph)
+        graph.export(self.path)
+        with open(os.path.join(self.path, 'word.word'), 'ab') as stream:
+            stream.write(b'\0')
+        restored = self.make_graph()
+        with self.assertRaises(columnar.ChecksumError):
+            restored.import_(self.path)
+        self.assertEqual(set(self.counts(restored).values()), {0})
+
+    def test_import_non_empty(self):
+        graph = self.make_graph()
+        self.learn(graph)
+        graph.export(self.path)
+        with self.assertRaises(ValueError):
+            graph.import_(self.path)
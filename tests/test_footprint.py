@@ -0,0 +1,114 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import tracemalloc
+import unittest
+from random import Random
+
+from mtj.markov import cli
+from mtj.markov import footprint
+from mtj.markov.graph.sentence import SentenceGraph
+from mtj.markov.model import sentence
+
+
+class FootprintTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.graph = SentenceGraph(
+            word_filter=True, random=Random(0).random)
+        self.graph.initialize()
+        self.graph.learn({sentence.Loader: 'the quick brown fox'})
+
+    def test_component_of(self):
+        self.assertEqual(footprint.component_of(
+            '/usr/lib/python3/site-packages/sqlalchemy/orm/session.py'),
+            'sqlalchemy')
+        self.assertEqual(footprint.component_of(
+            'C:\\src\\mtj\\markov\\utils.py'), 'mtj.markov')
+        self.assertEqual(footprint.component_of('<frozen abc>'), 'other')
+
+    def test_memory_report(self):
+        self.graph.load_word_filter()
+        report = footprint.memory_report(
+            self.graph,
+            learn=[{sentence.Loader: 'the lazy dog'}],
+            generate=[{'word': 'quick'}, {'word': 'dog'}],
+        )
+        self.assertEqual(report['sqlite']['connections'], 1)
+        self.assertGreater(report['sqlite']['database_bytes'], 0)
+        self.assertLessEqual(
+            report['sqlite']['cache_bytes'],
+            report['sqlite']['database_bytes'])
+        self.assertTrue(report['sessions']['active'])
+        self.assertEqual(report['caches']['models'], 6)
+        self.assertGreater(report['caches']['word_filter_bytes'], 0)
+        self.assertGreater(report['objects']['sqlalchemy'], 0)
+        self.assertIsNone(report['tracemalloc'])
+        self.assertEqual(report['operations']['learn']['samples'], 1)
+        self.assertEqual(report['operations']['generate']['samples'], 2)
+        self.assertIn('operation generate:', footprint.format_report(report))
+
+    def test_tracemalloc_report(self):
+        tracemalloc.start()
+        try:
+            report = footprint.memory_report(self.graph)
+        finally:
+            tracemalloc.stop()
+        traced = report['tracemalloc']
+        self.assertGreaterEqual(traced['peak'], traced['current'])
+        self.assertTrue(traced['top'])
+        self.assertIn('tracemalloc:', footprint.format_report(report))
+
+    def test_allocation_delta(self):
+        result, delta = footprint.allocation_delta(
+            lambda n: [object() for i in range(n)], 1000)
+        self.assertEqual(len(result), 1000)
+        self.assertGreater(delta['size'], 0)
+        self.assertGreaterEqual(delta['count'], 1000)
+        self.assertFalse(tracemalloc.is_tracing())
+
+
+class CliTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.db_src = 'sqlite:///' + os.path.join(self.tempdir, 'graph.db')
+
+    def test_memory_report_json(self):
+        out = io.StringIO()
+        cli.main([
+            'memory-report', self.db_src, '--json', '--trace',
+            '--learn', 'hello world', '--generate', 'hello'], out=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['operations']['generate']['samples'], 1)
+        self.assertIsNotNone(report['tracemalloc'])
+        # sqlite files are not pooled.
+        self.assertEqual(report['pool']['connections'], 0)
+
+    def test_memory_report_learn_kept_out(self):
+        graph = SentenceGraph(self.db_src)
+        graph.initialize()
+        graph.learn({sentence.Loader: 'the quick brown fox'})
+        graph.engine.dispose()
+
+        out = io.StringIO()
+        cli.main([
+            'memory-report', self.db_src, '--json',
+            '--learn', 'a lazy dog', '--generate', 'lazy'], out=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['operations']['generate']['samples'], 1)
+
+        graph = SentenceGraph(self.db_src)
+        graph.initialize()
+        self.addCleanup(graph.engine.dispose)
+        self.assertIsNone(graph.generate({'word': 'lazy'}, None))
+        self.assertEqual(
+            graph.generate({'word': 'fox'}), 'the quick brown fox')
+
+    def test_memory_report_text(self):
+        out = io.StringIO()
+        cli.main(['memory-report', self.db_src, '--graph', 'xmpp'], out=out)
+        self.assertIn('sqlite:\n  cache_bytes:', out.getvalue())
@@ -0,0 +1,96 @@
+import unittest
+
+from sqlalchemy import event
+
+from mtj.markov.graph.sentence import SentenceGraph
+
+from mtj.markov.model import fuzzy
+from mtj.markov.model import sentence
+
+
+class WordFilterTestCase(unittest.TestCase):
+
+    def record_queries(self, engine):
+        queries = []
+
+        def before_execute(conn, clauseelement, multiparams, params):
+            queries.append(clauseelement)
+
+        event.listen(engine.engine, 'before_execute', before_execute)
+        self.addCleanup(
+            event.remove, engine.engine, 'before_execute', before_execute)
+        return queries
+
+    def test_unknown_word_rejected_without_query(self):
+        engine = SentenceGraph(word_filter=True)
+        engine.initialize()
+        engine.learn({sentence.Loader: 'Hello there world'})
+        self.assertEqual(
+            engine.generate({'word': 'hello'}), 'Hello there world')
+        queries = self.record_queries(engine)
+        with self.assertRaises(KeyError):
+            engine.generate({'word': 'unicorn'})
+        self.assertEqual(queries, [])
+
+    def test_filter_learns_and_reloads(self):
+        engine = SentenceGraph(word_filter=True)
+        engine.initialize()
+        engine.learn({sentence.Loader: 'hello world'})
+        # loaded from the existing words on first use.
+        self.assertEqual(engine.generate({'word': 'world'}), 'hello world')
+        engine.learn({sentence.Loader: 'goodbye moon'})
+        self.assertIn('moon', engine.word_filter)
+        self.assertEqual(engine.generate({'word': 'moon'}), 'goodbye moon')
+
+
+class FuzzyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = SentenceGraph()
+        self.engine.initialize([fuzzy])
+        self.engine.learn({sentence.Loader: 'the elephants trumpeted loudly'})
+        self.engine.learn({sentence.Loader: 'a cat sat on the mat'})
+
+    def test_trigrams(self):
+        self.assertEqual(
+            fuzzy.trigrams('cat'), {'  c', ' ca', 'cat', 'at '})
+
+    def test_indexed_once(self):
+        engine = self.engine
+        s = engine._sessions()
+        count = s.query(engine.classes['WordTrigram']).count()
+        engine.learn({sentence.Loader: 'the cat sat'})
+        self.assertEqual(
+            s.query(engine.classes['WordTrigram']).count(), count)
+
+    def test_known_word(self):
+        self.assertEqual(
+            self.engine.generate({'word': 'cat'}), 'a cat sat on the mat')
+
+    def test_prefix(self):
+        self.assertEqual(
+            self.engine.generate({'word': 'eleph'}),
+            'the elephants trumpeted loudly')
+
+    def test_near_miss(self):
+        engine = self.engine
+        self.assertEqual(
+            engine.generate({'word': 'elephant'}),
+            'the elephants trumpeted loudly')
+        self.assertEqual(
+            engine.generate({'word': 'trumpetted'}),
+            'the elephants trumpeted loudly')
+        self.assertEqual(
+            engine.generate({'word': 'cats'}), 'a cat sat on the mat')
+
+    def test_no_near_miss(self):
+        with self.assertRaises(KeyError):
+            self.engine.generate({'word': 'zebra'})
+
+    def test_filter_with_fuzzy(self):
+        engine = SentenceGraph(word_filter=True)
+        engine.initialize([fuzzy])
+        engine.learn({sentence.Loader: 'the elephants trumpeted loudly'})
+        self.assertEqual(
+            engine.generate({'words': ['elephant', 'loud']}),
+            'the elephants trumpeted loudly')
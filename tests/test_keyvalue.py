@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from mtj.markov.graph.keyvalue import DbmSentenceGraph
+from mtj.markov.graph.keyvalue import decode
+from mtj.markov.graph.keyvalue import encode
+
+from mtj.markov.model import sentence
+
+from mtj.markov.testing import XorShift128
+
+import test_sentence
+
+
+class EncodingTestCase(unittest.TestCase):
+
+    def test_roundtrip(self):
+        self.assertEqual(encode([1, 2, 3]), b'\1\0\0\0\2\0\0\0\3\0\0\0')
+        self.assertEqual(list(decode(encode([1, 2, 3]))), [1, 2, 3])
+        self.assertEqual(list(decode(b'')), [])
+
+
+class DbmSentenceTestCase(test_sentence.SentenceTestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.engine = DbmSentenceGraph(
+            os.path.join(self.tempdir, 'graph'), random=XorShift128())
+        self.engine.initialize()
+
+    def tearDown(self):
+        self.engine.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_lookup_words_by_ids(self):
+        engine = self.engine
+        engine.learn({sentence.Loader: 'hello this beautiful world.'})
+
+        words = engine.lookup_states_by_ids([3, 4, 5, 6])
+        self.assertEqual(sorted(words.keys()), [3, 4, 5])
+        self.assertEqual(words[5], 'world')
+
+    def test_lookup_words_by_words(self):
+        engine = self.engine
+        engine.learn({sentence.Loader: 'hello this beautiful world.'})
+        self.assertEqual(
+            [engine._lookup_word_id(w)
+             for w in ['hello', 'this', 'strange', 'world']],
+            [1, 2, None, 5],
+        )
+
+    def test_learn_results(self):
+        engine = self.engine
+        engine.learn({sentence.Loader:
+            'if you gaze long into an abyss, the abyss also gazes into you.'})
+        self.assertEqual(engine._word_count(), 13)
+        you = engine._lookup_word_id('you')
+        abyss = engine._lookup_word_id('abyss')
+        self.assertEqual(len(decode(engine.db[b'x' + encode([you])])), 6)
+        self.assertEqual(len(decode(engine.db[b'x' + encode([abyss])])), 6)
+
+    def test_learn_failure_sql(self):
+        engine = self.engine
+        engine.learn({})
+        self.assertEqual(engine._word_count(), 0)
+
+    def test_learn_failure_logic(self):
+        engine = self.engine
+        engine.learn({sentence.Loader: None})
+        self.assertEqual(engine._word_count(), 0)
+
+    def test_learn_chunked(self):
+        engine = self.engine
+        engine.chunk_size = 6
+        for i in range(5):
+            engine.learn({sentence.Loader: 'the cat %d' % i})
+        key = b'x' + encode([engine._lookup_word_id('the')])
+        self.assertEqual(list(decode(engine.db[key + b'\0'])), [2])
+        ids = b''.join(
+            engine.db[key + b'\0' + encode([i])] for i in range(2))
+        ids += engine.db[key]
+        self.assertEqual(len(engine.db[key]), 3 * 4)
+        self.assertEqual(len(decode(ids)), 15)
+        self.assertEqual(
+            set(engine.generate({'word': 'the'}) for i in range(50)),
+            set('the cat %d' % i for i in range(5)))
+        self.assertEqual(
+            set(engine.generate({'word': '3'}) for i in range(10)),
+            {'the cat 3'})
+
+    def test_reopen(self):
+        engine = self.engine
+        engine.learn({sentence.Loader: 'how are you doing'})
+        engine.close()
+        engine.initialize('r')
+        self.assertEqual(engine.generate({'word': 'you'}), 'how are you doing')
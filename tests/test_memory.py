@@ -0,0 +1,125 @@
+import unittest
+from io import BytesIO
+from random import Random
+
+from mtj.markov.graph.memory import MemorySentenceGraph
+from mtj.markov.graph.memory import MemoryXMPPGraph
+
+from mtj.markov.model import sentence
+
+from mtj.markov.testing import XorShift128
+
+# the existing test suites, to be run against the in-memory graphs.
+import test_sentence
+import test_xmpp
+
+
+class MemorySentenceTestCase(test_sentence.SentenceTestCase):
+
+    def setUp(self):
+        self.engine = MemorySentenceGraph(random=XorShift128())
+        self.engine.initialize()
+
+    def tearDown(self):
+        pass
+
+    def test_lookup_words_by_ids(self):
+        engine = self.engine
+        engine.learn({sentence.Loader: 'hello this beautiful world.'})
+
+        words = engine.lookup_states_by_ids([3, 4, 5, 6])
+
+        # empty string is 0, plus "world." and its normalized form.
+        self.assertEqual(sorted(words.keys()), [3, 4, 5])
+
+    def test_lookup_words_by_words(self):
+        engine = self.engine
+        engine.learn({sentence.Loader: 'hello this beautiful world.'})
+        self.assertEqual(
+            sorted(w for w in ['hello', 'this', 'strange', 'world']
+                   if w in engine.word_ids),
+            ['hello', 'this', 'world'],
+        )
+
+    def test_learn_results(self):
+        engine = self.engine
+        engine.learn({sentence.Loader:
+            'if you gaze long into an abyss, the abyss also gazes into you.'})
+        self.assertEqual(len(engine.words), 13)
+        self.assertEqual(len(engine.f_sentence), 13)
+        self.assertEqual(
+            sum(len(v) for v in engine.idx_word.values()), 13)
+        self.assertEqual(len(engine.idx_word[engine.word_ids['you']]), 2)
+        self.assertEqual(len(engine.idx_word[engine.word_ids['abyss']]), 2)
+
+    def test_learn_failure_sql(self):
+        # no sql involved, but a missing loader entry must not raise.
+        engine = self.engine
+        engine.learn({})
+        self.assertEqual(len(engine.timestamps), 0)
+
+    def test_learn_failure_logic(self):
+        engine = self.engine
+        # force a programming error of some kind.
+        engine.learn({sentence.Loader: None})
+        self.assertEqual(len(engine.timestamps), 0)
+
+    def test_dump_load(self):
+        engine = self.engine
+        engine.learn({sentence.Loader: 'how are you doing'})
+        stream = BytesIO()
+        engine.dump(stream)
+        stream.seek(0)
+
+        restored = MemorySentenceGraph()
+        restored.load(stream)
+        self.assertEqual(restored.words, engine.words)
+        self.assertEqual(
+            restored.generate({'word': 'you'}), 'how are you doing')
+
+
+class MemoryXMPPTestCase(test_xmpp.XMPPTestCase):
+
+    def setUp(self):
+        self.engine = MemoryXMPPGraph(random=Random(0).random)
+        self.engine.initialize()
+
+    def test_basic_generate(self):
+        engine = self.engine
+        engine.learn({
+            sentence.Loader: 'how are you doing',
+            test_xmpp.xmpp.Loader: {
+                'muc': 'room@chat.example.com',
+                'jid': 'user@example.com',
+                'nick': 'A Test User',
+            }
+        })
+
+        chain = engine.generate({'word': 'you'})
+        self.assertEqual(chain, 'how are you doing')
+        self.assertEqual(
+            engine.values[engine.log_nickname[0]], 'A Test User')
+        self.assertEqual(
+            engine.values[engine.log_jid[0]], 'user@example.com')
+
+    def test_multiple_generate(self):
+        engine = self.engine
+        for text, jid in (('how are you doing', 'user1@example.com'),
+                          ('I am fine, thank you.', 'user2@example.com')):
+            engine.learn({
+                sentence.Loader: text,
+                test_xmpp.xmpp.Loader: {
+                    'muc': 'room@chat.example.com',
+                    'jid': jid,
+                    'nick': 'User',
+                }
+            })
+
+        self.assertEqual(
+            sorted(engine.values[i] for i in set(engine.log_jid)),
+            ['user1@example.com', 'user2@example.com'],
+        )
+        self.assertEqual(len(engine.log_sentence), 2)
+        self.assertEqual(
+            engine.generate({'jid': 'user2@example.com'}),
+            'I am fine, thank you.')
@@ -0,0 +1,187 @@
+import os
+import shutil
+import tempfile
+import unittest
+from random import Random
+
+from sqlalchemy import func
+from sqlalchemy import select
+
+from mtj.markov.graph.aggregate import AggregateXMPPGraph
+from mtj.markov.graph.ngram import NGramGraph
+from mtj.markov.graph.xmpp import XMPPGraph
+
+from mtj.markov.model import fuzzy
+from mtj.markov.model import sentence
+from mtj.markov.model import xmpp
+
+
+class MergeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def make_graph(self, name, cls=XMPPGraph, modules=None, **kw):
+        graph = cls(
+            'sqlite:///' + os.path.join(self.tempdir, name),
+            random=Random(0).random, **kw)
+        graph.initialize(modules)
+        self.addCleanup(graph.engine.dispose)
+        return graph
+
+    def learn(self, graph, jid, *texts, **kw):
+        for text in texts:
+            graph.learn({
+                sentence.Loader: text,
+                xmpp.Loader: {
+                    'muc': 'room@chat.example.com',
+                    'jid': jid,
+                    'nick': jid,
+                },
+            }, **kw)
+
+    def count(self, graph, cls):
+        return graph._sessions().execute(
+            select([func.count()]).select_from(cls.__table__)).scalar()
+
+    def test_merge(self):
+        target = self.make_graph('target.db')
+        source = self.make_graph('source.db')
+        self.learn(target, 'user1@example.com', 'how are you doing')
+        self.learn(source, 'user2@example.com', 'I am fine, how are you')
+        self.learn(source, 'user3@example.com', 'doing great')
+
+        words = set(
+            w.word for g in (target, source)
+            for w in g._sessions().query(g.Word).all())
+        fragments = self.count(target, target.Fragment) + self.count(
+            source, source.Fragment)
+
+        offsets = target.merge_from(source)
+        self.assertEqual(offsets['sentence'], 1)
+
+        s = target._sessions()
+        self.assertEqual(
+            sorted(w.word for w in s.query(target.Word).all()), sorted(words))
+        self.assertEqual(self.count(target, target.Sentence), 3)
+        self.assertEqual(self.count(target, target.Fragment), fragments)
+        self.assertEqual(self.count(target, target.XMPPLog), 3)
+        self.assertEqual(self.count(target, target.JID), 3)
+        self.assertEqual(self.count(target, target.Muc), 1)
+
+        # fragments refer to the right words after remapping.
+        self.assertEqual(
+            target.generate({'jid': 'user3@example.com'}), 'doing great')
+        self.assertEqual(
+            set(target.generate({'word': 'fine,'}) for i in range(30)),
+            {'I am fine, how are you', 'I am fine, how are you doing'})
+
+        # the graph can still be learned into.
+        self.learn(target, 'user1@example.com', 'great stuff')
+        self.assertIsNotNone(target.generate({'word': 'stuff'}, default=None))
+
+    def test_merge_path_and_digests(self):
+        target = self.make_graph('target.db', dedup='ignore')
+        source = self.make_graph('source.db', dedup='ignore')
+        self.learn(target, 'user1@example.com', 'hello world')
+        self.learn(source, 'user2@example.com', 'hello world', 'goodbye')
+        target.merge_from(os.path.join(self.tempdir, 'source.db'))
+        self.assertEqual(self.count(target, target.Digest), 2)
+
+    def test_merge_tenants(self):
+        target = self.make_graph('target.db')
+        source = self.make_graph('source.db')
+        self.learn(target, 'user1@example.com', 'hello world', tenant='a')
+        self.learn(source, 'user2@example.com', 'hello there', tenant='b')
+        self.learn(source, 'user2@example.com', 'hello you', tenant='a')
+        self.learn(source, 'user2@example.com', 'hello default')
+        target.merge_from(source)
+
+        self.assertEqual(self.count(target, target.Tenant), 2)
+        self.assertEqual(
+            set(target.tenant('a').generate({'word': 'hello'})
+                for i in range(30)),
+            {'hello world', 'hello you'})
+        self.assertEqual(
+            target.tenant('b').generate({'word': 'hello'}), 'hello there')
+        self.assertEqual(target.generate({'word': 'hello'}), 'hello default')
+
+    def test_merge_missing_model(self):
+        target = self.make_graph('target.db', modules=[fuzzy])
+        source = self.make_graph('source.db')
+        self.learn(source, 'user1@example.com', 'the elephants trumpeted')
+        target.merge_from(source)
+        self.assertEqual(
+            target.generate({'word': 'elephants'}), 'the elephants trumpeted')
+
+    def test_merge_memory(self):
+        target = self.make_graph('target.db')
+        source = XMPPGraph()
+        source.initialize()
+        with self.assertRaises(ValueError):
+            target.merge_from(source)
+
+    def test_merge_ngram(self):
+        target = self.make_graph('target.db', cls=NGramGraph)
+        source = self.make_graph('source.db', cls=NGramGraph)
+        self.learn(target, 'user1@example.com', 'the cat sat down')
+        self.learn(source, 'user2@example.com', 'a dog sat up', 'the end')
+        ngrams = self.count(target, target.NGram) + self.count(
+            source, source.NGram)
+        target.merge_from(source)
+
+        self.assertEqual(self.count(target, target.NGram), ngrams)
+        # the packed keys refer to the right words after remapping.
+        self.assertEqual(
+            set(target.generate({'word': 'sat'}) for i in range(30)),
+            {'the cat sat down', 'a dog sat up'})
+        self.assertEqual(
+            set(target.generate({'word': 'end'}) for i in range(30)),
+            {'the end'})
+        self.learn(target, 'user1@example.com', 'a dog barked')
+        self.assertEqual(
+            target.generate({'word': 'barked'}), 'a dog barked')
+
+    def test_merge_ngram_order(self):
+        target = self.make_graph('target.db', cls=NGramGraph)
+        source = self.make_graph('source.db', cls=NGramGraph, order=3)
+        with self.assertRaises(ValueError):
+            target.merge_from(source)
+
+    def test_merge_aggregate(self):
+        target = self.make_graph('target.db', cls=AggregateXMPPGraph)
+        source = self.make_graph('source.db', cls=AggregateXMPPGraph)
+        self.learn(target, 'user1@example.com', 'the cat sat', 'the cat ran')
+        self.learn(source, 'user2@example.com', 'the cat sat', 'a dog sat')
+        target.merge_from(source)
+
+        Transition = target.Transition
+        s = target._sessions()
+        counts = dict(
+            ((t.l_word_id, t.word_id, t.r_word_id), t.count)
+            for t in s.query(Transition).all())
+        words = dict((w.word, w.id) for w in s.query(target.Word).all())
+        # the transitions common to both are summed.
+        self.assertEqual(counts[(words['the'], words['cat'], words['sat'])], 2)
+        self.assertEqual(counts[(words['the'], words['cat'], words['ran'])], 1)
+        self.assertEqual(counts[(words[''], words['the'], words['cat'])], 3)
+        self.assertEqual(counts[(words['a'], words['dog'], words['sat'])], 1)
+        self.assertEqual(len(counts), 8)
+        self.assertEqual(
+            self.count(target, target.classes['IndexWordTransition']), 8)
+
+        # the provenance refers to the merged transitions.
+        self.assertEqual(
+            set(target.generate({'jid': 'user2@example.com'})
+                for i in range(30)),
+            {'the cat sat', 'a dog sat'})
+        self.assertEqual(target.generate({'word': 'dog'}), 'a dog sat')
+        self.learn(target, 'user1@example.com', 'a dog ran')
+        s.expire_all()
+        self.assertEqual(
+            s.query(Transition).filter(
+                (Transition.word_id == words['dog']) &
+                (Transition.r_word_id == words['sat'])).one().count, 1)
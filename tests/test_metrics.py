@@ -0,0 +1,119 @@
+import os
+import shutil
+import tempfile
+import unittest
+from random import Random
+from urllib.request import urlopen
+
+from mtj.markov import metrics
+from mtj.markov.graph.sentence import SentenceGraph
+from mtj.markov.model import sentence
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def test_counter(self):
+        registry = metrics.Registry()
+        counter = registry.counter('errors_total', 'Errors.', ('error',))
+        counter.inc('KeyError')
+        counter.inc('KeyError', amount=2)
+        counter.inc('Value"Error')
+        self.assertEqual(counter.value('KeyError'), 3)
+        self.assertEqual(registry.export(), (
+            '# HELP errors_total Errors.\n'
+            '# TYPE errors_total counter\n'
+            'errors_total{error="KeyError"} 3\n'
+            'errors_total{error="Value\\"Error"} 1\n'
+        ))
+
+    def test_histogram(self):
+        registry = metrics.Registry()
+        histogram = registry.histogram('latency', 'Latency.', buckets=(1, 2))
+        for value in (0.5, 1.5, 1.5, 3):
+            histogram.observe(value)
+        self.assertEqual(histogram.count(), 4)
+        self.assertEqual(histogram.quantile(0.5), 2)
+        self.assertEqual(histogram.quantile(0.99), float('inf'))
+        self.assertIsNone(histogram.quantile(0.5, 'missing'))
+        self.assertEqual(registry.export(), (
+            '# HELP latency Latency.\n'
+            '# TYPE latency histogram\n'
+            'latency_bucket{le="1"} 1\n'
+            'latency_bucket{le="2"} 3\n'
+            'latency_bucket{le="+Inf"} 4\n'
+            'latency_sum 6.5\n'
+            'latency_count 4\n'
+        ))
+
+    def test_register_shared(self):
+        registry = metrics.Registry()
+        self.assertIs(
+            registry.counter('c', 'C.'), registry.counter('c', 'C.'))
+        with self.assertRaises(ValueError):
+            registry.histogram('c', 'C.')
+
+    def test_scope_of(self):
+        self.assertEqual(metrics.scope_of({}), 'none')
+        self.assertEqual(metrics.scope_of({'word': ''}), 'none')
+        self.assertEqual(
+            metrics.scope_of({'jid': 'a@example.com', 'word': 'hi'}),
+            'word+jid')
+
+    def test_dump(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        registry = metrics.Registry()
+        registry.counter('c', 'C.').inc()
+        path = os.path.join(tempdir, 'markov.prom')
+        registry.dump(path)
+        with open(path) as stream:
+            self.assertEqual(stream.read(), registry.export())
+        self.assertEqual(os.listdir(tempdir), ['markov.prom'])
+
+    def test_serve(self):
+        registry = metrics.Registry()
+        registry.counter('c', 'C.').inc()
+        server = metrics.serve(registry)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = 'http://%s:%d/metrics' % server.server_address
+        with urlopen(url) as response:
+            self.assertEqual(
+                response.headers['Content-Type'], metrics.CONTENT_TYPE)
+            self.assertEqual(
+                response.read().decode('utf8'), registry.export())
+
+
+class GraphMetricsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = metrics.GraphMetrics()
+        self.graph = SentenceGraph(
+            random=Random(0).random, metrics=self.metrics)
+        self.graph.initialize()
+
+    def test_instrumented(self):
+        self.graph.learn({sentence.Loader: 'hello world'})
+        self.graph.learn({})
+        self.assertEqual(self.graph.generate({'word': 'hello'}), 'hello world')
+        self.assertIsNone(self.graph.generate({'word': 'unknown'}, None))
+        with self.assertRaises(KeyError):
+            self.graph.generate({'word': 'unknown'})
+        self.graph.generate({})
+
+        m = self.metrics
+        self.assertEqual(m.learn_seconds.count(), 2)
+        self.assertEqual(m.learn_errors.value('KeyError'), 1)
+        self.assertEqual(m.generate_seconds.count('word'), 3)
+        self.assertEqual(m.generate_seconds.count('none'), 1)
+        self.assertEqual(m.generate_errors.value('word', 'KeyError'), 2)
+        self.assertIn(
+            'mtj_markov_generate_seconds_count{scope="word"} 3',
+            m.registry.export())
+
+    def test_disabled(self):
+        graph = SentenceGraph(random=Random(0).random)
+        graph.initialize()
+        graph.learn({sentence.Loader: 'hello world'})
+        self.assertEqual(graph.generate({'word': 'hello'}), 'hello world')
+        self.assertIsNone(graph.metrics)
@@ -0,0 +1,182 @@
+import unittest
+from random import Random
+
+from mtj.markov.graph.ngram import NGramGraph
+
+from mtj.markov.model import ngram
+from mtj.markov.model import sentence
+
+from mtj.markov.testing import XorShift128
+
+import test_sentence
+
+
+class NGramUtilsTestCase(unittest.TestCase):
+
+    def test_padding(self):
+        self.assertEqual(
+            [ngram.padding(i) for i in range(1, 5)], [1, 1, 2, 3])
+
+    def test_indexed_positions(self):
+        self.assertEqual(list(ngram.indexed_positions(1)), [1])
+        self.assertEqual(list(ngram.indexed_positions(2)), [1])
+        self.assertEqual(list(ngram.indexed_positions(4)), [1, 2, 3])
+
+
+class NGramOrder2TestCase(test_sentence.SentenceTestCase):
+    """
+    Order 2 should be the same as the SentenceGraph.
+    """
+
+    def setUp(self):
+        self.engine = NGramGraph(order=2, random=XorShift128())
+        self.engine.initialize()
+
+    def tearDown(self):
+        pass
+
+    def test_lookup_words_by_words(self):
+        engine = self.engine
+        engine.learn({sentence.Loader: 'hello this beautiful world.'})
+
+        words = sentence.lookup_words_by_words(
+            ['hello', 'this', 'strange', 'world'],
+            engine._sessions(), engine.Word
+        )
+        self.assertEqual(sorted(words.keys()), ['hello', 'this', 'world'])
+
+    def test_learn_results(self):
+        engine = self.engine
+        s = self.engine._sessions()
+
+        engine.learn({sentence.Loader:
+            'if you gaze long into an abyss, the abyss also gazes into you.'})
+        self.assertEqual(s.query(engine.Word).count(), 13)
+        self.assertEqual(s.query(engine.NGram).count(), 13)
+        self.assertEqual(s.query(engine.IndexWordNGram).count(), 13)
+
+
+class NGramOrderTestCase(unittest.TestCase):
+
+    def make_engine(self, order):
+        engine = NGramGraph(order=order, random=Random(0).random)
+        engine.initialize()
+        return engine
+
+    def test_bad_order(self):
+        with self.assertRaises(ValueError):
+            NGramGraph(order=0)
+
+    def test_tenant_unsupported(self):
+        engine = self.make_engine(2)
+        with self.assertRaises(ValueError):
+            engine.tenant('room')
+        with self.assertRaises(ValueError):
+            engine.learn({sentence.Loader: 'hello there'}, tenant='room')
+        with self.assertRaises(ValueError):
+            engine.generate({'tenant': 'room'}, None)
+
+    def test_unsupported(self):
+        engine = self.make_engine(2)
+        engine.learn({sentence.Loader: 'hello there'})
+        for data in (
+                {'words': ['hello', 'there']},
+                {'min_length': 2},
+                {'max_length': 2},
+                {'since': 0},
+                {'until': 0}):
+            with self.assertRaises(ValueError):
+                engine.generate(data, None)
+        self.assertEqual(engine.generate({'word': 'hello'}), 'hello there')
+
+    def test_stats(self):
+        engine = self.make_engine(2)
+        engine.learn({sentence.Loader: 'how are you doing'})
+        engine.learn({sentence.Loader: 'how are they'})
+        stats = engine.stats()
+        self.assertEqual(stats['tables']['ngram']['rows'], 7)
+        self.assertEqual(stats['transitions'], 6)
+        self.assertEqual(stats['branching']['lr']['max'], 2)
+
+    def test_deadline(self):
+        engine = self.make_engine(1)
+        engine.learn({sentence.Loader: 'a b c d e'})
+        result = engine.generate({'word': 'c'}, deadline=0)
+        self.assertTrue(result.truncated)
+        engine.learn({sentence.Loader: 'b c'})
+        engine.learn({sentence.Loader: 'c d'})
+        results = set(
+            engine.generate({'word': 'c'}, deadline=0) for i in range(20))
+        self.assertEqual(results, {'b c', 'c'})
+        self.assertFalse(any(r.truncated for r in results))
+
+    def test_quote(self):
+        for order in range(1, 5):
+            engine = NGramGraph(
+                order=order, dedup='weight', random=Random(0).random)
+            engine.initialize()
+            engine.learn({sentence.Loader: 'how are you doing'})
+            engine.learn({sentence.Loader: 'fine'})
+            engine.learn({sentence.Loader: 'how are you doing'})
+            self.assertEqual(engine.quote(1), 'how are you doing')
+            self.assertEqual(engine.quote(2), 'fine')
+            with self.assertRaises(KeyError):
+                engine.quote(3)
+            self.assertEqual(
+                set(engine.random_quote({}) for i in range(20)),
+                {'how are you doing', 'fine'})
+
+    def test_random_quote_unsupported(self):
+        engine = self.make_engine(2)
+        self.assertIsNone(engine.random_quote({}, None))
+        engine.learn({sentence.Loader: 'hello there'})
+        with self.assertRaises(ValueError):
+            engine.random_quote({'since': 0}, None)
+
+    def test_learn_counts(self):
+        for order, count in ((1, 5), (2, 4), (3, 5), (4, 6)):
+            engine = self.make_engine(order)
+            engine.learn({sentence.Loader: 'how are you doing'})
+            s = engine._sessions()
+            self.assertEqual(s.query(engine.NGram).count(), count)
+            ngrams = s.query(engine.NGram).all()
+            self.assertEqual(
+                set(len(n.list_states()) for n in ngrams), {order + 1})
+
+    def test_generate_orders(self):
+        for order in range(1, 5):
+            engine = self.make_engine(order)
+            engine.learn({sentence.Loader: 'how are you doing'})
+            self.assertEqual(
+                engine.generate({'word': 'you'}), 'how are you doing')
+            self.assertEqual(engine.generate({}), 'how are you doing')
+
+    def test_generate_single_word(self):
+        for order in range(1, 5):
+            engine = self.make_engine(order)
+            engine.learn({sentence.Loader: 'hi'})
+            self.assertEqual(engine.generate({'word': 'hi'}), 'hi')
+
+    def test_generate_higher_order_less_branching(self):
+        text = [
+            'the cat sat on a mat',
+            'the dog sat on the log',
+        ]
+        results = {}
+        for order in (1, 3):
+            engine = self.make_engine(order)
+            for p in text:
+                engine.learn({sentence.Loader: p})
+            results[order] = set(
+                engine.generate({'word': 'cat'}) for i in range(30))
+        # order 3 only ever reproduces the source.
+        self.assertEqual(results[3], {'the cat sat on a mat'})
+        self.assertTrue(len(results[1]) > 1)
+
+    def test_generate_iter_orders(self):
+        for order in range(1, 5):
+            engine = self.make_engine(order)
+            engine.learn({sentence.Loader: 'how are you doing'})
+            self.assertEqual(
+                list(engine.generate_iter({'word': 'are'})),
+                ['how', 'are', 'you', 'doing'])
@@ -0,0 +1,125 @@
+import time
+import unittest
+
+from mtj.markov.graph.memory import MemorySentenceGraph
+from mtj.markov.graph.sentence import SentenceGraph
+from mtj.markov.model import sentence
+from mtj.markov.pool import PregeneratedPool
+from mtj.markov.pool import pool_key
+
+
+class PoolKeyTestCase(unittest.TestCase):
+
+    def test_pool_key(self):
+        self.assertEqual(pool_key({}), ())
+        self.assertEqual(pool_key({'word': None}), ())
+        self.assertEqual(pool_key({'word': ''}), (('word', ''),))
+        self.assertEqual(pool_key({'word': 'hi'}), (('word', 'hi'),))
+        self.assertEqual(
+            pool_key({'jid': 'a@example.com', 'word': 'hi', 'x': 1}),
+            (('jid', 'a@example.com'), ('word', 'hi'), ('x', 1)))
+        self.assertEqual(
+            pool_key({'words': ['a', 'b'], 'max_length': 3}),
+            (('max_length', 3), ('words', ('a', 'b'))))
+
+
+class PregeneratedPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.graph = MemorySentenceGraph()
+        self.graph.initialize()
+        self.graph.learn({sentence.Loader: 'how are you doing'})
+        # workers are not started, refills are done manually.
+        self.pool = PregeneratedPool(self.graph, size=3)
+
+    def test_miss_then_hit(self):
+        pool = self.pool
+        self.assertEqual(pool.get({'word': 'you'}), 'how are you doing')
+        self.assertEqual(pool.misses, 1)
+        self.assertEqual(list(pool.pending), [(('word', 'you'),)])
+
+        pool.refill(pool.pending.popleft())
+        self.assertEqual(len(pool.queues[(('word', 'you'),)]), 3)
+        self.assertEqual(pool.get({'word': 'you'}), 'how are you doing')
+        self.assertEqual(pool.hits, 1)
+        self.assertEqual(pool.hit_rate, 0.5)
+        self.assertEqual(pool.metrics()['pregenerated'], 2)
+        self.assertEqual(pool.metrics()['refills'], 3)
+
+    def test_missing_default(self):
+        pool = self.pool
+        self.assertIsNone(pool.get({'word': 'hi'}, None))
+        pool.refill(pool.pending.popleft())
+        self.assertEqual(len(pool.queues[(('word', 'hi'),)]), 0)
+        with self.assertRaises(KeyError):
+            pool.get({'word': 'hi'})
+
+    def test_learn_invalidates(self):
+        pool = self.pool
+        pool.get({})
+        pool.refill(pool.pending.popleft())
+        self.assertEqual(len(pool.queues[()]), 3)
+        pool.learn({sentence.Loader: 'what is going on'})
+        self.assertEqual(list(pool.pending), [()])
+        pool.get({})
+        self.assertEqual(pool.hits, 0)
+        self.assertEqual(pool.misses, 2)
+
+    def test_data_keys(self):
+        # the memory graph does not support the length bounds.
+        graph = SentenceGraph()
+        graph.initialize()
+        graph.learn({sentence.Loader: 'alpha beta gamma'})
+        graph.learn({sentence.Loader: 'delta epsilon zeta'})
+        graph.learn({sentence.Loader: 'epsilon zeta'})
+        pool = PregeneratedPool(graph, size=2)
+        pool.get({})
+        pool.get({'words': ['alpha', 'gamma']})
+        pool.get({'word': 'zeta', 'max_length': 2})
+        while pool.pending:
+            pool.refill(pool.pending.popleft())
+        self.assertEqual(len(pool.queues), 3)
+        for i in range(2):
+            self.assertEqual(
+                pool.get({'words': ['alpha', 'gamma']}), 'alpha beta gamma')
+            self.assertEqual(
+                pool.get({'word': 'zeta', 'max_length': 2}), 'epsilon zeta')
+        self.assertEqual(pool.hits, 4)
+
+    def test_zero_scope(self):
+        self.assertEqual(pool_key({'since': 0}), (('since', 0),))
+        self.assertNotEqual(pool_key({'until': 0}), pool_key({'since': 0}))
+        graph = SentenceGraph()
+        graph.initialize()
+        graph.learn({sentence.Loader: 'alpha beta gamma'})
+        pool = PregeneratedPool(graph, size=2)
+        pool.get({})
+        self.assertIsNone(pool.get({'until': 0}, None))
+        while pool.pending:
+            pool.refill(pool.pending.popleft())
+        self.assertEqual(len(pool.queues[()]), 2)
+        self.assertEqual(len(pool.queues[(('until', 0),)]), 0)
+        # the scoped request is not served from the unscoped queue.
+        self.assertIsNone(pool.get({'until': 0}, None))
+        self.assertEqual(pool.get({'since': 0}), 'alpha beta gamma')
+
+    def test_max_keys(self):
+        pool = PregeneratedPool(self.graph, max_keys=1)
+        pool.get({'word': 'you'})
+        pool.get({'word': 'how'})
+        self.assertEqual(list(pool.queues), [(('word', 'you'),)])
+
+    def test_workers(self):
+        pool = PregeneratedPool(self.graph, size=2, workers=2)
+        pool.start()
+        try:
+            pool.get({'word': 'how'})
+            # wait for the refill by a worker.
+            for i in range(100):
+                if len(pool.queues[(('word', 'how'),)]) == 2:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(pool.get({'word': 'how'}), 'how are you doing')
+            self.assertEqual(pool.hits, 1)
+        finally:
+            pool.stop()
@@ -1,8 +1,10 @@
 import unittest
 
+from sqlalchemy import func
+from sqlalchemy import select
 from sqlalchemy.orm.session import Session
 
-from mtj.markov.graph import sentence as graph_sentence
+from mtj.markov.graph.base import Context
 from mtj.markov.graph.sentence import SentenceGraph
 
 from mtj.markov.model import sentence
@@ -13,19 +15,16 @@ from mtj.markov.testing import XorShift128
 class SentenceTestCase(unittest.TestCase):
 
     def setUp(self):
-        self.engine = SentenceGraph()
+        self.engine = SentenceGraph(random=XorShift128())
         self.engine.initialize()
-        graph_sentence.random, self.original_random = (
-            XorShift128(), graph_sentence.random)
 
     def tearDown(self):
-        graph_sentence.random = self.original_random
         self.engine.model.metadata.drop_all(self.engine.engine)
 
     def skip_random(self, n=1):
         # For skipping over unfavorable generated numbers.
         for i in range(n):
-            graph_sentence.random()
+            self.engine.random()
 
     def test_lookup_words_by_ids(self):
         engine = self.engine
@@ -166,3 +165,360 @@ class SentenceTestCase(unittest.TestCase):
         # I had previously neglected this case, and this turns out to
         # make the above best case again less common.
         self.assertEqual(engine.generate({'word': 'logic'}), 'circular logic')
+
+
+class SentenceDedupTestCase(unittest.TestCase):
+
+    def make_engine(self, dedup):
+        engine = SentenceGraph(dedup=dedup)
+        engine.initialize()
+        return engine
+
+    def test_digest_normalized(self):
+        engine = self.make_engine('ignore')
+        self.assertEqual(
+            engine.digest({sentence.Loader: 'Hello world.'}),
+            engine.digest({sentence.Loader: 'hello  world'}),
+        )
+        self.assertNotEqual(
+            engine.digest({sentence.Loader: 'hello world'}),
+            engine.digest({sentence.Loader: 'world hello'}),
+        )
+
+    def test_dedup_disabled(self):
+        engine = self.make_engine(None)
+        engine.learn({sentence.Loader: 'hello world'})
+        engine.learn({sentence.Loader: 'hello world'})
+        s = engine._sessions()
+        self.assertEqual(s.query(engine.Datum).count(), 2)
+        self.assertEqual(s.query(engine.Fragment).count(), 4)
+        self.assertEqual(s.query(engine.Digest).count(), 0)
+
+    def test_dedup_ignore(self):
+        engine = self.make_engine('ignore')
+        engine.learn({sentence.Loader: 'hello world'})
+        engine.learn({sentence.Loader: 'Hello world.'})
+        engine.learn({sentence.Loader: 'hello there'})
+        s = engine._sessions()
+        self.assertEqual(s.query(engine.Datum).count(), 2)
+        self.assertEqual(s.query(engine.Fragment).count(), 4)
+        self.assertEqual(s.query(engine.IndexWordFragment).count(), 4)
+        self.assertEqual(s.query(engine.Digest).count(), 2)
+        self.assertEqual(engine.generate({'word': 'world'}), 'hello world')
+
+    def test_dedup_weight(self):
+        engine = self.make_engine('weight')
+        engine.learn({sentence.Loader: 'hello world'})
+        engine.learn({sentence.Loader: 'hello world'})
+        s = engine._sessions()
+        self.assertEqual(s.query(engine.Datum).count(), 1)
+        self.assertEqual(s.query(engine.Fragment).count(), 4)
+        self.assertEqual(s.query(engine.Digest).count(), 1)
+        self.assertEqual(
+            set(f.sentence_id for f in s.query(engine.Fragment).all()), {1})
+
+
+class SentenceLengthTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = SentenceGraph()
+        self.engine.initialize()
+        engine = self.engine
+        engine.learn({sentence.Loader: 'the cat sat on the mat'})
+        engine.learn({sentence.Loader: 'the dog ran'})
+        engine.learn({sentence.Loader: 'a bird saw the cat and the dog and '
+                                       'the mat under the big old tree'})
+
+    def test_fragment_distances(self):
+        s = self.engine._sessions()
+        fragments = s.query(self.engine.Fragment).filter(
+            self.engine.Fragment.sentence_id == 2).all()
+        self.assertEqual(
+            [(f.l_dist, f.r_dist) for f in fragments],
+            [(0, 2), (1, 1), (2, 0)])
+
+    def test_generate_bounded(self):
+        engine = self.engine
+        for i in range(100):
+            result = engine.generate({
+                'word': 'the', 'min_length': 4, 'max_length': 7})
+            self.assertTrue(4 <= len(result.split()) <= 7, result)
+
+    def test_generate_bounded_minimum(self):
+        engine = self.engine
+        for i in range(50):
+            result = engine.generate({'word': 'dog', 'min_length': 8})
+            self.assertTrue(8 <= len(result.split()), result)
+
+    def test_generate_bounded_exact(self):
+        engine = self.engine
+        for i in range(50):
+            result = engine.generate({
+                'word': 'the', 'min_length': 3, 'max_length': 3})
+            self.assertEqual(len(result.split()), 3, result)
+
+    def test_generate_bounded_infeasible(self):
+        engine = self.engine
+        with self.assertRaises(KeyError):
+            engine.generate({'word': 'bird', 'max_length': 5})
+        self.assertEqual(engine.generate({
+            'word': 'ran', 'min_length': 4, 'max_length': 5}, default=''), '')
+
+
+class SentenceWordsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = SentenceGraph()
+        self.engine.initialize()
+        engine = self.engine
+        engine.learn({sentence.Loader: 'the cat sat on the mat'})
+        engine.learn({sentence.Loader: 'a dog sat under the tree'})
+        engine.learn({sentence.Loader: 'the cat chased a dog up the tree'})
+
+    def test_generate_words(self):
+        engine = self.engine
+        for i in range(50):
+            result = engine.generate({'words': ['Cat', 'tree']}).split()
+            self.assertIn('cat', result)
+            self.assertIn('tree', result)
+
+    def test_generate_words_single(self):
+        engine = self.engine
+        for i in range(20):
+            self.assertIn('mat', engine.generate({'words': ['mat']}).split())
+
+    def test_generate_words_spine(self):
+        engine = self.engine
+        # only the last sentence has all three words, so the words in
+        # between them must come from that sentence.
+        self.assertIn(
+            'chased a dog up',
+            engine.generate({'words': ['dog', 'chased', 'up']}))
+
+    def test_generate_words_bounded(self):
+        engine = SentenceGraph(random=XorShift128())
+        engine.initialize()
+        rand = XorShift128()
+        vocab = ['x', 'y', 'of', 'the', 'a', 'b', 'c', 'd', 'e', 'f', 'g']
+        for i in range(300):
+            words = [
+                vocab[int(rand() * len(vocab))]
+                for j in range(3 + int(rand() * 13))
+            ]
+            engine.learn({sentence.Loader: ' '.join(words)})
+        for i in range(100):
+            result = engine.generate({
+                'words': ['x', 'y', 'of'], 'min_length': 5,
+                'max_length': 12}).split()
+            self.assertTrue(5 <= len(result) <= 12, result)
+            self.assertTrue({'x', 'y', 'of'} <= set(result))
+
+    def test_generate_words_missing(self):
+        engine = self.engine
+        with self.assertRaises(KeyError):
+            engine.generate({'words': ['cat', 'unicorn']})
+        with self.assertRaises(KeyError):
+            engine.generate({'words': ['mat', 'dog']})
+        self.assertEqual(
+            engine.generate({'words': ['unicorn']}, default=''), '')
+
+    def test_generate_words_repeated(self):
+        engine = SentenceGraph(dedup='weight')
+        engine.initialize()
+        engine.learn({sentence.Loader: 'hello big world'})
+        engine.learn({sentence.Loader: 'hello big world'})
+        self.assertEqual(
+            engine.generate({'words': ['hello', 'world']}), 'hello big world')
+
+
+class SentenceIterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = SentenceGraph()
+        self.engine.initialize()
+        self.engine.learn({sentence.Loader: 'the fire will start'})
+        self.engine.learn({sentence.Loader: 'will start the engine tomorrow'})
+
+    def test_generate_iter_same_as_generate(self):
+        engine = self.engine
+        for word in ('the', 'start', 'fire'):
+            engine.random = XorShift128()
+            expected = engine.generate({'word': word})
+            engine.random = XorShift128()
+            self.assertEqual(
+                ' '.join(engine.generate_iter({'word': word})), expected)
+
+    def test_generate_iter_lazy(self):
+        engine = self.engine
+        calls = []
+        query_chain = engine._query_chain
+
+        def _query_chain(*a, **kw):
+            calls.append(a)
+            return query_chain(*a, **kw)
+
+        engine._query_chain = _query_chain
+        words = engine.generate_iter({'word': 'fire'})
+        self.assertEqual(calls, [])
+        self.assertEqual(next(words), 'the')
+        lhs_calls = len(calls)
+        self.assertEqual(next(words), 'fire')
+        self.assertEqual(next(words), 'will')
+        # the right hand side not followed until requested.
+        self.assertEqual(len(calls), lhs_calls)
+        self.assertEqual(next(words), 'start')
+        self.assertEqual(len(calls), lhs_calls + 1)
+        words.close()
+        self.assertEqual(len(calls), lhs_calls + 1)
+
+    def test_generate_iter_bounded(self):
+        engine = self.engine
+        for i in range(20):
+            words = list(engine.generate_iter({
+                'word': 'start', 'min_length': 2, 'max_length': 4}))
+            self.assertTrue(2 <= len(words) <= 4, words)
+
+    def test_generate_iter_unknown(self):
+        words = self.engine.generate_iter({'word': 'unicorn'})
+        with self.assertRaises(KeyError):
+            next(words)
+
+
+class SentenceTenantTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = SentenceGraph(random=XorShift128())
+        self.engine.initialize()
+        self.room1 = self.engine.tenant('room1')
+        self.room2 = self.engine.tenant('room2')
+        self.room1.learn({sentence.Loader: 'the cat sat on the mat'})
+        self.room2.learn({sentence.Loader: 'the dog ate the bone'})
+        self.engine.learn({sentence.Loader: 'the bird sang in the tree'})
+
+    def test_shared_words(self):
+        s = self.engine._sessions()
+        self.assertEqual(s.query(self.engine.Tenant).count(), 2)
+        self.assertEqual(
+            s.query(self.engine.Word).filter(
+                self.engine.Word.word == 'the').count(), 1)
+        self.assertEqual(
+            sorted(t for t, in s.query(self.engine.Sentence.tenant_id)),
+            [0, 1, 2])
+
+    def test_generate_isolated(self):
+        for i in range(10):
+            self.assertEqual(
+                self.room1.generate({}), 'the cat sat on the mat')
+            self.assertEqual(
+                self.room2.generate({'word': 'the'}), 'the dog ate the bone')
+            self.assertEqual(
+                self.engine.generate({'word': 'the'}),
+                'the bird sang in the tree')
+
+    def test_generate_missing(self):
+        self.assertIsNone(self.room1.generate({'word': 'dog'}, None))
+        self.assertIsNone(self.room2.generate({'words': ['cat']}, None))
+        self.assertIsNone(
+            self.engine.tenant('room3').generate({'word': 'the'}, None))
+        self.assertEqual(
+            self.room2.generate({'words': ['dog', 'bone']}),
+            'the dog ate the bone')
+
+    def test_generate_iter(self):
+        self.assertEqual(
+            list(self.room1.generate_iter({'word': 'cat'})),
+            'the cat sat on the mat'.split())
+
+    def test_dedup_per_tenant(self):
+        engine = SentenceGraph(dedup='ignore', random=XorShift128())
+        engine.initialize()
+        engine.tenant('room1').learn({sentence.Loader: 'hello there'})
+        engine.tenant('room2').learn({sentence.Loader: 'hello there'})
+        engine.tenant('room2').learn({sentence.Loader: 'hello there'})
+        s = engine._sessions()
+        self.assertEqual(s.query(engine.Sentence).count(), 2)
+        self.assertEqual(
+            engine.tenant('room2').generate({'word': 'hello'}), 'hello there')
+
+
+class SentenceDeadlineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = SentenceGraph(random=XorShift128())
+        self.engine.initialize()
+        self.engine.learn({sentence.Loader: 'a b c d e'})
+
+    def test_no_deadline(self):
+        result = self.engine.generate({'word': 'c'})
+        self.assertEqual(result, 'a b c d e')
+        self.assertFalse(result.truncated)
+        result = self.engine.generate({'word': 'c'}, deadline=60)
+        self.assertEqual(result, 'a b c d e')
+        self.assertFalse(result.truncated)
+
+    def test_truncated(self):
+        result = self.engine.generate({'word': 'c'}, deadline=0)
+        self.assertEqual(result, 'b c d')
+        self.assertTrue(result.truncated)
+
+    def test_truncated_bounded(self):
+        result = self.engine.generate(
+            {'word': 'c', 'min_length': 5}, deadline=0)
+        self.assertEqual(result, 'b c d')
+        self.assertTrue(result.truncated)
+
+    def test_closed(self):
+        self.engine.learn({sentence.Loader: 'b c d'})
+        for data in ({'word': 'c'}, {'word': 'c', 'max_length': 5}):
+            result = self.engine.generate(data, deadline=0)
+            self.assertEqual(result, 'b c d')
+            self.assertFalse(result.truncated)
+
+    def test_tenant(self):
+        room = self.engine.tenant('room')
+        room.learn({sentence.Loader: 'a b c d e'})
+        result = room.generate({'word': 'c'}, deadline=0)
+        self.assertTrue(result.truncated)
+
+
+class SentenceQuoteTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = SentenceGraph(dedup='weight', random=XorShift128())
+        self.engine.initialize()
+        self.engine.learn({sentence.Loader: 'Hello, the World!'})
+        self.engine.learn({sentence.Loader: 'a b a b a'})
+        self.engine.learn({sentence.Loader: 'Hello, the World!'})
+
+    def test_quote(self):
+        self.assertEqual(self.engine.quote(1), 'Hello, the World!')
+        self.assertEqual(self.engine.quote(2), 'a b a b a')
+        with self.assertRaises(KeyError):
+            self.engine.quote(3)
+
+    def test_quote_indexed(self):
+        s = self.engine._sessions()
+        plan = ' '.join(str(row[-1]) for row in s.execute(
+            'EXPLAIN QUERY PLAN SELECT l_dist, word_id FROM fragment '
+            'WHERE sentence_id = 1 ORDER BY l_dist'))
+        self.assertIn('idx_fragment_sentence', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_random_quote_indexed(self):
+        column, condition = self.engine.quote_condition(
+            {}, Context(self.engine._sessions(), {}, tenant_id=0))
+        sql = str(select([func.count(column)]).where(condition).compile(
+            self.engine.engine))
+        connection = self.engine.engine.raw_connection()
+        self.addCleanup(connection.close)
+        plan = ' '.join(str(row[-1]) for row in connection.execute(
+            'EXPLAIN QUERY PLAN ' + sql, (0,)))
+        self.assertIn('COVERING INDEX idx_fragment_first', plan)
+
+    def test_random_quote(self):
+        self.assertEqual(
+            set(self.engine.random_quote({}) for i in range(20)),
+            {'Hello, the World!', 'a b a b a'})
+        self.assertIsNone(self.engine.random_quote({'until': 0}, None))
+        with self.assertRaises(KeyError):
+            self.engine.tenant('room').random_quote({})
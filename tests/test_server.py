@@ -0,0 +1,114 @@
+import os
+import tempfile
+import shutil
+import unittest
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+from threading import Thread
+
+from mtj.markov.graph.memory import MemorySentenceGraph
+from mtj.markov.graph.sentence import SentenceGraph
+from mtj.markov.model import sentence
+from mtj.markov.server import GenerationServer
+
+
+class GenerationServerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.graph = MemorySentenceGraph()
+        self.graph.initialize()
+        self.graph.learn({sentence.Loader: 'how are you doing'})
+        self.server = GenerationServer(self.graph, workers=2)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_generate(self):
+        self.assertEqual(
+            self.server.generate({'word': 'you'}), 'how are you doing')
+        with self.assertRaises(KeyError):
+            self.server.generate({'word': 'hi'})
+        self.assertIsNone(self.server.generate({'word': 'hi'}, None))
+
+    def test_generate_many(self):
+        self.assertEqual(
+            self.server.generate_many({'word': 'how'}, 10),
+            ['how are you doing'] * 10)
+
+    def test_learn_reload(self):
+        server = self.server
+        server.learn({sentence.Loader: 'hi there'})
+        self.assertTrue(server.stale)
+        self.assertEqual(server.generate({'word': 'hi'}), 'hi there')
+        self.assertFalse(server.stale)
+
+    def serve(self, **kw):
+        address = os.path.join(tempfile.mkdtemp(), 'socket')
+        self.addCleanup(shutil.rmtree, os.path.dirname(address))
+        thread = Thread(
+            target=self.server.serve_forever, args=(address,), kwargs=kw)
+        thread.daemon = True
+        thread.start()
+
+        for i in range(100):
+            if os.path.exists(address):
+                break
+            thread.join(0.01)
+        return address, thread
+
+    def stop(self, thread):
+        self.server.shutdown()
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+
+    def test_serve(self):
+        address, thread = self.serve()
+        authkey = self.server.authkey
+        self.assertEqual(len(authkey), 32)
+
+        with self.assertRaises(AuthenticationError):
+            Client(address, authkey=b'wrong')
+
+        with Client(address, authkey=authkey) as client:
+            client.send(('generate', ({'word': 'you'},)))
+            self.assertEqual(client.recv(), (None, 'how are you doing'))
+            client.send(('generate', ({'word': 'hi'},)))
+            error, result = client.recv()
+            self.assertTrue(isinstance(error, KeyError))
+            # learn is not served by default.
+            client.send(('learn', ({sentence.Loader: 'hi there'},)))
+            error, result = client.recv()
+            self.assertTrue(isinstance(error, KeyError))
+            self.assertFalse(self.server.stale)
+
+        self.stop(thread)
+
+    def test_serve_learn(self):
+        address, thread = self.serve(authkey=b'secret', allow_learn=True)
+        with Client(address, authkey=b'secret') as client:
+            client.send(('learn', ({sentence.Loader: 'hi there'},)))
+            self.assertEqual(client.recv()[0], None)
+            client.send(('generate', ({'word': 'hi'},)))
+            self.assertEqual(client.recv(), (None, 'hi there'))
+        self.stop(thread)
+
+
+class SqliteGenerationServerTestCase(unittest.TestCase):
+
+    def test_generate_file(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        graph = SentenceGraph('sqlite:///' + os.path.join(tempdir, 'db'))
+        graph.initialize()
+        graph.learn({sentence.Loader: 'how are you doing'})
+        server = GenerationServer(graph, workers=2)
+        server.start()
+        try:
+            self.assertEqual(
+                server.generate_many({'word': 'you'}, 4),
+                ['how are you doing'] * 4)
+            server.learn({sentence.Loader: 'hi there'})
+            self.assertEqual(server.generate({'word': 'hi'}), 'hi there')
+        finally:
+            server.close()
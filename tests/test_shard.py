@@ -0,0 +1,166 @@
+import os
+import shutil
+import tempfile
+import unittest
+from random import Random
+
+from mtj.markov.graph.shard import JIDPartition
+from mtj.markov.graph.shard import MucPartition
+from mtj.markov.graph.shard import Partition
+from mtj.markov.graph.shard import ShardedGraph
+from mtj.markov.graph.shard import TimePartition
+from mtj.markov.graph.shard import stable_hash
+from mtj.markov.graph.xmpp import XMPPGraph
+
+from mtj.markov.model import sentence
+from mtj.markov.model import xmpp
+
+
+def table(text, muc='room@chat.example.com', jid='user@example.com'):
+    return {
+        sentence.Loader: text,
+        xmpp.Loader: {'muc': muc, 'jid': jid, 'nick': jid},
+    }
+
+
+class PartitionTestCase(unittest.TestCase):
+
+    def test_stable_hash(self):
+        self.assertEqual(stable_hash(u'room'), 1923043739)
+
+    def test_partition(self):
+        partition = Partition(
+            3, key=lambda table: len(table[sentence.Loader]))
+        self.assertEqual(partition.learn_shard(table('abcd')), 1)
+        self.assertEqual(partition.generate_shards({}), [0, 1, 2])
+
+    def test_muc_partition(self):
+        partition = MucPartition(4)
+        index = partition.learn_shard(table('hi', muc='a@chat'))
+        self.assertEqual(partition.generate_shards({'muc': 'a@chat'}), [index])
+        self.assertEqual(
+            partition.generate_shards({'jid': 'user@example.com'}),
+            [0, 1, 2, 3])
+
+    def test_jid_partition(self):
+        partition = JIDPartition(4)
+        index = partition.learn_shard(table('hi', jid='b@example.com'))
+        self.assertEqual(
+            partition.generate_shards({'jid': 'b@example.com'}), [index])
+
+    def test_time_partition(self):
+        now = [50]
+        partition = TimePartition([100, 200], time=lambda: now[0])
+        self.assertEqual(partition.count, 3)
+        self.assertEqual(partition.learn_shard(table('hi')), 0)
+        now[0] = 150
+        self.assertEqual(partition.learn_shard(table('hi')), 1)
+        now[0] = 200
+        self.assertEqual(partition.learn_shard(table('hi')), 2)
+        self.assertEqual(partition.generate_shards({}), [0, 1, 2])
+        self.assertEqual(partition.generate_shards({'since': 120}), [1, 2])
+        self.assertEqual(partition.generate_shards({'until': 99}), [0])
+
+
+class ShardedGraphTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.shards = [
+            XMPPGraph('sqlite:///' + os.path.join(self.tempdir, '%d.db' % i))
+            for i in range(2)
+        ]
+        self.partition = JIDPartition(2)
+        self.graph = ShardedGraph(
+            self.shards, self.partition, random=Random(0).random)
+        self.graph.initialize()
+        # find jids that land on each shard.
+        self.jids = {}
+        i = 0
+        while len(self.jids) < 2:
+            jid = 'user%d@example.com' % i
+            self.jids.setdefault(self.partition.shard_of(jid), jid)
+            i += 1
+
+    def tearDown(self):
+        for shard in self.shards:
+            shard.engine.dispose()
+        shutil.rmtree(self.tempdir)
+
+    def test_bad_partition(self):
+        with self.assertRaises(ValueError):
+            ShardedGraph(self.shards, JIDPartition(3))
+
+    def test_learn_routed(self):
+        graph = self.graph
+        graph.learn(table('hello shard zero', jid=self.jids[0]))
+        graph.learn(table('hello shard one', jid=self.jids[1]))
+        graph.learn(table('bye shard one', jid=self.jids[1]))
+        self.assertEqual(graph.refresh_weights(), [1, 2])
+        self.assertEqual(
+            graph.generate({'word': 'zero'}, shard=0), 'hello shard zero')
+        self.assertIsNone(graph.generate({'word': 'zero'}, None, shard=1))
+
+    def test_generate(self):
+        graph = self.graph
+        graph.learn(table('hello shard zero', jid=self.jids[0]))
+        graph.learn(table('bye shard one', jid=self.jids[1]))
+        self.assertEqual(
+            graph.generate({'jid': self.jids[1]}), 'bye shard one')
+        # falls back to the other shard.
+        for i in range(10):
+            self.assertEqual(
+                graph.generate({'word': 'zero'}), 'hello shard zero')
+            self.assertEqual(graph.generate({'word': 'bye'}), 'bye shard one')
+        self.assertEqual(
+            set(graph.generate({}) for i in range(30)),
+            {'hello shard zero', 'bye shard one'})
+        with self.assertRaises(KeyError):
+            graph.generate({'word': 'unknown'})
+        self.assertIsNone(graph.generate({'word': 'unknown'}, None))
+
+    def test_generate_deadline(self):
+        graph = self.graph
+        graph.learn(table('a b c d e', jid=self.jids[0]))
+        self.assertFalse(graph.generate({'word': 'c'}, deadline=60).truncated)
+        self.assertTrue(graph.generate({'word': 'c'}, deadline=0).truncated)
+        self.assertTrue(
+            graph.generate({'word': 'c'}, deadline=0, shard=0).truncated)
+        # the shard is never taken for the deadline.
+        with self.assertRaises(TypeError):
+            graph.generate({'word': 'c'}, None, 0, 0)
+
+    def test_weights_tracked(self):
+        graph = self.graph
+        graph.refresh_weights()
+        graph.learn(table('bye shard one', jid=self.jids[1]))
+        self.assertEqual(graph.weights, [0, 1])
+        # the empty shard is never picked.
+        self.assertEqual(graph.order_shards([0, 1]), [1])
+
+    def test_weights_failed_learn(self):
+        graph = self.graph
+        graph.refresh_weights()
+        sessions = self.shards[1]._Sessions
+        # force the learn of the shard to fail.
+        del self.shards[1]._Sessions
+        self.assertIsNotNone(graph.learn(table('bye', jid=self.jids[1])))
+        self.assertEqual(graph.weights, [0, 0])
+        self.shards[1]._Sessions = sessions
+        self.assertIsNone(graph.learn(table('bye', jid=self.jids[1])))
+        self.assertEqual(graph.weights, [0, 1])
+
+    def test_learn_unroutable(self):
+        graph = self.graph
+        graph.refresh_weights()
+        self.assertIsInstance(
+            graph.learn({sentence.Loader: 'hello'}), KeyError)
+        self.assertIsInstance(graph.learn({
+            sentence.Loader: 'hello', xmpp.Loader: {'muc': 'a@chat'},
+        }), KeyError)
+        self.assertEqual(graph.weights, [0, 0])
+
+    def test_vacuum(self):
+        self.graph.learn(table('hello', jid=self.jids[0]))
+        self.graph.vacuum()
+        self.assertEqual(self.graph.generate({}), 'hello')
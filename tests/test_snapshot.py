@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import unittest
+from random import Random
+from threading import Thread
+
+from sqlalchemy import text
+
+from mtj.markov.graph.sentence import SentenceGraph
+from mtj.markov.model import sentence
+
+
+class SnapshotTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+
+    def make_graph(self, snapshot):
+        graph = SentenceGraph(
+            'sqlite:///' + os.path.join(self.tempdir, 'graph.db'),
+            random=Random(0).random, snapshot=snapshot)
+        graph.initialize()
+        self.addCleanup(graph.engine.dispose)
+        self.addCleanup(graph.reset_snapshots)
+        return graph
+
+    def test_memory_unsupported(self):
+        graph = SentenceGraph(snapshot=1)
+        with self.assertRaises(ValueError):
+            graph.initialize()
+
+    def test_wal(self):
+        graph = self.make_graph(60)
+        with graph.engine.connect() as connection:
+            self.assertEqual(connection.execute(
+                text('PRAGMA journal_mode')).scalar(), 'wal')
+
+    def test_snapshot(self):
+        graph = self.make_graph(3600)
+        graph.learn({sentence.Loader: 'hello world'})
+        self.assertEqual(graph.generate({'word': 'hello'}), 'hello world')
+
+        # learned after the snapshot was taken.
+        graph.learn({sentence.Loader: 'goodbye world'})
+        self.assertIsNone(graph.generate({'word': 'goodbye'}, None))
+        self.assertEqual(
+            list(graph.generate_iter({'word': 'hello'})), ['hello', 'world'])
+
+        # other threads take their own snapshot.
+        results = []
+        thread = Thread(target=lambda: results.append(
+            graph.generate({'word': 'goodbye'}, None)))
+        thread.start()
+        thread.join()
+        self.assertEqual(results, ['goodbye world'])
+
+        graph.refresh_snapshot()
+        self.assertEqual(
+            graph.generate({'word': 'goodbye'}, None), 'goodbye world')
+
+    def test_snapshot_expired(self):
+        graph = self.make_graph(0)
+        graph.learn({sentence.Loader: 'hello world'})
+        self.assertEqual(graph.generate({'word': 'hello'}), 'hello world')
+        graph.learn({sentence.Loader: 'goodbye world'})
+        self.assertEqual(
+            graph.generate({'word': 'goodbye'}, None), 'goodbye world')
@@ -1,8 +1,15 @@
 # -*- coding: utf-8 -*-
 import unittest
+from random import Random
+from threading import Thread
 
+from mtj.markov.utils import BatchedRandom
+from mtj.markov.utils import BloomFilter
+from mtj.markov.utils import ThreadLocalRandom
 from mtj.markov.utils import nchain
 from mtj.markov.utils import pair
+from mtj.markov.utils import pack_ids
+from mtj.markov.utils import unpack_ids
 # unique_merge is tested under normal usage.
 
 
@@ -67,3 +74,91 @@ class NchainTestCase(unittest.TestCase):
     def test_3chain_four_items(self):
         results = list(nchain(4, ['a', 'b', 'c', 'd']))
         self.assertEqual(results, [('a', 'b', 'c', 'd')])
+
+
+class PackIdsTestCase(unittest.TestCase):
+
+    def test_pack_ids(self):
+        self.assertEqual(pack_ids([]), b'')
+        self.assertEqual(pack_ids([1, 256]), b'\1\0\0\0\0\1\0\0')
+
+    def test_unpack_ids(self):
+        self.assertEqual(list(unpack_ids(b'')), [])
+        self.assertEqual(list(unpack_ids(pack_ids([3, 2, 1]))), [3, 2, 1])
+
+
+class BloomFilterTestCase(unittest.TestCase):
+
+    def test_membership(self):
+        bloom = BloomFilter(100)
+        bloom.update(['hello', 'world', u'caf\xe9'])
+        self.assertIn('hello', bloom)
+        self.assertIn(u'caf\xe9', bloom)
+        self.assertNotIn('goodbye', bloom)
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(1000, error_rate=0.01)
+        bloom.update('word%d' % i for i in range(1000))
+        self.assertTrue(all('word%d' % i in bloom for i in range(1000)))
+        false_positives = sum(
+            'other%d' % i in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_saturated(self):
+        bloom = BloomFilter(2)
+        bloom.update(['a', 'b'])
+        self.assertFalse(bloom.saturated)
+        bloom.add('c')
+        self.assertTrue(bloom.saturated)
+
+
+class ThreadLocalRandomTestCase(unittest.TestCase):
+
+    def test_per_thread(self):
+        random = ThreadLocalRandom(lambda: Random(0).random)
+        results = []
+
+        def draw():
+            results.append([random() for i in range(3)])
+
+        draw()
+        thread = Thread(target=draw)
+        thread.start()
+        thread.join()
+        # each thread has its own generator from the same seed.
+        self.assertEqual(results[0], results[1])
+
+    def test_reseed(self):
+        random = ThreadLocalRandom(lambda: Random(0).random)
+        first = random()
+        self.assertNotEqual(random(), first)
+        random.reseed()
+        self.assertEqual(random(), first)
+
+
+class BatchedRandomTestCase(unittest.TestCase):
+
+    def test_same_sequence(self):
+        random = BatchedRandom(Random(1), size=4)
+        values = [random() for i in range(10)]
+        other = BatchedRandom(Random(1), size=4)
+        self.assertEqual([other() for i in range(10)], values)
+        self.assertTrue(all(0 <= value < 1 for value in values))
+        self.assertEqual(len(set(values)), 10)
+        self.assertEqual(len(random.batch), 4)
+
+    def test_bulk_draw(self):
+        source = Random(1)
+        random = BatchedRandom(Random(1), size=4)
+        random()
+        # the mantissas are the random bits of a single draw.
+        bits = source.getrandbits(256)
+        self.assertEqual(
+            [int((value - 1.0) * 2 ** 52) for value in random.batch],
+            [(bits >> (64 * i)) & ((1 << 52) - 1) for i in range(4)])
+
+    def test_urandom(self):
+        random = BatchedRandom(size=8)
+        values = [random() for i in range(20)]
+        self.assertTrue(all(0 <= value < 1 for value in values))
+        self.assertEqual(len(set(values)), 20)
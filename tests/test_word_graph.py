@@ -0,0 +1,142 @@
+import unittest
+from io import BytesIO
+from time import perf_counter
+
+from sqlalchemy import create_engine
+
+from mtj.markov.graph.word import WordGraph
+from mtj.markov.model import word
+
+from mtj.markov.testing import XorShift128
+
+
+class WordGraphTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.graph = WordGraph(random=XorShift128())
+        self.graph.initialize()
+
+    def test_learn(self):
+        graph = self.graph
+        self.assertEqual(graph.learn({word.Loader: 'Hello, "world" ...'}), 2)
+        self.assertEqual(graph.chars, ['', 'h', 'e', 'l', 'o', 'w', 'r', 'd'])
+        # the state before the first character is the boundaries.
+        state_id = graph.state_ids[(0, 0)]
+        start = state_id * graph.width
+        self.assertEqual(graph.counts[start + 1], 1)
+        self.assertEqual(graph.counts[start + 5], 1)
+        self.assertEqual(graph.totals[state_id], 2)
+        # 'l', 'l' is followed by 'o'.
+        state_id = graph.state_ids[(3, 3)]
+        self.assertEqual(graph.totals[state_id], 1)
+        self.assertEqual(graph.counts[state_id * graph.width + 4], 1)
+
+    def test_learn_missing(self):
+        self.assertIsNone(self.graph.learn({}))
+
+    def test_generate_empty(self):
+        with self.assertRaises(KeyError):
+            self.graph.generate({})
+        self.assertIsNone(self.graph.generate({}, None))
+
+    def test_generate(self):
+        graph = self.graph
+        graph.learn({word.Loader: 'hello'})
+        self.assertEqual(graph.generate({}), 'hello')
+        self.assertEqual(graph.generate({'prefix': 'he'}), 'hello')
+        self.assertEqual(graph.generate({'max_length': 3}), 'hel')
+        self.assertIsNone(graph.generate({'prefix': 'x'}, None))
+        self.assertIsNone(graph.generate({'prefix': 'lh'}, None))
+
+    def test_generate_learned(self):
+        graph = self.graph
+        words = ['kestrel', 'kettle', 'settle', 'nestle', 'trestle']
+        graph.learn({word.Loader: ' '.join(words)})
+        for i in range(100):
+            value = graph.generate({})
+            self.assertTrue(value)
+            self.assertLessEqual(len(value), graph.max_length)
+            # every trigram of the boundary padded word is learned.
+            padded = '^^' + value + '$'
+            for j in range(len(value) + 1):
+                self.assertTrue(any(
+                    padded[j:j + 3] in '^^' + w + '$' for w in words))
+
+    def test_widen(self):
+        graph = self.graph
+        graph.learn({word.Loader: 'ab'})
+        # more characters than the initial width of the counts.
+        graph.learn({word.Loader: ''.join(chr(0x4e00 + i) for i in range(40))})
+        self.assertEqual(graph.width, 64)
+        self.assertEqual(len(graph.counts), len(graph.totals) * 64)
+        self.assertEqual(graph.generate({'prefix': 'a'}), 'ab')
+        self.assertEqual(sum(graph.counts), sum(graph.totals))
+
+    def test_order(self):
+        with self.assertRaises(ValueError):
+            WordGraph(order=0)
+        graph = WordGraph(order=1, random=XorShift128())
+        graph.learn({word.Loader: 'abc'})
+        self.assertEqual(sorted(graph.state_ids), [(0,), (1,), (2,), (3,)])
+        self.assertEqual(graph.generate({}), 'abc')
+
+    def test_dump_load(self):
+        graph = self.graph
+        graph.learn({word.Loader: 'kestrel kettle settle'})
+        expected = [graph.generate({}) for i in range(20)]
+
+        stream = BytesIO()
+        graph.dump(stream)
+        stream.seek(0)
+        other = WordGraph(random=XorShift128())
+        other.load(stream)
+        self.assertEqual([other.generate({}) for i in range(20)], expected)
+
+    def test_save_restore(self):
+        graph = self.graph
+        graph.learn({word.Loader: 'kestrel kettle settle'})
+        engine = create_engine('sqlite://')
+        rows = graph.save(engine)
+        self.assertEqual(rows, sum(1 for count in graph.counts if count))
+        # saving again replaces the rows.
+        self.assertEqual(graph.save(engine), rows)
+
+        other = WordGraph(random=XorShift128())
+        other.restore(engine)
+        self.assertEqual(other.chars, graph.chars)
+        self.assertEqual(other.totals, graph.totals)
+        self.assertEqual(other.counts, graph.counts)
+        graph.random = XorShift128()
+        self.assertEqual(
+            [other.generate({}) for i in range(20)],
+            [graph.generate({}) for i in range(20)])
+
+        with self.assertRaises(ValueError):
+            WordGraph(order=3).restore(engine)
+
+    def test_save_existing_store(self):
+        from mtj.markov.graph.sentence import SentenceGraph
+        from mtj.markov.model import sentence
+        sentences = SentenceGraph()
+        sentences.initialize()
+        sentences.learn({sentence.Loader: 'hello world'})
+        graph = self.graph
+        graph.learn({word.Loader: 'hello world'})
+        graph.save(sentences.engine)
+
+        other = WordGraph(random=XorShift128())
+        other.restore(sentences.engine)
+        self.assertEqual(other.counts, graph.counts)
+        self.assertEqual(sentences.generate({'word': 'hello'}), 'hello world')
+
+    def test_throughput(self):
+        graph = WordGraph()
+        graph.learn({word.Loader: (
+            'kestrel kettle settle nestle trestle wrestle whistle thistle '
+            'bristle gristle castle tassel vessel')})
+        count = 2000
+        start = perf_counter()
+        for i in range(count):
+            graph.generate({})
+        # well under a millisecond each, with plenty of margin.
+        self.assertLess(perf_counter() - start, count * 0.001)
@@ -1,25 +1,21 @@
 import unittest
 
 from random import Random
+from sqlalchemy import select
 from sqlalchemy.orm.session import Session
 
-from mtj.markov.graph import sentence as graph_sentence
-from mtj.markov.graph import xmpp as graph_xmpp
+from mtj.markov.graph.base import Context
 from mtj.markov.graph.xmpp import XMPPGraph
 
 from mtj.markov.model import sentence
 from mtj.markov.model import xmpp
 
-from mtj.markov.testing.mocks import stub_module_random
-
 
 class XMPPTestCase(unittest.TestCase):
 
     def setUp(self):
-        self.engine = XMPPGraph()
+        self.engine = XMPPGraph(random=Random(0).random)
         self.engine.initialize()
-        stub_module_random(self, graph_sentence)
-        stub_module_random(self, graph_xmpp)
 
     def tearDown(self):
         pass
@@ -27,7 +23,7 @@ class XMPPTestCase(unittest.TestCase):
     def skip_random(self, n=1):
         # For skipping over unfavorable generated numbers.
         for i in range(n):
-            self._random_mod.random()
+            self.engine.random()
 
     def test_basic_generate(self):
         engine = self.engine
@@ -153,3 +149,188 @@ class XMPPTestCase(unittest.TestCase):
         #     ['room@chat.example.com'],
         # )
         # self.assertEqual(s.query(engine.classes['XMPPLog']).count(), 2)
+
+
+class XMPPDedupTestCase(unittest.TestCase):
+
+    def test_dedup_reference(self):
+        engine = XMPPGraph(dedup='ignore')
+        engine.initialize()
+        for jid in ('user1@example.com', 'user2@example.com'):
+            engine.learn({
+                sentence.Loader: '+1',
+                xmpp.Loader: {
+                    'muc': 'room@chat.example.com',
+                    'jid': jid,
+                    'nick': jid,
+                }
+            })
+
+        s = engine._sessions()
+        self.assertEqual(s.query(engine.Datum).count(), 1)
+        self.assertEqual(s.query(engine.Fragment).count(), 1)
+        self.assertEqual(s.query(engine.XMPPLog).count(), 2)
+        self.assertEqual(
+            set(i.sentence_id for i in s.query(engine.XMPPLog).all()), {1})
+        self.assertEqual(engine.generate({'jid': 'user2@example.com'}), '+1')
+
+
+def learn_logs(engine):
+    """
+    Learn the sentences of the logs of two mucs, at their timestamps.
+    """
+
+    logs = (
+        ('room1@chat.example.com', 'user1@example.com', 'Alice', 100,
+            'the quick fox jumped'),
+        ('room1@chat.example.com', 'user2@example.com', 'Bob', 200,
+            'the lazy dog slept'),
+        ('room2@chat.example.com', 'user1@example.com', 'Alice', 300,
+            'the red hen clucked'),
+        ('room2@chat.example.com', 'user1@example.com', 'Ally', 400,
+            'the old cow mooed'),
+    )
+    for muc, jid, nick, timestamp, text in logs:
+        engine.learn({
+            sentence.Loader: text,
+            xmpp.Loader: {'muc': muc, 'jid': jid, 'nick': nick},
+        })
+    s = engine._sessions()
+    for i, log in enumerate(logs, 1):
+        s.query(engine.Sentence).filter(
+            engine.Sentence.id == i).update({'timestamp': log[3]})
+    s.commit()
+
+
+class XMPPScopeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = XMPPGraph()
+        self.engine.initialize()
+        learn_logs(self.engine)
+
+    def generate_all(self, data):
+        return set(self.engine.generate(data) for i in range(50))
+
+    def test_random_quote(self):
+        engine = self.engine
+        self.assertEqual(
+            engine.random_quote({'jid': 'user2@example.com'}),
+            'the lazy dog slept')
+        self.assertEqual(
+            set(engine.random_quote({'muc': 'room2@chat.example.com'})
+                for i in range(30)),
+            {'the red hen clucked', 'the old cow mooed'})
+        self.assertIsNone(
+            engine.random_quote({'jid': 'user3@example.com'}, None))
+
+    def test_muc(self):
+        self.assertEqual(self.generate_all({
+            'muc': 'room1@chat.example.com', 'word': 'the'}), {
+            'the quick fox jumped', 'the lazy dog slept'})
+
+    def test_nickname(self):
+        self.assertEqual(self.generate_all({
+            'nickname': 'Ally'}), {'the old cow mooed'})
+
+    def test_muc_jid(self):
+        self.assertEqual(self.generate_all({
+            'muc': 'room2@chat.example.com', 'jid': 'user1@example.com',
+            'nickname': 'Alice'}), {'the red hen clucked'})
+
+    def test_since_until(self):
+        self.assertEqual(self.generate_all({
+            'since': 200, 'until': 400}), {
+            'the lazy dog slept', 'the red hen clucked'})
+        self.assertEqual(self.generate_all({
+            'jid': 'user1@example.com', 'since': 200}), {
+            'the red hen clucked', 'the old cow mooed'})
+
+    def test_scope_empty(self):
+        engine = self.engine
+        self.assertIsNone(engine.generate(
+            {'muc': 'room3@chat.example.com'}, default=None))
+        self.assertIsNone(engine.generate(
+            {'nickname': 'Bob', 'word': 'hen'}, default=None))
+        self.assertIsNone(engine.generate({'until': 100}, default=None))
+
+    def test_scope_indexed(self):
+        engine = self.engine
+        s = engine._sessions()
+        statement = engine.scope({
+            'muc': 'room1@chat.example.com', 'since': 100})
+        plan = ' '.join(str(row[-1]) for row in s.execute(
+            'EXPLAIN QUERY PLAN ' + str(statement.compile(
+                compile_kwargs={'literal_binds': True}))))
+        self.assertIn('idx_xmpp_log_muc_sentence', plan)
+
+    def test_scope_condition_correlated(self):
+        engine = self.engine
+        s = engine._sessions()
+        context = Context(s, {})
+        context.sentence_ids = engine.scope({'jid': 'user1@example.com'})
+        Fragment = engine.Fragment
+        statement = select([Fragment.id]).where(
+            (Fragment.tenant_id == 0) & (Fragment.word_id == 1) &
+            (Fragment.l_word_id == 1) &
+            engine.scope_condition(Fragment, context))
+        plan = ' '.join(str(row[-1]) for row in s.execute(
+            'EXPLAIN QUERY PLAN ' + str(statement.compile(
+                compile_kwargs={'literal_binds': True}))))
+        # every candidate of a hop is checked by its sentence, rather than
+        # listing the whole scope.
+        self.assertNotIn('LIST SUBQUERY', plan)
+        self.assertIn('jid_id=? AND sentence_id=?', plan)
+
+
+class XMPPStatsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = XMPPGraph()
+        self.engine.initialize()
+        learn_logs(self.engine)
+
+    def test_vocabulary(self):
+        engine = self.engine
+        self.assertEqual(engine.vocabulary('jid'), [
+            ('user1@example.com', 10), ('user2@example.com', 4)])
+        self.assertEqual(engine.vocabulary('muc', limit=1), [
+            ('room1@chat.example.com', 7)])
+        self.assertEqual(
+            engine.vocabulary_size('jid', 'user2@example.com'), 4)
+        self.assertEqual(
+            engine.vocabulary_size('muc', 'room3@chat.example.com'), 0)
+
+        # repeated words are not counted again.
+        engine.learn({
+            sentence.Loader: 'The quick, quick dog',
+            xmpp.Loader: {
+                'muc': 'room1@chat.example.com', 'jid': 'user2@example.com',
+                'nick': 'Bob'},
+        })
+        self.assertEqual(
+            engine.vocabulary_size('jid', 'user2@example.com'), 5)
+
+    def test_stats(self):
+        stats = self.engine.stats()
+        self.assertEqual(stats['tables']['fragment']['rows'], 16)
+        self.assertEqual(stats['transitions'], 16)
+        self.assertEqual(stats['branching']['lr'], {
+            'states': 13, 'mean': 16 / 13, 'max': 4})
+        self.assertEqual(stats['branching']['rl'], {
+            'states': 16, 'mean': 1.0, 'max': 1})
+        self.assertEqual(stats['top_words'][0], ('the', 4))
+        self.assertEqual(stats['vocabulary'], {
+            'jid': {'count': 2, 'mean': 7.0, 'max': 10},
+            'muc': {'count': 2, 'mean': 7.0, 'max': 7},
+        })
+
+        # cached until refreshed.
+        self.engine.learn({
+            sentence.Loader: 'hello',
+            xmpp.Loader: {
+                'muc': 'room1@chat.example.com', 'jid': 'user2@example.com',
+                'nick': 'Bob'},
+        })
+        self.assertIs(self.engine.stats(), stats)
+        self.assertEqual(self.engine.stats(refresh=True)['transitions'], 17)